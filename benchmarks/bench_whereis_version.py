@@ -0,0 +1,107 @@
+"""
+Benchmark ManifestsChecker.whereis_version against a local stand-in for raw.githubusercontent.com
+serving NUM_ENVIRONMENTS manifests with an artificial per-request latency.
+
+usage: GITHUB_TOKEN=meh python benchmarks/bench_whereis_version.py [num_envs] [latency_ms]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GITHUB_TOKEN", "meh")
+os.environ.setdefault("LOGLEVEL", "WARNING")
+
+from qabot.lib.httplib import HttpCache, HttpLib  # noqa: E402
+from qabot.manifests_checker import ManifestsChecker  # noqa: E402
+
+NUM_ENVIRONMENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+LATENCY_MS = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+ENVIRONMENTS = [f"env-{i}.planx-pla.net" for i in range(NUM_ENVIRONMENTS)]
+
+
+class ManifestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(LATENCY_MS / 1000)
+        # /cdis-manifest/master/env-N.planx-pla.net/manifest.json
+        env_number = int(self.path.split("/")[3].split(".")[0].split("-")[1])
+        release = "2024.05" if env_number % 3 == 0 else "2024.04"
+        body = json.dumps(
+            {
+                "versions": {
+                    "fence": f"quay.io/cdis/fence:{release}",
+                    "indexd": f"quay.io/cdis/indexd:{release}",
+                    "sheepdog": f"quay.io/cdis/sheepdog:{release}",
+                }
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def sequential_whereis_version(checker, version):
+    """the pre-crawler implementation: one manifest at a time"""
+    count = 0
+    for env in ENVIRONMENTS:
+        manifest = checker.httplib.fetch_json(
+            f"{checker.raw_base_url}/cdis-manifest/master/{env}/manifest.json"
+        )
+        if manifest["versions"]["sheepdog"].split(":")[-1] == version:
+            count += 1
+    return count
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ManifestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    raw_base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    # no repo archive: the index is built by crawling the manifests one by one
+    snapshotlib = Mock(name="SnapshotLibMock")
+    snapshotlib.get_snapshot.side_effect = Exception("no archive")
+    with patch.object(
+        ManifestsChecker,
+        "_get_directories_from_repo",
+        lambda self, repo, ref=None: ENVIRONMENTS,
+    ), patch.object(
+        ManifestsChecker, "_get_head_sha", lambda self, repo: "master"
+    ), patch.object(
+        ManifestsChecker, "get_snapshotlib", lambda self: snapshotlib
+    ), patch.object(
+        ManifestsChecker, "get_httplib", lambda self: HttpLib(HttpCache())
+    ):
+        checker = ManifestsChecker(raw_base_url=raw_base_url)
+
+        started_at = time.perf_counter()
+        sequential_whereis_version(checker, "2024.05")
+        sequential_time = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        checker.whereis_version("release", "2024.05")
+        concurrent_time = time.perf_counter() - started_at
+
+    server.shutdown()
+    print(
+        f"whereis_version over {NUM_ENVIRONMENTS} environments ({LATENCY_MS}ms latency per manifest):"
+    )
+    print(f"  sequential: {sequential_time:.2f}s")
+    print(f"  concurrent: {concurrent_time:.2f}s")
+    print(f"  speedup:    {sequential_time / concurrent_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,18 @@
 import logging
 import os
+import signal
+import sys
+import time
 import traceback
 
+BOOT_STARTED_AT = time.perf_counter()
+
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_bolt.app import App
 
-from qabot.env_maintenance import EnvMaintenance
-from qabot.greeter import Greeter
-from qabot.manifests_checker import ManifestsChecker
-from qabot.pipeline_maintenance import PipelineMaintenance
-from qabot.release import ReleaseManager
-from qabot.state_of_the_nation import StateOfTheNation
+from qabot.ci_stats import get_ci_stats, save_ci_stats, start_ci_stats_snapshots
+from qabot.command_registry import CommandRegistry, get_max_rss_mb
+from qabot.executor import CommandExecutor
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
@@ -19,6 +21,7 @@ SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN").strip("\n")
 SLACK_APP_TOKEN = os.environ.get("SLACK_APP_TOKEN").strip("\n")
 
 app = App(token=SLACK_BOT_TOKEN)
+executor = CommandExecutor()
 
 
 def list_all_commands():
@@ -28,83 +31,122 @@ def list_all_commands():
     )
 
 
-commands_map = {
-    "help": {
-        "args": "",
-        "example": "@qa-bot help",
-        "call": list_all_commands,
-        "pass_thread_ts": False,
-    },
-    "roll": {
-        "args": "service to roll, ci_environment_name",
-        "example": "@qa-bot roll guppy jenkins-brain",
-        "call": EnvMaintenance().roll_service,
-        "pass_thread_ts": False,
-    },
-    "replay-nightly-run": {
-        "args": "comma-separated list of labels",
-        "example": "@qa-bot replay-nightly-run test-portal-homepageTest,test-apis-dataUploadTest",
-        "call": PipelineMaintenance().replay_nightly_run,
-        "pass_thread_ts": False,
-    },
-    "replay-nightly-run-gen3ff": {
-        "args": "comma-separated list of labels",
-        "example": "@qa-bot replay-nightly-run-gen3ff test-portal-homepageTest,test-apis-dataUploadTest",
-        "call": PipelineMaintenance().replay_nightly_run_gen3ff,
-        "pass_thread_ts": False,
-    },
-    "replay-pr": {
-        "args": "repo name, pr number, comma-separated list of labels",
-        "example": "@qa-bot replay-pr gen3-qa 549 test-portal-homepageTest,test-apis-dataUploadTest",
-        "call": PipelineMaintenance().replay_pr,
-        "pass_thread_ts": False,
-    },
-    "self-service-release": {
-        "args": "github username of environment's owner",
-        "example": "@qa-bot self-service-release ac3eb",
-        "call": ReleaseManager().roll_out_latest_gen3_release_to_environments,
-        "pass_thread_ts": True,
-    },
-    "quarantine-ci-environment": {
-        "args": "ci_environment_name",
-        "example": "jenkins-brain",
-        "call": PipelineMaintenance().quarantine_ci_env,
-        "pass_thread_ts": False,
-    },
-    "unquarantine-ci-environment": {
-        "args": "ci_environment_name",
-        "example": "jenkins-brain",
-        "call": PipelineMaintenance().unquarantine_ci_env,
-        "pass_thread_ts": False,
-    },
-    "scaleup-namespace": {
-        "args": "ci_environment_name",
-        "example": "jenkins-brain",
-        "call": EnvMaintenance().scaleup_namespace,
-        "pass_thread_ts": False,
-    },
-    "run-gen3-job": {
-        "args": "gen3_job_name, env_name",
-        "example": "@qa-bot run-gen3-job usersync jenkins-brain",
-        "call": EnvMaintenance().run_gen3_job,
-        "pass_thread_ts": False,
-    },
-    "test-external-pr": {
-        "args": "repo_name, pr_num",
-        "example": "@qa-bot test-external-pr fence 123",
-        "call": PipelineMaintenance().test_external_pr,
-        "pass_thread_ts": False,
-    },
-    "hello": {
-        "args": "",
-        "example": "@qa-bot hello",
-        "call": Greeter().say_hello,
-        "pass_thread_ts": False,
-    },
-}
-
-
-def process_command(command, args, thread_ts=None):
+commands_map = CommandRegistry(
+    {
+        "help": {
+            "args": "",
+            "example": "@qa-bot help",
+            "handler": list_all_commands,
+            "pass_thread_ts": False,
+            "max_concurrency": 8,
+            "timeout": 10,
+            "ack": False,
+        },
+        "roll": {
+            "args": "service to roll, ci_environment_name",
+            "example": "@qa-bot roll guppy jenkins-brain",
+            "handler": "qabot.env_maintenance.EnvMaintenance.roll_service",
+            "pass_thread_ts": False,
+            "max_concurrency": 2,
+            "timeout": 900,
+            "ack": True,
+        },
+        "replay-nightly-run": {
+            "args": "comma-separated list of labels",
+            "example": "@qa-bot replay-nightly-run test-portal-homepageTest,test-apis-dataUploadTest",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.replay_nightly_run",
+            "pass_thread_ts": False,
+            "max_concurrency": 4,
+            "timeout": 120,
+            "ack": True,
+        },
+        "replay-nightly-run-gen3ff": {
+            "args": "comma-separated list of labels",
+            "example": "@qa-bot replay-nightly-run-gen3ff test-portal-homepageTest,test-apis-dataUploadTest",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.replay_nightly_run_gen3ff",
+            "pass_thread_ts": False,
+            "max_concurrency": 4,
+            "timeout": 120,
+            "ack": True,
+        },
+        "replay-pr": {
+            "args": "repo name, pr number, comma-separated list of labels",
+            "example": "@qa-bot replay-pr gen3-qa 549 test-portal-homepageTest,test-apis-dataUploadTest",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.replay_pr",
+            "pass_thread_ts": False,
+            "max_concurrency": 4,
+            "timeout": 180,
+            "ack": True,
+        },
+        "self-service-release": {
+            "args": "github username of environment's owner (comma-separated usernames or `all` for a batch release)",
+            "example": "@qa-bot self-service-release ac3eb,gkuffel",
+            "handler": "qabot.release.ReleaseManager.roll_out_latest_gen3_release_to_environments",
+            "pass_thread_ts": True,
+            "max_concurrency": 2,
+            "timeout": 300,
+            "ack": True,
+        },
+        "quarantine-ci-environment": {
+            "args": "ci_environment_name",
+            "example": "jenkins-brain",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.quarantine_ci_env",
+            "pass_thread_ts": False,
+            "max_concurrency": 2,
+            "timeout": 120,
+            "ack": True,
+        },
+        "unquarantine-ci-environment": {
+            "args": "ci_environment_name",
+            "example": "jenkins-brain",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.unquarantine_ci_env",
+            "pass_thread_ts": False,
+            "max_concurrency": 2,
+            "timeout": 120,
+            "ack": True,
+        },
+        "scaleup-namespace": {
+            "args": "ci_environment_name",
+            "example": "jenkins-brain",
+            "handler": "qabot.env_maintenance.EnvMaintenance.scaleup_namespace",
+            "pass_thread_ts": False,
+            "max_concurrency": 1,
+            "timeout": 1200,
+            "ack": True,
+        },
+        "run-gen3-job": {
+            "args": "gen3_job_name, env_name",
+            "example": "@qa-bot run-gen3-job usersync jenkins-brain",
+            "handler": "qabot.env_maintenance.EnvMaintenance.run_gen3_job",
+            "pass_thread_ts": False,
+            "max_concurrency": 2,
+            "timeout": 900,
+            "ack": True,
+        },
+        "test-external-pr": {
+            "args": "repo_name, pr_num",
+            "example": "@qa-bot test-external-pr fence 123",
+            "handler": "qabot.pipeline_maintenance.PipelineMaintenance.test_external_pr",
+            "pass_thread_ts": False,
+            "pass_reply": True,
+            "max_concurrency": 2,
+            "timeout": 180,
+            "ack": True,
+        },
+        "hello": {
+            "args": "",
+            "example": "@qa-bot hello",
+            "handler": "qabot.greeter.Greeter.say_hello",
+            "pass_thread_ts": False,
+            "max_concurrency": 8,
+            "timeout": 10,
+            "ack": False,
+        },
+    }
+)
+
+
+def process_command(command, args, thread_ts=None, reply=None):
     log.info(f"command = {command}, args = {args}")
     # process args to handle whitespaces inside json blocks
     entered_json_block_at_index = None
@@ -130,10 +172,15 @@ example:  {commands_map[command]['example']}
       """
         else:
             try:
+                handler = commands_map.resolve(command)
+                kwargs = {}
+                if commands_map[command].get("pass_reply"):
+                    # lets long-running commands post follow-ups in the thread
+                    kwargs["reply"] = reply
                 if commands_map[command]["pass_thread_ts"]:
-                    return commands_map[command]["call"](*args, thread_ts)
+                    return handler(*args, thread_ts, **kwargs)
                 else:
-                    return commands_map[command]["call"](*args)
+                    return handler(*args, **kwargs)
             except TypeError as te:
                 return str(te)
             except Exception as e:
@@ -144,6 +191,37 @@ example:  {commands_map[command]['example']}
         return "command not recognized. :thisisfine:"
 
 
+def dispatch_command(command, args, thread_ts, user, say):
+    """
+    Acknowledge the command in the thread and run it on its own execution lane
+    so the Socket Mode handler thread is released right away
+    """
+
+    def reply(result):
+        say(text=f"<@{user}> {result}", thread_ts=thread_ts)
+
+    if command not in commands_map.keys():
+        reply(process_command(command, args, thread_ts))
+        return
+
+    command_spec = commands_map[command]
+    if command_spec["ack"]:
+        in_flight = executor.in_flight(command)
+        if in_flight >= command_spec["max_concurrency"]:
+            reply(
+                f"working on it... :hourglass_flowing_sand: (queued behind {in_flight} other `{command}` command(s))"
+            )
+        else:
+            reply("working on it... :hourglass_flowing_sand:")
+    executor.submit(
+        command,
+        lambda: process_command(command, args, thread_ts, reply),
+        reply,
+        max_concurrency=command_spec["max_concurrency"],
+        timeout=command_spec["timeout"],
+    )
+
+
 @app.event("app_mention")
 def handle_app_mention(payload, say, logger):
     logger.info(payload)
@@ -159,11 +237,8 @@ def handle_app_mention(payload, say, logger):
         if len(msg_parts) > 1:
             command = msg_parts[1]
             args = msg_parts[2:]
-            thread_ts = (payload.get("thread_ts") or payload.get("ts"),)
-            say(
-                text=f"<@{payload['user']}> {process_command(command, args, thread_ts)}",
-                thread_ts=thread_ts,
-            )
+            thread_ts = payload.get("thread_ts") or payload.get("ts")
+            dispatch_command(command, args, thread_ts, payload["user"], say)
     else:
         usage_msg = """
 # Usage instructions: *@qa-bot <command>* \n
@@ -178,8 +253,26 @@ def handle_app_mention(payload, say, logger):
 
 @app.event("message")
 def handle_message_events(body, say, logger):
+    # TODO: hand the Jenkins notifications over to PipelineMaintenance.react_to_jenkins_updates
+    # (replying in the thread of the Jenkins message) once it can collect the CI results,
+    # it relies on fetch_ci_failures and ci_benchmarking which are not implemented yet
     logger.info(body)
 
 
+def handle_sigterm(signum, frame):
+    log.info("SIGTERM received, saving the CI stats before shutting down...")
+    save_ci_stats()
+    sys.exit(0)
+
+
 if __name__ == "__main__":
+    # warm restart: pick up the CI stats where the previous process left them
+    get_ci_stats()
+    start_ci_stats_snapshots()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    log.info(
+        f"qa-bot booted in {time.perf_counter() - BOOT_STARTED_AT:.2f}s "
+        f"with {len(commands_map.keys())} commands registered "
+        f"(max RSS: {get_max_rss_mb()} MB)"
+    )
     SocketModeHandler(app, SLACK_APP_TOKEN).start()
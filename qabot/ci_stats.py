@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+CI_STATS_BUCKET_SECONDS = 3600
+# how far back (in hours) the CI stats go, 7 days by default
+CI_STATS_WINDOW_HOURS = int(os.environ.get("QABOT_CI_STATS_WINDOW_HOURS", "168"))
+RESULTS = ("failed", "successful")
+# where (and how often, in seconds) the CI stats are snapshotted so they survive restarts
+CI_STATS_SNAPSHOT_PATH = os.environ.get("QABOT_CI_STATS_SNAPSHOT")
+CI_STATS_SNAPSHOT_INTERVAL = int(
+    os.environ.get("QABOT_CI_STATS_SNAPSHOT_INTERVAL", "300")
+)
+
+
+class CIStats:
+    """
+    Sliding window of CI results (pass / fail counts per repo and PR).
+    Results are counted in a ring buffer of time buckets (1 hour each by default):
+    recording a result only touches the bucket of its timestamp, and a bucket is
+    recycled as soon as the window moves past it, so memory stays bounded
+    by the size of the window and there's no reset at midnight.
+    """
+
+    def __init__(
+        self,
+        window_hours=CI_STATS_WINDOW_HOURS,
+        bucket_seconds=CI_STATS_BUCKET_SECONDS,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, window_hours * 3600 // bucket_seconds)
+        # each slot holds (bucket number, Counter of (repo, pr, result))
+        self._slots = [(None, Counter()) for _ in range(self.num_buckets)]
+        self._lock = threading.Lock()
+        # number of results recorded since the last snapshot
+        self._unsaved = 0
+
+    def _bucket_of(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def record(self, timestamp, repo_name, pr_number, result):
+        """count one CI `result` ("failed" or "successful") of a PR at `timestamp` (epoch seconds)"""
+        bucket = self._bucket_of(timestamp)
+        slot = bucket % self.num_buckets
+        with self._lock:
+            slot_bucket, counts = self._slots[slot]
+            if slot_bucket != bucket:
+                if slot_bucket is not None and slot_bucket > bucket:
+                    log.debug(
+                        f"ignoring CI result older than the stats window: {timestamp}"
+                    )
+                    return
+                # the window moved past this slot, recycle it
+                counts = Counter()
+                self._slots[slot] = (bucket, counts)
+            counts[(repo_name, str(pr_number), result)] += 1
+            self._unsaved += 1
+
+    def pr_totals(self, hours, now=None):
+        """{(repo, pr): {"failed": n, "successful": m}} over the last `hours` hours"""
+        now_bucket = self._bucket_of(now if now is not None else time.time())
+        oldest_bucket = now_bucket - hours * 3600 // self.bucket_seconds + 1
+        totals = {}
+        with self._lock:
+            for bucket, counts in self._slots:
+                if bucket is None or not oldest_bucket <= bucket <= now_bucket:
+                    continue
+                for (repo_name, pr_number, result), count in counts.items():
+                    pr_totals = totals.setdefault(
+                        (repo_name, pr_number), dict.fromkeys(RESULTS, 0)
+                    )
+                    pr_totals[result] += count
+        return totals
+
+    def repo_totals(self, hours, now=None):
+        """{repo: {"failed": n, "successful": m}} over the last `hours` hours"""
+        totals = {}
+        for (repo_name, _), pr_totals in self.pr_totals(hours, now).items():
+            repo_totals = totals.setdefault(repo_name, dict.fromkeys(RESULTS, 0))
+            for result in RESULTS:
+                repo_totals[result] += pr_totals[result]
+        return totals
+
+    def to_dict(self):
+        """compact representation of the non-empty buckets"""
+        with self._lock:
+            return {
+                "bucket_seconds": self.bucket_seconds,
+                "buckets": [
+                    [bucket, [[*key, count] for key, count in counts.items()]]
+                    for bucket, counts in self._slots
+                    if bucket is not None and counts
+                ],
+            }
+
+    def save(self, path):
+        """snapshot the stats to `path` (atomically), unless nothing changed since the last one"""
+        if not self._unsaved and os.path.exists(path):
+            return
+        started_at = time.perf_counter()
+        with self._lock:
+            unsaved = self._unsaved
+        data = self.to_dict()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        with self._lock:
+            self._unsaved -= unsaved
+        log.info(
+            f"Saved a snapshot of the CI stats ({len(data['buckets'])} buckets, "
+            f"{os.path.getsize(path)} bytes) to {path} in {time.perf_counter() - started_at:.3f}s"
+        )
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        restore the stats from a snapshot (buckets that fell out of the window are dropped
+        as soon as their slot is reused), or start empty if there's no usable snapshot
+        """
+        stats = cls(**kwargs)
+        if not path or not os.path.exists(path):
+            return stats
+        started_at = time.perf_counter()
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data["bucket_seconds"] != stats.bucket_seconds:
+                raise ValueError(
+                    f"bucket size changed ({data['bucket_seconds']}s -> {stats.bucket_seconds}s)"
+                )
+            # oldest first, so the most recent bucket wins when two of them share a slot
+            for bucket, entries in sorted(data["buckets"], key=lambda b: b[0]):
+                counts = Counter(
+                    {(repo, pr, result): count for repo, pr, result, count in entries}
+                )
+                stats._slots[bucket % stats.num_buckets] = (bucket, counts)
+        except (OSError, ValueError, KeyError, TypeError) as err:
+            log.warning(f"Ignoring unreadable CI stats snapshot {path}: {err}")
+            return cls(**kwargs)
+        log.info(
+            f"Loaded a snapshot of the CI stats ({len(data['buckets'])} buckets, "
+            f"{os.path.getsize(path)} bytes) from {path} in {time.perf_counter() - started_at:.3f}s"
+        )
+        return stats
+
+
+_ci_stats = None
+_ci_stats_lock = threading.Lock()
+
+
+def get_ci_stats():
+    """Return the process-wide CIStats, restored from the last snapshot (if any)"""
+    global _ci_stats
+    with _ci_stats_lock:
+        if _ci_stats is None:
+            _ci_stats = CIStats.load(CI_STATS_SNAPSHOT_PATH)
+        return _ci_stats
+
+
+def save_ci_stats():
+    """Snapshot the process-wide CIStats (if snapshots are enabled)"""
+    if not CI_STATS_SNAPSHOT_PATH:
+        return
+    try:
+        get_ci_stats().save(CI_STATS_SNAPSHOT_PATH)
+    except OSError as err:
+        log.error(f"could not save the CI stats to {CI_STATS_SNAPSHOT_PATH}: {err}")
+
+
+def start_ci_stats_snapshots(interval=CI_STATS_SNAPSHOT_INTERVAL):
+    """Snapshot the process-wide CIStats every `interval` seconds from a background thread"""
+    if not CI_STATS_SNAPSHOT_PATH:
+        log.info("QABOT_CI_STATS_SNAPSHOT is not set, CI stats won't survive restarts")
+        return None
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            save_ci_stats()
+
+    threading.Thread(target=run, name="qabot-ci-stats-snapshots", daemon=True).start()
+    return stopped
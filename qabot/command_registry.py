@@ -0,0 +1,69 @@
+import importlib
+import logging
+import os
+import threading
+import time
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+
+class CommandRegistry:
+    """
+    Maps qa-bot commands to their metadata (args, example, limits, etc.) and handlers.
+    Handlers are declared by dotted path (e.g., "qabot.env_maintenance.EnvMaintenance.roll_service")
+    so the handler class and the client libraries it depends on are only imported
+    and instantiated the first time the command is invoked.
+    """
+
+    def __init__(self, commands):
+        self._commands = commands
+        self._instances = {}
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, command):
+        return command in self._commands
+
+    def __getitem__(self, command):
+        return self._commands[command]
+
+    def keys(self):
+        return self._commands.keys()
+
+    def loaded_handlers(self):
+        return list(self._handlers.keys())
+
+    def _get_instance(self, module_name, class_name):
+        class_path = f"{module_name}.{class_name}"
+        if class_path not in self._instances:
+            started_at = time.perf_counter()
+            module = importlib.import_module(module_name)
+            self._instances[class_path] = getattr(module, class_name)()
+            log.info(f"Loaded {class_path} in {time.perf_counter() - started_at:.2f}s")
+        return self._instances[class_path]
+
+    def resolve(self, command):
+        """
+        Return the callable behind a command, importing and building its handler on first use
+        """
+        handler = self._commands[command]["handler"]
+        if callable(handler):
+            return handler
+        with self._lock:
+            if command not in self._handlers:
+                # "package.module.Class.method" -> "package.module", "Class", "method"
+                module_name, class_name, method_name = handler.rsplit(".", 2)
+                instance = self._get_instance(module_name, class_name)
+                self._handlers[command] = getattr(instance, method_name)
+            return self._handlers[command]
+
+
+def get_max_rss_mb():
+    """Peak resident memory of the current process in MB (None if unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is reported in KB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
@@ -4,16 +4,45 @@ import random
 import string
 import subprocess
 
+import requests
+
+from qabot.lib.k8slib import KubernetesError, get_k8slib
+
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
 
 class EnvMaintenance:
+    def get_k8slib(self):
+        return get_k8slib()
+
     def roll_service(self, service_name: str, env_name: str):
         """
         Roll a service in one of our gen3 environments
         """
         log.info(f"Running roll-service on {env_name}")
+        try:
+            k8slib = self.get_k8slib()
+        except KubernetesError as e:
+            log.error(e)
+            return f"Failed to roll service(s) on {env_name}, please try again or contact QA team"
+        if k8slib:
+            if service_name.upper() == "ALL":
+                deployment_name = None
+                msg = f"All services have been rolled on {env_name}. :awesome-face:"
+            else:
+                if service_name not in ["sower", "ssjdispatcher"]:
+                    deployment_name = f"{service_name}-deployment"
+                else:
+                    deployment_name = service_name
+                msg = f"The service {service_name} has been rolled on {env_name}. :awesome-face:"
+            try:
+                k8slib.rollout_restart(env_name, deployment_name)
+                k8slib.rollout_status(env_name, deployment_name)
+                return msg
+            except (KubernetesError, requests.exceptions.RequestException) as e:
+                log.info(e)
+                return f"Failed to roll service(s) on {env_name}, please try again or contact QA team"
         try:
             # Sets commands and messages when all services need to be restarted
             if service_name.upper() == "ALL":
@@ -78,6 +107,12 @@ class EnvMaintenance:
         Scaleup the given namespace in gen3 environments
         """
         log.info(f"Running scaleup-namespace on {env_name}")
+        failure_msg = f"Failed to scaleup namespace {env_name}, please try again or contact QA team"
+        try:
+            k8slib = self.get_k8slib()
+        except KubernetesError as e:
+            log.error(e)
+            return failure_msg
         script_path = "/src/qabot/scripts/scaleup-namespace.sh"
         try:
             os.chmod(script_path, 0o755)
@@ -94,6 +129,17 @@ class EnvMaintenance:
                 input="yes\n",
             )
             log.info(f"Output from command when scaling up namespace: {result.stdout}")
+        except subprocess.CalledProcessError as e:
+            log.info(e.stderr)
+            return failure_msg
+        if k8slib:
+            try:
+                k8slib.rollout_status(env_name)
+                return f"Namespace {env_name} has been scaled up. :rocket:"
+            except (KubernetesError, requests.exceptions.RequestException) as e:
+                log.info(e)
+                return failure_msg
+        try:
             command = [
                 "kubectl",
                 "rollout",
@@ -109,20 +155,34 @@ class EnvMaintenance:
             return f"Namespace {env_name} has been scaled up. :rocket:"
         except subprocess.CalledProcessError as e:
             log.info(e.stderr)
-            return f"Failed to scaleup namespace {env_name}, please try again or contact QA team"
+            return failure_msg
 
     def run_gen3_job(self, job_name, env_name):
         """
         Run gen3 job in the given namespace in gen3 environments
         """
         log.info(f"Running run-gen3-job on {env_name}")
+        cronjob_name = job_name
+        if job_name == "etl":
+            cronjob_name = "etl-cronjob"
+        job_name += "-" + "".join(
+            random.choices(string.ascii_lowercase + string.digits, k=4)
+        )
+        failure_msg = f"Failed to execute {job_name} in namespace {env_name}, please try again or contact QA team"
+        try:
+            k8slib = self.get_k8slib()
+        except KubernetesError as e:
+            log.error(e)
+            return failure_msg
+        if k8slib:
+            try:
+                k8slib.create_job_from_cronjob(env_name, cronjob_name, job_name)
+                k8slib.wait_for_job(env_name, job_name)
+                return f"Job {job_name} executed and completed on {env_name}. :checkered_flag:"
+            except (KubernetesError, requests.exceptions.RequestException) as e:
+                log.info(e)
+                return failure_msg
         try:
-            cronjob_name = job_name
-            if job_name == "etl":
-                cronjob_name = "etl-cronjob"
-            job_name += "-" + "".join(
-                random.choices(string.ascii_lowercase + string.digits, k=4)
-            )
             command = [
                 "kubectl",
                 "create",
@@ -154,7 +214,7 @@ class EnvMaintenance:
             )
         except subprocess.CalledProcessError as e:
             log.info(e.stderr)
-            return f"Failed to execute {job_name} in namespace {env_name}, please try again or contact QA team"
+            return failure_msg
 
 
 if __name__ == "__main__":
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 2
+DEFAULT_TIMEOUT = 300
+
+
+class CommandExecutor:
+    """
+    Runs qa-bot commands away from the Slack event handler thread.
+    Each command gets its own bounded lane (thread pool), so slow commands
+    (e.g., run-gen3-job) cannot starve cheap ones (e.g., help or hello).
+    """
+
+    def __init__(
+        self,
+        default_max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        default_timeout=DEFAULT_TIMEOUT,
+    ):
+        self.default_max_concurrency = default_max_concurrency
+        self.default_timeout = default_timeout
+        self._lanes = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _get_lane(self, command, max_concurrency):
+        with self._lock:
+            if command not in self._lanes:
+                log.info(
+                    f"Creating execution lane for {command} with {max_concurrency} worker(s)"
+                )
+                self._lanes[command] = ThreadPoolExecutor(
+                    max_workers=max_concurrency,
+                    thread_name_prefix=f"qabot-{command}",
+                )
+                self._in_flight[command] = 0
+            return self._lanes[command]
+
+    def in_flight(self, command):
+        """Number of executions of `command` that are either running or queued"""
+        with self._lock:
+            return self._in_flight.get(command, 0)
+
+    def submit(self, command, func, on_done, max_concurrency=None, timeout=None):
+        """
+        Queue `func` on the lane of `command` and call `on_done` with its result.
+        If the command does not finish within `timeout` seconds of starting, `on_done` is called
+        with a timeout message instead and the late result is only logged
+        (python threads cannot be killed, so the lane slot stays busy until it returns).
+        """
+        max_concurrency = max_concurrency or self.default_max_concurrency
+        timeout = timeout or self.default_timeout
+        lane = self._get_lane(command, max_concurrency)
+
+        delivered = threading.Event()
+
+        def deliver(result):
+            # whichever comes first (result or timeout) wins
+            with self._lock:
+                if delivered.is_set():
+                    return False
+                delivered.set()
+            try:
+                on_done(result)
+            except Exception as e:
+                log.error(f"Failed to deliver the result of {command}: {e}")
+                traceback.print_exc()
+            return True
+
+        def run():
+            # the timeout only starts ticking once a worker picks the command up
+            timer.start()
+            try:
+                return func()
+            finally:
+                with self._lock:
+                    self._in_flight[command] -= 1
+
+        def on_timeout():
+            log.warning(f"Command {command} did not finish within {timeout}s")
+            deliver(
+                f"`{command}` is taking longer than {timeout}s, I'm giving up on waiting for it. :hourglass:"
+            )
+
+        def on_complete(future):
+            timer.cancel()
+            if future.cancelled():
+                log.warning(f"Command {command} was cancelled before it could run")
+                return
+            error = future.exception()
+            if error is not None:
+                log.error(f"Command {command} failed: {error}")
+                result = "Something went wrong. Contact the QA team"
+            else:
+                result = future.result()
+            if not deliver(result):
+                log.warning(
+                    f"Dropping late result of {command} (timed out after {timeout}s): {result}"
+                )
+
+        with self._lock:
+            self._in_flight[command] += 1
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        future = lane.submit(run)
+        future.add_done_callback(on_complete)
+        return future
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            lanes = list(self._lanes.values())
+        for lane in lanes:
+            lane.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,62 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = int(os.environ.get("QABOT_CRAWLER_MAX_WORKERS", "32"))
+DEFAULT_PER_HOST_LIMIT = int(os.environ.get("QABOT_CRAWLER_PER_HOST_LIMIT", "16"))
+
+
+class Crawler:
+    """
+    Fetches many urls concurrently with bounded parallelism (overall and per host)
+    and streams the results back as they arrive.
+    A failure to fetch one url is reported alongside its result instead of aborting the crawl.
+    """
+
+    def __init__(
+        self, max_workers=DEFAULT_MAX_WORKERS, per_host_limit=DEFAULT_PER_HOST_LIMIT
+    ):
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_host_semaphore(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                    self.per_host_limit
+                )
+            return self._host_semaphores[host]
+
+    def _fetch(self, fetch, url):
+        with self._get_host_semaphore(url):
+            return fetch(url)
+
+    def crawl(self, urls, fetch):
+        """
+        Call `fetch(url)` for every url and yield `(url, result, error)` tuples in completion order.
+        `error` is None when the fetch succeeded.
+        """
+        urls = list(urls)
+        if not urls:
+            return
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(urls)),
+            thread_name_prefix="qabot-crawler",
+        ) as pool:
+            futures = {pool.submit(self._fetch, fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                error = future.exception()
+                if error is not None:
+                    log.warning(f"failed to fetch {url}: {error}")
+                    yield url, None, error
+                else:
+                    yield url, future.result(), None
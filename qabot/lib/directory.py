@@ -0,0 +1,168 @@
+import abc
+import logging
+import os
+import threading
+import time
+
+from qabot.lib.scheduler import get_scheduler
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# how long (in seconds) a lookup may wait for a directory that was never loaded
+INITIAL_LOAD_WAIT = float(os.environ.get("QABOT_DIRECTORY_INITIAL_LOAD_WAIT", "10"))
+
+
+class Directory(abc.ABC):
+    """
+    In-memory copy of a paginated collection of an API (e.g., the users of Jira or Slack)
+    indexed by several keys for O(1) lookups.
+    The directory is refreshed in the background every `ttl` seconds: pages are applied
+    as they arrive (entries whose version did not change are skipped) and entries that are
+    gone are dropped at the end of a complete pass. Lookups only read memory, they never
+    wait for the API unless the directory was never loaded.
+
+    Subclasses implement `fetch_pages`, `entry_id` and `index_keys`
+    (and optionally `entry_version` and `normalize_key`).
+    """
+
+    name = "directory"
+
+    def __init__(self, ttl, scheduler=None):
+        self.ttl = ttl
+        self.scheduler = scheduler or get_scheduler()
+        self.refreshed_at = None
+        self.loaded = threading.Event()
+        self._entries = {}
+        self._versions = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._started = False
+
+    @abc.abstractmethod
+    def fetch_pages(self):
+        """yield the entries of the collection, one page (list) at a time"""
+
+    @abc.abstractmethod
+    def entry_id(self, entry):
+        pass
+
+    @abc.abstractmethod
+    def index_keys(self, entry):
+        """{index name: [keys]} an entry can be looked up by"""
+
+    def entry_version(self, entry):
+        """entries with the same id and version are not re-indexed (None = always re-index)"""
+        return None
+
+    def normalize_key(self, index, key):
+        return key
+
+    def _remove(self, entry_id):
+        # must be called with the lock held
+        entry = self._entries.pop(entry_id, None)
+        self._versions.pop(entry_id, None)
+        if entry is None:
+            return
+        for index, keys in self.index_keys(entry).items():
+            for key in keys:
+                key = self.normalize_key(index, key)
+                if self._indexes.get(index, {}).get(key) == entry_id:
+                    del self._indexes[index][key]
+
+    def _apply(self, page):
+        """index a page of entries, return (ids seen, number of entries (re-)indexed)"""
+        seen, changed = set(), 0
+        with self._lock:
+            for entry in page:
+                entry_id = self.entry_id(entry)
+                seen.add(entry_id)
+                version = self.entry_version(entry)
+                if (
+                    version is not None
+                    and entry_id in self._entries
+                    and self._versions.get(entry_id) == version
+                ):
+                    continue
+                self._remove(entry_id)
+                self._entries[entry_id] = entry
+                self._versions[entry_id] = version
+                for index, keys in self.index_keys(entry).items():
+                    for key in keys:
+                        if key:
+                            self._indexes.setdefault(index, {})[
+                                self.normalize_key(index, key)
+                            ] = entry_id
+                changed += 1
+        return seen, changed
+
+    def refresh(self):
+        """page through the whole collection and bring the indexes up to date"""
+        if not self._refresh_lock.acquire(blocking=False):
+            log.debug(f"{self.name} is already being refreshed")
+            return
+        try:
+            started_at = time.perf_counter()
+            seen, changed, pages = set(), 0, 0
+            for page in self.fetch_pages():
+                page_seen, page_changed = self._apply(page)
+                seen |= page_seen
+                changed += page_changed
+                pages += 1
+                # a partial directory is better than none
+                self.loaded.set()
+            with self._lock:
+                for entry_id in set(self._entries) - seen:
+                    self._remove(entry_id)
+                size = len(self._entries)
+            self.refreshed_at = time.monotonic()
+            self.loaded.set()
+            log.info(
+                f"Refreshed the {self.name} ({size} entries, {changed} updated) "
+                f"from {pages} page(s) in {time.perf_counter() - started_at:.2f}s"
+            )
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh_periodically(self):
+        try:
+            self.refresh()
+        except Exception as err:
+            log.error(f"could not refresh the {self.name}: {err}")
+        finally:
+            self.scheduler.call_later(
+                self.ttl, self._refresh_periodically, key=("directory", id(self))
+            )
+
+    def start(self):
+        """start refreshing the directory in the background (idempotent)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self.scheduler.call_later(
+            0, self._refresh_periodically, key=("directory", id(self))
+        )
+
+    def wait_until_loaded(self, timeout=INITIAL_LOAD_WAIT):
+        """start the directory and wait (up to `timeout` seconds) for its first page"""
+        self.start()
+        if not self.loaded.is_set() and timeout:
+            log.info(f"waiting for the {self.name} to be loaded...")
+            self.loaded.wait(timeout)
+        return self.loaded.is_set()
+
+    def lookup(self, index, key, wait=INITIAL_LOAD_WAIT):
+        """
+        return the entry with `key` in `index`, or None.
+        Several lookups in a row should call `wait_until_loaded` once and pass wait=0
+        """
+        self.wait_until_loaded(wait)
+        with self._lock:
+            entry_id = self._indexes.get(index, {}).get(self.normalize_key(index, key))
+            return self._entries.get(entry_id) if entry_id is not None else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
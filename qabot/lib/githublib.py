@@ -1,15 +1,120 @@
-import json
 import logging
 import os
+import re
+import threading
 import time
+from collections import OrderedDict
 
-import requests
 from github import Github
-from github.GithubException import GithubException
+from requests.exceptions import RequestException
+
+from qabot.lib import transport
+from qabot.lib.waiter import get_resource_waiter
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# how long authenticated clients / repo handles and PR objects are reused (in seconds)
+REPO_HANDLE_TTL = int(os.environ.get("QABOT_GITHUB_REPO_HANDLE_TTL", "1800"))
+PULL_REQUEST_TTL = int(os.environ.get("QABOT_GITHUB_PULL_REQUEST_TTL", "60"))
+
+# process-wide caches shared by every GithubLib instance
+_clients = {}
+_repo_handles = {}
+_pull_requests = {}
+_cache_lock = threading.Lock()
+
+INTEGRATION_TESTS_WORKFLOW = "Integration Tests"
+# (org, repo, workflow name) -> workflow id
+_workflow_ids = {}
+# (org, repo, workflow id, head sha) -> most recent workflow run id
+_runs_by_head_sha = OrderedDict()
+MAX_INDEXED_RUNS = 4096
+
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"
+# "graphql" batches PR / file / label lookups into cursor-paged GraphQL queries,
+# "rest" sticks to the REST API (which is also the fallback when a GraphQL query fails)
+GITHUB_BACKEND = os.environ.get("QABOT_GITHUB_BACKEND", "graphql").lower()
+GRAPHQL_PAGE_SIZE = 100
+# REST "state" filter -> GraphQL PullRequestState values
+GRAPHQL_PR_STATES = {
+    "open": ["OPEN"],
+    "closed": ["CLOSED", "MERGED"],
+    "all": ["OPEN", "CLOSED", "MERGED"],
+}
+
+PULL_REQUESTS_QUERY = """
+query($owner: String!, $name: String!, $states: [PullRequestState!], $first: Int!, $after: String, $numFiles: Int!) {
+  repository(owner: $owner, name: $name) {
+    pullRequests(states: $states, first: $first, after: $after, orderBy: {field: UPDATED_AT, direction: DESC}) {
+      pageInfo { hasNextPage endCursor }
+      nodes {
+        number title url state mergedAt updatedAt headRefOid mergeable
+        labels(first: 20) { nodes { name } }
+        files(first: $numFiles) { nodes { path } }
+      }
+    }
+  }
+  rateLimit { cost remaining }
+}
+"""
+
+PULL_REQUEST_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $first: Int!, $after: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      number title url state mergedAt updatedAt headRefOid mergeable
+      labels(first: 100) { nodes { name } }
+      files(first: $first, after: $after) {
+        pageInfo { hasNextPage endCursor }
+        nodes { path }
+      }
+    }
+  }
+  rateLimit { cost remaining }
+}
+"""
+
+
+class GithubGraphQLError(Exception):
+    pass
+
+
+def clear_github_cache():
+    """Drop all cached clients, repo handles and PR objects"""
+    with _cache_lock:
+        _clients.clear()
+        _repo_handles.clear()
+        _pull_requests.clear()
+        _workflow_ids.clear()
+        _runs_by_head_sha.clear()
+
+
+def _pull_request_from_graphql(node):
+    """convert a GraphQL PullRequest node to the shape of the REST API pull request objects"""
+    return {
+        "number": node["number"],
+        "title": node["title"],
+        "html_url": node["url"],
+        "state": "open" if node["state"] == "OPEN" else "closed",
+        "merged_at": node["mergedAt"],
+        "updated_at": node["updatedAt"],
+        "head": {"sha": node["headRefOid"]},
+        "mergeable": node.get("mergeable"),
+        "labels": [{"name": label["name"]} for label in node["labels"]["nodes"]],
+        "files": [file["path"] for file in node["files"]["nodes"]],
+    }
+
+
+def log_api_usage(backend, operation, requests, cost=None, remaining=None):
+    """log how many requests (and how much rate-limit) an operation consumed"""
+    message = f"github {backend} {operation}: {requests} request(s)"
+    if cost is not None:
+        message += f", rate-limit cost {cost}"
+    if remaining is not None:
+        message += f" ({remaining} remaining)"
+    log.info(message)
+
 
 class GithubLib:
     def __init__(
@@ -25,63 +130,380 @@ class GithubLib:
         self.repo = repo
         self.token = token
 
+    def _get_authenticated_client(self):
+        with _cache_lock:
+            if self.token not in _clients:
+                _clients[self.token] = Github(
+                    self.token,
+                    timeout=transport.get_timeout("https://api.github.com")[1],
+                    retry=transport.get_retry_strategy(),
+                    pool_size=transport.POOL_MAXSIZE,
+                )
+            return _clients[self.token]
+
     def get_github_client(self):
         """
         return a github client object that can instrument a given repo
+        (repo handles are cached per (org, repo) and refreshed after REPO_HANDLE_TTL seconds)
         """
-        g = Github(self.token)
-        org = g.get_organization(self.org)
-        repo = org.get_repo(self.repo)
+        key = (self.token, self.org, self.repo)
+        with _cache_lock:
+            cached = _repo_handles.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        log.debug(f"resolving repo handle for {self.org}/{self.repo}")
+        repo = self._get_authenticated_client().get_repo(f"{self.org}/{self.repo}")
+        with _cache_lock:
+            _repo_handles[key] = (repo, time.monotonic() + REPO_HANDLE_TTL)
         return repo
 
+    def _is_pull_cached(self, pr_number):
+        key = (self.token, self.org, self.repo, int(pr_number))
+        with _cache_lock:
+            cached = _pull_requests.get(key)
+        return bool(cached and cached[1] > time.monotonic())
+
+    def get_pull(self, pr_number):
+        """
+        return a (briefly cached) PullRequest object, so a sequence of operations
+        against the same PR (e.g., labeling + replaying) only fetches it once
+        """
+        key = (self.token, self.org, self.repo, int(pr_number))
+        with _cache_lock:
+            cached = _pull_requests.get(key)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        pr = self.get_github_client().get_pull(int(pr_number))
+        with _cache_lock:
+            _pull_requests[key] = (pr, time.monotonic() + PULL_REQUEST_TTL)
+        return pr
+
+    def use_graphql(self):
+        return GITHUB_BACKEND == "graphql"
+
+    def graphql(self, query, variables=None, usage=None):
+        """
+        run a GraphQL query and return its `data`.
+        `usage` (if given) accumulates the number of requests and the rate-limit cost
+        """
+        response = transport.post(
+            GITHUB_GRAPHQL_URL,
+            headers=self._get_api_headers(),
+            json={"query": query, "variables": variables or {}},
+        )
+        if usage is not None:
+            usage["requests"] += 1
+        response.raise_for_status()
+        body = response.json()
+        if body.get("errors"):
+            raise GithubGraphQLError(
+                "; ".join(error.get("message", "") for error in body["errors"])
+            )
+        data = body.get("data") or {}
+        rate_limit = data.get("rateLimit") or {}
+        if usage is not None and rate_limit:
+            usage["cost"] += rate_limit.get("cost", 0)
+            usage["remaining"] = rate_limit.get("remaining")
+        return data
+
+    def _graphql_pages(self, query, variables, connection_path, usage):
+        """
+        run a query page by page following the cursor of the connection at `connection_path`,
+        yield `(data, connection)` for every page
+        """
+        after = None
+        while True:
+            data = self.graphql(query, dict(variables, after=after), usage)
+            connection = data
+            for field in connection_path:
+                connection = connection.get(field) if connection else None
+            if connection is None:
+                raise GithubGraphQLError(
+                    f"{'.'.join(connection_path)} not found in {self.org}/{self.repo}"
+                )
+            yield data, connection
+            page_info = connection["pageInfo"]
+            if not page_info["hasNextPage"]:
+                return
+            after = page_info["endCursor"]
+
+    def get_pull_requests_with_files(
+        self, state="open", limit=50, num_files=1, updated_since=None
+    ):
+        """
+        list the `limit` most recently updated PRs (REST-like objects) with their labels,
+        head SHA, merge state and first `num_files` files in as few GraphQL requests as possible.
+        With `updated_since`, paging stops at the first PR that was not updated after
+        that timestamp.
+        """
+        usage = {"requests": 0, "cost": 0, "remaining": None}
+        variables = {
+            "owner": self.org,
+            "name": self.repo,
+            "states": GRAPHQL_PR_STATES[state],
+            "first": min(limit, GRAPHQL_PAGE_SIZE),
+            "numFiles": num_files,
+        }
+        pull_requests = []
+        try:
+            for _, connection in self._graphql_pages(
+                PULL_REQUESTS_QUERY,
+                variables,
+                ("repository", "pullRequests"),
+                usage,
+            ):
+                page = [_pull_request_from_graphql(n) for n in connection["nodes"]]
+                if updated_since:
+                    recent = [pr for pr in page if pr["updated_at"] >= updated_since]
+                    pull_requests += recent
+                    if len(recent) < len(page):
+                        break
+                else:
+                    pull_requests += page
+                if len(pull_requests) >= limit:
+                    break
+        finally:
+            log_api_usage("graphql", "pull requests with files", **usage)
+        return pull_requests[:limit]
+
+    def get_pull_request_details(self, pr_number, until_file=None, num_files=None):
+        """
+        return a REST-like PR object with its labels, head SHA, merge state and files.
+        Files are paged until one of them contains `until_file`, `num_files` were listed
+        or there are no more files.
+        """
+        usage = {"requests": 0, "cost": 0, "remaining": None}
+        variables = {
+            "owner": self.org,
+            "name": self.repo,
+            "number": int(pr_number),
+            "first": min(num_files or GRAPHQL_PAGE_SIZE, GRAPHQL_PAGE_SIZE),
+        }
+        pr = None
+        try:
+            for data, connection in self._graphql_pages(
+                PULL_REQUEST_QUERY,
+                variables,
+                ("repository", "pullRequest", "files"),
+                usage,
+            ):
+                page = _pull_request_from_graphql(data["repository"]["pullRequest"])
+                if pr is None:
+                    pr = page
+                else:
+                    pr["files"] += page["files"]
+                if until_file and any(until_file in f for f in page["files"]):
+                    break
+                if num_files and len(pr["files"]) >= num_files:
+                    break
+        finally:
+            log_api_usage("graphql", f"pull request #{pr_number}", **usage)
+        return pr
+
     def get_file_raw_url(self, pr_number, filename):
-        pr = self.get_github_client().get_pull(pr_number)
-        for file in pr.get_files():
-            if filename in file.filename:
-                return file.raw_url
+        if self.use_graphql():
+            try:
+                pr = self.get_pull_request_details(pr_number, until_file=filename)
+                for path in pr["files"]:
+                    if filename in path:
+                        return f"https://raw.githubusercontent.com/{self.org}/{self.repo}/{pr['head']['sha']}/{path}"
+                raise Exception(
+                    "Could not find {} among the files of PR #{}".format(
+                        filename, pr_number
+                    )
+                )
+            except (GithubGraphQLError, RequestException) as err:
+                log.warning(f"GraphQL lookup failed, falling back to REST: {err}")
+
+        requests = 0 if self._is_pull_cached(pr_number) else 1
+        pr = self.get_pull(pr_number)
+        try:
+            for i, file in enumerate(pr.get_files()):
+                # the REST API lists 30 files per page
+                if i % 30 == 0:
+                    requests += 1
+                if filename in file.filename:
+                    return file.raw_url
+        finally:
+            log_api_usage("rest", f"pull request #{pr_number} files", requests)
         raise Exception(
             "Could not find {} among the files of PR #{}".format(filename, pr_number)
         )
 
-    def list_files_in_dir(self, dir):
+    def list_files_in_dir(self, dir, ref=None):
         ghc = self.get_github_client()
-        content_files = ghc.get_dir_contents(dir)
+        content_files = (
+            ghc.get_dir_contents(dir, ref=ref) if ref else ghc.get_dir_contents(dir)
+        )
         # This content_files list contains something like:
         # [ContentFile(path="releases/2020"), ContentFile(path="releases/2021")]
         # hence, obtain the path and keep only the name of the last folder
         files = [f.path.split("/")[-1] for f in content_files]
         return files
 
+    def get_head_sha(self, branch="master"):
+        """
+        return the SHA of the latest commit of a branch
+        """
+        return self.get_github_client().get_branch(branch).commit.sha
+
+    def get_file_changes(self, base_sha, head_sha):
+        """
+        return {path: status ("added", "modified", "removed", ...)} for the files changed
+        between two commits, or None if the diff is too large for the compare API to list every file
+        """
+        comparison = self.get_github_client().compare(base_sha, head_sha)
+        changes = {f.filename: f.status for f in comparison.files}
+        # the compare API lists at most 300 files
+        if len(changes) >= 300:
+            return None
+        return changes
+
+    def get_changed_files(self, base_sha, head_sha):
+        """
+        return the paths of the files changed between two commits,
+        or None if the diff is too large for the compare API to list every file
+        """
+        changes = self.get_file_changes(base_sha, head_sha)
+        return list(changes) if changes is not None else None
+
     def set_label_to_pr(self, pr_number, label, override_all=False):
-        pr = self.get_github_client().get_pull(pr_number)
+        pr = self.get_pull(pr_number)
         if override_all:
             pr.set_labels(label)
         else:
             pr.add_to_labels(label)
 
-    def replay_pr(self, pr_number):
-        gh_client = self.get_github_client()
-        pr = gh_client.get_pull(int(pr_number))
-        head_sha = pr.head.sha
-        workflow_runs = gh_client.get_workflow_runs()
-        target_run = None
-        for run in workflow_runs:
-            if run.name == "Integration Tests" and run.head_sha == head_sha:
-                target_run = run
-                break
-        if target_run:
-            log.info(f"Latest 'Tests' workflow run ID: {target_run.id}")
+    def set_labels_to_pr(self, pr_number, labels):
+        """
+        replace all the labels of a PR with the given list in a single API call
+        """
+        self.get_pull(pr_number).set_labels(*labels)
+
+    def _get_api_headers(self):
+        return {
+            "Authorization": f"token {self.token}",
+            "Accept": "application/vnd.github+json",
+        }
+
+    def get_workflow_id(self, workflow_name):
+        """
+        resolve (and cache) the id of a workflow based on its name
+        """
+        key = (self.org, self.repo, workflow_name)
+        with _cache_lock:
+            if key in _workflow_ids:
+                return _workflow_ids[key]
+        url = f"https://api.github.com/repos/{self.org}/{self.repo}/actions/workflows"
+        response = transport.get(
+            url, headers=self._get_api_headers(), params={"per_page": 100}
+        )
+        response.raise_for_status()
+        with _cache_lock:
+            for workflow in response.json().get("workflows", []):
+                _workflow_ids[(self.org, self.repo, workflow["name"])] = workflow["id"]
+            return _workflow_ids.get(key)
+
+    def index_workflow_runs(self, runs):
+        """
+        remember the most recent run id of each (workflow, head sha) pair.
+        `runs` are workflow run objects as returned by the REST API
+        """
+        with _cache_lock:
+            # the API lists the most recent runs first, index them oldest first
+            # so the most recent run of a given head sha wins
+            for run in reversed(runs):
+                key = (self.org, self.repo, run["workflow_id"], run["head_sha"])
+                _runs_by_head_sha[key] = run["id"]
+                _runs_by_head_sha.move_to_end(key)
+            while len(_runs_by_head_sha) > MAX_INDEXED_RUNS:
+                _runs_by_head_sha.popitem(last=False)
+
+    def index_workflow_run(self, run_id, workflow_id, head_sha):
+        """remember a run we just acted upon (e.g., re-ran) without fetching it"""
+        self.index_workflow_runs(
+            [{"id": run_id, "workflow_id": workflow_id, "head_sha": head_sha}]
+        )
+
+    def find_workflow_run_id(
+        self, workflow_name, head_sha, branch=None, event=None, status=None
+    ):
+        """
+        find the most recent run of a workflow for a given commit using server-side filters
+        (one request, or zero if the run has already been indexed)
+        """
+        workflow_id = self.get_workflow_id(workflow_name)
+        if workflow_id is None:
+            log.warning(f"could not find workflow {workflow_name} in {self.repo}")
+            return None
+        key = (self.org, self.repo, workflow_id, head_sha)
+        with _cache_lock:
+            if key in _runs_by_head_sha:
+                return _runs_by_head_sha[key]
+
+        params = {"head_sha": head_sha, "per_page": 10}
+        if branch:
+            params["branch"] = branch
+        if event:
+            params["event"] = event
+        if status:
+            params["status"] = status
+        url = f"https://api.github.com/repos/{self.org}/{self.repo}/actions/workflows/{workflow_id}/runs"
+        response = transport.get(url, headers=self._get_api_headers(), params=params)
+        response.raise_for_status()
+        runs = response.json().get("workflow_runs", [])
+        self.index_workflow_runs(runs)
+        with _cache_lock:
+            return _runs_by_head_sha.get(key)
+
+    def rerun_workflow_run(self, run_id, workflow_id=None, head_sha=None):
+        """
+        re-run a workflow run. A re-run keeps its run id, so when the workflow and head sha
+        are known the run stays indexed as the most recent one of that commit
+        """
+        url = f"https://api.github.com/repos/{self.org}/{self.repo}/actions/runs/{run_id}/rerun"
+        response = transport.post(url, headers=self._get_api_headers())
+        if response.status_code == 201 and workflow_id and head_sha:
+            self.index_workflow_run(run_id, workflow_id, head_sha)
+        return response
+
+    def get_pr_head_sha(self, pr_number):
+        """
+        return the head SHA of a PR, reusing the PR object if it was just fetched
+        (e.g., to set its labels) and a single GraphQL query otherwise
+        """
+        if self.use_graphql() and not self._is_pull_cached(pr_number):
             try:
-                target_run.rerun()
-                rerun_url = f"https://github.com/{self.org}/{self.repo}/actions/runs/{target_run.id}"
+                pr = self.get_pull_request_details(pr_number, num_files=1)
+                return pr["head"]["sha"]
+            except (GithubGraphQLError, RequestException) as err:
+                log.warning(f"GraphQL lookup failed, falling back to REST: {err}")
+        requests = 0 if self._is_pull_cached(pr_number) else 1
+        log_api_usage("rest", f"pull request #{pr_number}", requests)
+        return self.get_pull(pr_number).head.sha
+
+    def replay_pr(self, pr_number):
+        head_sha = self.get_pr_head_sha(pr_number)
+        target_run_id = self.find_workflow_run_id(INTEGRATION_TESTS_WORKFLOW, head_sha)
+        if target_run_id:
+            log.info(f"Latest 'Tests' workflow run ID: {target_run_id}")
+            response = self.rerun_workflow_run(
+                target_run_id,
+                workflow_id=self.get_workflow_id(INTEGRATION_TESTS_WORKFLOW),
+                head_sha=head_sha,
+            )
+            if response.status_code == 201:
+                rerun_url = f"https://github.com/{self.org}/{self.repo}/actions/runs/{target_run_id}"
                 return f"Your PR has been labeled and replayed successfully :tada: \n Czech it out :muscle: {rerun_url}"
-            except GithubException as e:
-                log.error(e.data)
+            else:
+                log.error(response.text)
                 return "Failed to replay the PR :sadcat:, please try from Github directly :pray:"
         else:
             return "No `Integration Tests` workflow run found for this PR :thinking:"
 
     def trigger_gh_action_workflow(self, workflow_repo, workflow_filename, ref, inputs):
+        # the dispatch API answers 204 without the run it creates (asynchronously),
+        # so there is nothing to index here: the run is indexed when it is first listed
         url = f"https://api.github.com/repos/{self.org}/{workflow_repo}/actions/workflows/{workflow_filename}/dispatches"
         headers = {
             "Authorization": f"token {self.token}",
@@ -90,22 +512,68 @@ class GithubLib:
         payload = {"ref": ref}
         if inputs:
             payload["inputs"] = inputs
-        response = requests.post(url, headers=headers, json=payload)
+        response = transport.post(url, headers=headers, json=payload)
         return response
 
-    def get_external_pr_number(self, repo_name, search_title):
-        for i in range(6):
-            time.sleep(10)
-            headers = {
-                "Authorization": f"token {self.token}",
-                "Accept": "application/vnd.github+json",
-            }
-            url = f"https://api.github.com/search/issues?q={search_title}+in:title+repo:{self.org}/{repo_name}+type:pr"
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            items = response.json().get("items", [])
-            if not items:
-                continue
-            pr = items[0]
-            return pr["html_url"]
-        return False
+    def _search_prs_by_title(self, repo_name, search_title):
+        """
+        list the PRs of a repo with `search_title` in their title (most recently updated first)
+        with a single search query
+        """
+        url = "https://api.github.com/search/issues"
+        params = {
+            "q": f'"{search_title}" in:title repo:{self.org}/{repo_name} type:pr',
+            "sort": "updated",
+            "order": "desc",
+        }
+        response = transport.get(url, headers=self._get_api_headers(), params=params)
+        response.raise_for_status()
+        return response.json().get("items", [])
+
+    def wait_for_external_pr(
+        self, repo_name, search_title, on_found, on_timeout, deadline=120
+    ):
+        """
+        call `on_found(pr_html_url)` as soon as a PR with `search_title` in its title shows up
+        in `repo_name` (or `on_timeout()` after `deadline` seconds) without blocking the caller.
+        Concurrent waiters on the same repo + title share the same search poll.
+        """
+        title_regex = re.compile(rf"\b{re.escape(str(search_title))}\b")
+
+        def match(items):
+            # the search also matches titles that only contain the same words
+            for pr in items:
+                if title_regex.search(pr["title"]):
+                    return pr["html_url"]
+            return None
+
+        get_resource_waiter().wait_for(
+            key=("external-pr", self.org, repo_name, str(search_title)),
+            poll=lambda: self._search_prs_by_title(repo_name, search_title),
+            match=match,
+            on_found=on_found,
+            on_timeout=on_timeout,
+            deadline=deadline,
+        )
+
+    def get_external_pr_number(self, repo_name, search_title, deadline=60):
+        """
+        blocking version of wait_for_external_pr, returns the PR url or False
+        (never blocks longer than `deadline`, even if the shared poll falls behind)
+        """
+        result = {"url": False}
+        done = threading.Event()
+
+        def on_found(url):
+            result["url"] = url
+            done.set()
+
+        self.wait_for_external_pr(
+            repo_name, search_title, on_found, done.set, deadline=deadline
+        )
+        if not done.wait(timeout=deadline):
+            log.warning(
+                f"gave up waiting for a PR matching {search_title} in {repo_name} after {deadline}s"
+            )
+            return False
+        return result["url"]
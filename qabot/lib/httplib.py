@@ -1,18 +1,207 @@
 import requests
+import hashlib
 import json
 import logging
 import os
+import threading
+from collections import OrderedDict
+
+from qabot.lib import transport
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# log the cache counters every N lookups
+CACHE_STATS_LOG_INTERVAL = 100
+
+
+class HttpCache:
+    """
+    LRU cache of GET response bodies + validators (ETag / Last-Modified) keyed by url.
+    Cached entries are always revalidated with a conditional GET, a 304 is served from memory.
+    When `cache_dir` is set, entries are also written to disk so a restarted pod starts warm.
+    The disk copy is bounded like the memory one: evicted entries are deleted from disk too.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._prune_disk()
+
+    def _disk_path(self, url):
+        return os.path.join(
+            self.cache_dir, hashlib.sha256(url.encode()).hexdigest() + ".json"
+        )
+
+    def _load_from_disk(self, url):
+        try:
+            with open(self._disk_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("url") == url else None
+
+    def _write_to_disk(self, entry):
+        path = self._disk_path(entry["url"])
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(entry, f)
+            os.replace(path + ".tmp", path)
+        except OSError as err:
+            log.warning(f"could not persist cache entry for {entry['url']}: {err}")
+
+    def _remove_from_disk(self, urls):
+        for url in urls:
+            try:
+                os.remove(self._disk_path(url))
+            except FileNotFoundError:
+                pass
+            except OSError as err:
+                log.warning(f"could not remove cache entry for {url}: {err}")
+
+    def _prune_disk(self):
+        """keep the most recently written files of a previous run, up to max_bytes"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = 0
+        for _, size, path in sorted(files, reverse=True):
+            total += size
+            if total > self.max_bytes:
+                try:
+                    os.remove(path)
+                except OSError as err:
+                    log.warning(f"could not remove cache file {path}: {err}")
+
+    def _store(self, entry):
+        """
+        must be called with the lock held.
+        Returns the urls of the evicted entries, to remove from disk once the lock is released
+        """
+        old_entry = self._entries.pop(entry["url"], None)
+        if old_entry:
+            self._size -= len(old_entry["body"])
+        self._entries[entry["url"]] = entry
+        self._size += len(entry["body"])
+        evicted_urls = []
+        while self._size > self.max_bytes and len(self._entries) > 1:
+            url, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted["body"])
+            evicted_urls.append(url)
+        return evicted_urls
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+                return entry
+        if self.cache_dir:
+            entry = self._load_from_disk(url)
+            if entry:
+                with self._lock:
+                    evicted_urls = self._store(entry)
+                self._remove_from_disk(evicted_urls)
+                return entry
+        return None
+
+    def put(self, url, body, etag=None, last_modified=None):
+        entry = {
+            "url": url,
+            "body": body,
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+        with self._lock:
+            evicted_urls = self._store(entry)
+        if self.cache_dir:
+            self._write_to_disk(entry)
+            self._remove_from_disk(evicted_urls)
+        return entry
+
+    def record(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            lookups = self.hits + self.misses
+        if outcome != "revalidations" and lookups % CACHE_STATS_LOG_INTERVAL == 0:
+            log.info(f"HTTP cache stats: {self.stats()}")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+
+_shared_cache = HttpCache(cache_dir=os.environ.get("QABOT_HTTP_CACHE_DIR"))
+
 
 class HttpLib:
+    def __init__(self, cache=None):
+        self.cache = cache or _shared_cache
+
+    def cache_stats(self):
+        return self.cache.stats()
+
+    def _conditional_get(self, url):
+        """
+        GET a url through the response cache.
+        Returns a (body, etag) tuple; the body comes from the cache when the server answers 304.
+        """
+        entry = self.cache.get(url)
+        headers = {}
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        if headers:
+            self.cache.record("revalidations")
+        response = transport.get(url, headers=headers)
+        if response.status_code == 304 and entry:
+            log.debug(f"serving {url} from cache (etag: {entry['etag']})")
+            self.cache.record("hits")
+            return entry["body"], entry["etag"]
+        response.raise_for_status()
+        self.cache.record("misses")
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self.cache.put(url, response.text, etag, last_modified)
+        return response.text, etag
+
+    def fetch_raw_data_with_etag(self, url):
+        """
+        Returns a (body, etag) tuple, the ETag tells callers whether the content changed
+        since they last saw it. Unlike fetch_raw_data, HTTP errors are raised.
+        """
+        return self._conditional_get(url)
+
     def fetch_json(self, url):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            json_data = response.json()
+            body, _ = self._conditional_get(url)
+            json_data = json.loads(body)
         except requests.exceptions.HTTPError as httperr:
             log.error(
                 "request to {0} failed due to the following error: {1}".format(
@@ -30,8 +219,7 @@ class HttpLib:
 
     def fetch_raw_data(self, url):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            body, _ = self._conditional_get(url)
         except requests.exceptions.HTTPError as httperr:
             log.error(
                 "request to {0} failed due to the following error: {1}".format(
@@ -39,4 +227,4 @@ class HttpLib:
                 )
             )
             return None
-        return response.text
+        return body
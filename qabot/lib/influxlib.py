@@ -1,16 +1,37 @@
-import requests
+import itertools
 import json
 import logging
 import os
+import threading
+import time
+from collections import OrderedDict
 
 from influxdb import InfluxDBClient
 from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
 from requests.exceptions import RequestException
 
+from qabot.lib import transport
+
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
 
+# windows (in days) scanned in order until one of them has any points
+QUERY_WINDOWS = [
+    int(days)
+    for days in os.environ.get("QABOT_INFLUX_QUERY_WINDOWS", "14,30,60,120").split(",")
+]
+# points per chunk of a streamed (chunked) response
+CHUNK_SIZE = int(os.environ.get("QABOT_INFLUX_CHUNK_SIZE", "10000"))
+# results of each window are cached for the current time bucket (in seconds)
+CACHE_BUCKET = int(os.environ.get("QABOT_INFLUX_CACHE_BUCKET", "300"))
+MAX_CACHED_WINDOWS = 256
+# windows with more points than this are streamed but not cached
+MAX_CACHED_POINTS = 10000
+# errors of a query, they can also be raised in the middle of a streamed response
+QUERY_ERRORS = (RequestException, InfluxDBClientError, InfluxDBServerError)
+
+
 class InfluxLib:
     """
     Handle interactions with InfluxDB
@@ -23,36 +44,139 @@ class InfluxLib:
             log.info(f"Creating the InfluxDB client object targeting {host}:{port}...")
             cls._instance = super(InfluxLib, cls).__new__(cls)
             # initialize instance attributes
-            cls._instance.client = InfluxDBClient(host, port)
+            cls._instance.client = InfluxDBClient(
+                host, port, timeout=transport.DEFAULT_TIMEOUT[1]
+            )
             cls._instance.client.switch_database("ci_metrics")
+            cls._instance._window_cache = OrderedDict()
+            cls._instance._window_cache_lock = threading.Lock()
         return cls._instance
 
-    def _run_query(self, query, tags, days_ago):
-        log.debug(f"running query: {query} WHERE time > now() - {days_ago}d")
-        results = self.client.query(f"{query} WHERE time > now() - {days_ago}d")
-        return list(results.get_points(tags=tags))
+    def clear_cache(self):
+        with self._window_cache_lock:
+            self._window_cache.clear()
+
+    def _build_query(self, query, tags, window, group_by=()):
+        """
+        append a WHERE clause that filters by tag on the server (the tag values are sent as
+        bind parameters) and by time, plus an optional GROUP BY clause.
+        `window` is a (newer_than, older_than) range of days ago.
+        """
+        newer_than, older_than = window
+        conditions = [f'"{tag}" = ${tag}' for tag in tags]
+        conditions.append(f"time > now() - {older_than}d")
+        if newer_than:
+            conditions.append(f"time <= now() - {newer_than}d")
+        query += " WHERE " + " AND ".join(conditions)
+        if group_by:
+            query += " GROUP BY " + ", ".join(f'"{tag}"' for tag in group_by)
+        return query
+
+    def _run_query(self, query, tags, window, group_by=()):
+        """stream the points of a query chunk by chunk"""
+        query = self._build_query(query, tags, window, group_by)
+        log.debug(f"running query: {query} with {tags}")
+        for results in self.client.query(
+            query, bind_params=tags, chunked=True, chunk_size=CHUNK_SIZE
+        ):
+            # the tags of each group (if any) are merged into its points
+            for (_, group_tags), points in results.items():
+                for point in points:
+                    yield dict(group_tags or {}, **point)
+
+    def _stream_window(self, query, tags, window, group_by=()):
+        """
+        stream the points of a window, reusing the points cached for the same
+        query + window in the current time bucket
+        """
+        key = (
+            query,
+            tuple(sorted(tags.items())),
+            tuple(group_by),
+            window,
+            int(time.time() // CACHE_BUCKET),
+        )
+        with self._window_cache_lock:
+            cached = self._window_cache.get(key)
+        if cached is not None:
+            log.debug(f"reusing {len(cached)} cached point(s) of {window} for {query}")
+            yield from cached
+            return
+
+        points = []
+        for point in self._run_query(query, tags, window, group_by):
+            if points is not None:
+                points.append(point)
+                if len(points) > MAX_CACHED_POINTS:
+                    points = None
+            yield point
+        # only windows that were fully read are cached
+        if points is not None:
+            with self._window_cache_lock:
+                self._window_cache[key] = points
+                while len(self._window_cache) > MAX_CACHED_WINDOWS:
+                    self._window_cache.popitem(last=False)
+
+    def _log_stream_errors(self, points, query):
+        """
+        yield the points of a stream, a failure in a later chunk is logged and
+        ends the stream instead of escaping into the consumer
+        """
+        try:
+            yield from points
+        except QUERY_ERRORS as err:
+            log.error(f"streaming the results of query {query} failed. Details: {err}")
+
+    def _query_recent(self, query, tags, group_by=()):
+        """
+        Scan QUERY_WINDOWS from the narrowest to the widest and return a generator over
+        the points of the first one that has any (or None if none of them has points).
+        Since the narrower windows were empty, each step only scans the days
+        it adds to the previous window.
+        """
+        newer_than = 0
+        try:
+            for older_than in QUERY_WINDOWS:
+                window = (newer_than, older_than)
+                points = self._stream_window(query, tags, window, group_by)
+                first_point = next(points, None)
+                if first_point is not None:
+                    log.debug(f"found metrics in the last {older_than} days")
+                    return itertools.chain([first_point], points)
+                newer_than = older_than
+        except QUERY_ERRORS as err:
+            log.error(f"request with query {query} failed. Details: {err}")
+            return None
+        log.warn(
+            "could not find any metrics with this query + tags. Return empty response."
+        )
+        return None
 
     def query_ci_metrics(self, measurement, tags):
+        """
+        return a generator over the raw points of a measurement that match the given tags
+        (streamed from the server), or None if there are none.
+        The stream ends early if a later chunk of the response fails.
+        """
         query = f'SELECT * FROM "{measurement}"'
+        points = self._query_recent(query, tags)
+        return self._log_stream_errors(points, query) if points is not None else None
+
+    def count_ci_metrics(self, measurement, tags, group_by, field=None):
+        """
+        count (on the server) the points of a measurement that match the given tags
+        per combination of the `group_by` tags, e.g.:
+        [{"repo_name": "myRepo", "pr_num": "123", "count": 2}, ...]
+        or None if there are none or the query failed
+        """
+        field = field or measurement
+        query = f'SELECT COUNT("{field}") AS "count" FROM "{measurement}"'
+        rows = self._query_recent(query, tags, group_by)
+        if rows is None:
+            return None
         try:
-            points = self._run_query(query, tags, 14)
-
-            # If zero metrics are found for this query/tags in a 2-week time frame
-            # go further back a few months
-            if len(points) == 0:
-                points = self._run_query(query, tags, 120)
-
-            if len(points) > 0:
-                if logging.getLogger().level == logging.DEBUG:
-                    for point in points:
-                        log.debug(f"point {point}")
-                return points
-            else:
-                log.warn(
-                    "could not find any metrics with this query + tags. Return empty response."
-                )
-                return None
-        except (RequestException, InfluxDBClientError, InfluxDBServerError) as err:
-            log.error(f"request with query {query} failed. Details: {err}")
+            return list(rows)
+        except QUERY_ERRORS as err:
+            # partial counts would be wrong, report the failure as "nothing found"
+            log.error(f"streaming the results of query {query} failed. Details: {err}")
             return None
-        return results
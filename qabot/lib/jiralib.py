@@ -1,14 +1,91 @@
 from jira import JIRA
 from jira.exceptions import JIRAError
-from functools import lru_cache
-import time
-import requests
 import logging
 import os
+import re
+import threading
+
+from qabot.lib import transport
+from qabot.lib.directory import Directory
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# how often (in seconds) the Jira user directory is refreshed in the background
+JIRA_USER_DIRECTORY_TTL = int(os.environ.get("QABOT_JIRA_USER_DIRECTORY_TTL", "3600"))
+JIRA_USERS_PAGE_SIZE = 1000
+
+
+def normalize_user_name(name):
+    """'Marcelo_Rodrigues_Costa' / 'marcelo  rodrigues costa' -> 'marcelo rodrigues costa'"""
+    return " ".join(re.split(r"[\s_]+", name.strip().lower()))
+
+
+class JiraUserDirectory(Directory):
+    """
+    All the users of a Jira instance, indexed by displayName, normalized name and accountId
+    """
+
+    name = "Jira user directory"
+
+    def __init__(
+        self, jira_server, service_account, token, ttl=JIRA_USER_DIRECTORY_TTL, **kwargs
+    ):
+        super().__init__(ttl, **kwargs)
+        self.jira_server = jira_server
+        self.service_account = service_account
+        self.token = token
+
+    def fetch_pages(self):
+        # the page size is capped server-side, so keep going until an empty page
+        start_at = 0
+        while True:
+            response = transport.get(
+                f"{self.jira_server}/rest/api/3/user/search",
+                params={
+                    "query": "_",
+                    "startAt": start_at,
+                    "maxResults": JIRA_USERS_PAGE_SIZE,
+                },
+                headers={"Content-type": "application/json"},
+                auth=(self.service_account, self.token),
+            )
+            response.raise_for_status()
+            users = response.json()
+            if not users:
+                return
+            yield users
+            start_at += len(users)
+
+    def entry_id(self, user):
+        return user["accountId"]
+
+    def index_keys(self, user):
+        display_name = user.get("displayName") or ""
+        return {
+            "accountId": [user["accountId"]],
+            "displayName": [display_name],
+            "name": [display_name],
+        }
+
+    def normalize_key(self, index, key):
+        return normalize_user_name(key) if index == "name" else key
+
+
+_jira_user_directories = {}
+_jira_user_directories_lock = threading.Lock()
+
+
+def get_jira_user_directory(jira_server, service_account, token):
+    """Return the process-wide JiraUserDirectory of a Jira instance"""
+    with _jira_user_directories_lock:
+        key = (jira_server, service_account)
+        if key not in _jira_user_directories:
+            _jira_user_directories[key] = JiraUserDirectory(
+                jira_server, service_account, token
+            )
+        return _jira_user_directories[key]
+
 
 class JiraLib:
     def __init__(
@@ -29,47 +106,35 @@ class JiraLib:
         return a jira client object
         """
         options = {"server": self.jira_server}
-        j = JIRA(options, basic_auth=(self.service_account, self.token))
+        j = JIRA(
+            options,
+            basic_auth=(self.service_account, self.token),
+            timeout=transport.get_timeout(self.jira_server)[1],
+        )
         return j
 
-    def _get_ttl_hash(self, seconds=300):
-        """To facilitate caching: Return the same value withing `seconds` time period"""
-        return round(time.time() / seconds)
-
-    @lru_cache()
-    def _get_all_jira_users(self, ttl_hash=None):
-        del ttl_hash
-        url = f"{self.jira_server}/rest/api/3/user/search?query=_&maxResults=1000"
-        try:
-            response = requests.get(
-                url,
-                headers={"Content-type": "application/json"},
-                auth=(self.service_account, self.token),
-            )
-            response.raise_for_status()
-            all_users_json = response.json()
-        except requests.exceptions.HTTPError as httperr:
-            log.error(
-                "request to {0} failed due to the following error: {1}".format(
-                    url, str(httperr)
-                )
-            )
-            return None
-        return all_users_json
+    def get_user_directory(self):
+        return get_jira_user_directory(
+            self.jira_server, self.service_account, self.token
+        )
 
     # TODO: It would be great to use the email instead but the JIRA Cloud API hides it
     def get_jira_user_id(self, display_name):
-        all_users = self._get_all_jira_users(self._get_ttl_hash())
-        user_found = None
-        for user in all_users:
-            if user["displayName"] == display_name:
-                user_found = user["accountId"]
-
-        if user_found:
-            log.info(f"Found user id: {user_found}")
-            return user_found
+        """
+        accountId of a user given their display name (exact, or case / underscore
+        insensitive, e.g. "Marcelo_Rodrigues_Costa"), or "-1" if not found
+        """
+        directory = self.get_user_directory()
+        # only wait once for the initial load, not once per index
+        directory.wait_until_loaded()
+        user = directory.lookup(
+            "displayName", display_name, wait=0
+        ) or directory.lookup("name", display_name, wait=0)
+        if user:
+            log.info(f"Found user id: {user['accountId']}")
+            return user["accountId"]
         else:
-            log.warn(f"could not find user id based on display name: {display_name}")
+            log.warning(f"could not find user id based on display name: {display_name}")
             return "-1"
 
     def create_ticket(
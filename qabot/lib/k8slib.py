@@ -0,0 +1,264 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from qabot.lib import transport
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# "api" (Kubernetes API only), "kubectl" (always fork kubectl) or "auto" (API when configured)
+K8S_BACKEND = os.environ.get("QABOT_K8S_BACKEND", "auto").lower()
+# credentials mounted in every pod
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+# how often (in seconds) rollouts and jobs are polled
+K8S_POLL_INTERVAL = float(os.environ.get("QABOT_K8S_POLL_INTERVAL", "5"))
+K8S_WAIT_TIMEOUT = 600
+
+
+class KubernetesError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class K8sLib:
+    """
+    Minimal Kubernetes API client (namespace labels, rollout restarts and statuses, jobs
+    created from cronjobs) going through the shared, pooled HTTP session of qabot.lib.transport,
+    so the API server is not re-discovered and re-authenticated for every operation like
+    with a `kubectl` process.
+    """
+
+    def __init__(self, api_server, token=None, token_path=None, ca_cert=None):
+        self.api_server = api_server.rstrip("/")
+        self.token_path = token_path
+        self.ca_cert = ca_cert
+        self._token = token
+        self._token_mtime = None
+
+    @classmethod
+    def from_environment(cls):
+        """
+        K8sLib authenticated with the service account of the pod, or None when running
+        outside of a cluster (QABOT_K8S_API_SERVER can point to another API server)
+        """
+        api_server = os.environ.get("QABOT_K8S_API_SERVER")
+        if not api_server and os.environ.get("KUBERNETES_SERVICE_HOST"):
+            host = os.environ["KUBERNETES_SERVICE_HOST"]
+            port = os.environ.get("KUBERNETES_SERVICE_PORT", "443")
+            api_server = f"https://{host}:{port}"
+        token_path = os.path.join(SERVICE_ACCOUNT_DIR, "token")
+        if not api_server or not os.path.exists(token_path):
+            return None
+        ca_cert = os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt")
+        return cls(
+            api_server,
+            token_path=token_path,
+            ca_cert=ca_cert if os.path.exists(ca_cert) else None,
+        )
+
+    def _get_token(self):
+        # projected service account tokens are rotated by the kubelet, re-read the file when it changes
+        if self.token_path:
+            mtime = os.stat(self.token_path).st_mtime
+            if mtime != self._token_mtime:
+                with open(self.token_path) as f:
+                    self._token = f.read().strip()
+                self._token_mtime = mtime
+        return self._token
+
+    def _request(self, method, path, body=None, content_type="application/json"):
+        headers = {"Accept": "application/json"}
+        token = self._get_token()
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        if body is not None:
+            headers["Content-Type"] = content_type
+        response = transport.request(
+            method,
+            f"{self.api_server}{path}",
+            headers=headers,
+            json=body,
+            verify=self.ca_cert or True,
+        )
+        if response.status_code >= 400:
+            try:
+                message = response.json().get("message", response.text)
+            except ValueError:
+                message = response.text
+            raise KubernetesError(
+                f"{method} {path} failed ({response.status_code}): {message}",
+                status_code=response.status_code,
+            )
+        return response.json()
+
+    def label_namespace(self, namespace, labels):
+        """set `labels` ({name: value}, None removes the label) on a namespace in one call"""
+        return self._request(
+            "PATCH",
+            f"/api/v1/namespaces/{namespace}",
+            {"metadata": {"labels": labels}},
+            content_type="application/merge-patch+json",
+        )
+
+    def list_deployments(self, namespace):
+        return self._request(
+            "GET", f"/apis/apps/v1/namespaces/{namespace}/deployments"
+        )["items"]
+
+    def rollout_restart(self, namespace, deployment=None):
+        """
+        restart a deployment (or all the deployments of the namespace) the way
+        `kubectl rollout restart` does. Returns the names of the restarted deployments
+        """
+        if deployment:
+            names = [deployment]
+        else:
+            names = [d["metadata"]["name"] for d in self.list_deployments(namespace)]
+        restarted_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        patch = {
+            "spec": {
+                "template": {
+                    "metadata": {
+                        "annotations": {
+                            "kubectl.kubernetes.io/restartedAt": restarted_at
+                        }
+                    }
+                }
+            }
+        }
+        for name in names:
+            self._request(
+                "PATCH",
+                f"/apis/apps/v1/namespaces/{namespace}/deployments/{name}",
+                patch,
+                content_type="application/strategic-merge-patch+json",
+            )
+        log.info(f"Restarted {len(names)} deployment(s) in {namespace}")
+        return names
+
+    @staticmethod
+    def is_rolled_out(deployment):
+        spec = deployment.get("spec", {})
+        status = deployment.get("status", {})
+        replicas = spec.get("replicas", 1)
+        return (
+            status.get("observedGeneration", 0)
+            >= deployment["metadata"].get("generation", 0)
+            and status.get("updatedReplicas", 0) >= replicas
+            and status.get("replicas", 0) <= status.get("updatedReplicas", 0)
+            and status.get("availableReplicas", 0) >= replicas
+        )
+
+    def rollout_status(
+        self, namespace, deployment=None, timeout=K8S_WAIT_TIMEOUT, interval=None
+    ):
+        """wait until a deployment (or all the deployments of the namespace) is rolled out"""
+        interval = K8S_POLL_INTERVAL if interval is None else interval
+        deadline = time.monotonic() + timeout
+        while True:
+            if deployment:
+                deployments = [
+                    self._request(
+                        "GET",
+                        f"/apis/apps/v1/namespaces/{namespace}/deployments/{deployment}",
+                    )
+                ]
+            else:
+                deployments = self.list_deployments(namespace)
+            pending = [
+                d["metadata"]["name"] for d in deployments if not self.is_rolled_out(d)
+            ]
+            if not pending:
+                return [d["metadata"]["name"] for d in deployments]
+            if time.monotonic() + interval > deadline:
+                raise KubernetesError(
+                    f"timed out waiting for the rollout of {', '.join(pending)} in {namespace}"
+                )
+            log.debug(f"waiting for the rollout of {', '.join(pending)} in {namespace}")
+            time.sleep(interval)
+
+    def create_job_from_cronjob(self, namespace, cronjob_name, job_name):
+        """create a job from the template of a cronjob, like `kubectl create job --from=cronjob/...`"""
+        cronjob = self._request(
+            "GET", f"/apis/batch/v1/namespaces/{namespace}/cronjobs/{cronjob_name}"
+        )
+        job_template = cronjob["spec"]["jobTemplate"]
+        job = {
+            "apiVersion": "batch/v1",
+            "kind": "Job",
+            "metadata": {
+                "name": job_name,
+                "namespace": namespace,
+                "labels": job_template.get("metadata", {}).get("labels", {}),
+                "annotations": {"cronjob.kubernetes.io/instantiate": "manual"},
+                "ownerReferences": [
+                    {
+                        "apiVersion": "batch/v1",
+                        "kind": "CronJob",
+                        "name": cronjob_name,
+                        "uid": cronjob["metadata"]["uid"],
+                        "controller": True,
+                    }
+                ],
+            },
+            "spec": job_template["spec"],
+        }
+        return self._request("POST", f"/apis/batch/v1/namespaces/{namespace}/jobs", job)
+
+    def wait_for_job(
+        self, namespace, job_name, timeout=K8S_WAIT_TIMEOUT, interval=None
+    ):
+        """wait until a job completes, raise a KubernetesError if it fails or times out"""
+        interval = K8S_POLL_INTERVAL if interval is None else interval
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._request(
+                "GET", f"/apis/batch/v1/namespaces/{namespace}/jobs/{job_name}"
+            )
+            for condition in job.get("status", {}).get("conditions", []):
+                if condition.get("status") != "True":
+                    continue
+                if condition["type"] == "Complete":
+                    return job
+                if condition["type"] == "Failed":
+                    raise KubernetesError(
+                        f"job {job_name} failed in {namespace}: {condition.get('message')}"
+                    )
+            if time.monotonic() + interval > deadline:
+                raise KubernetesError(
+                    f"timed out waiting for job {job_name} to complete in {namespace}"
+                )
+            time.sleep(interval)
+
+
+_k8slib = None
+_k8slib_checked = False
+_k8slib_lock = threading.Lock()
+
+
+def get_k8slib():
+    """
+    Return the process-wide K8sLib, or None when kubectl must be used instead
+    (QABOT_K8S_BACKEND=kubectl, or no API server / service account available).
+    Raises a KubernetesError if QABOT_K8S_BACKEND=api and no API is available.
+    """
+    global _k8slib, _k8slib_checked
+    if K8S_BACKEND == "kubectl":
+        return None
+    with _k8slib_lock:
+        if not _k8slib_checked:
+            _k8slib = K8sLib.from_environment()
+            _k8slib_checked = True
+            if _k8slib:
+                log.info(f"Using the Kubernetes API at {_k8slib.api_server}")
+            elif K8S_BACKEND != "api":
+                log.info("No Kubernetes API configured, falling back to kubectl")
+        if _k8slib is None and K8S_BACKEND == "api":
+            raise KubernetesError(
+                "QABOT_K8S_BACKEND=api but no Kubernetes API is configured"
+            )
+        return _k8slib
@@ -0,0 +1,99 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = int(os.environ.get("QABOT_SCHEDULER_MAX_WORKERS", "4"))
+
+
+class Scheduler:
+    """
+    Runs deferred tasks without holding a thread per task:
+    a single timer thread sleeps until the next task is due (tasks are kept in a heap)
+    and hands it over to a small pool of workers.
+    A task scheduled under a key that is already pending is merged into the pending one.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._heap = []
+        self._pending_keys = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._workers = None
+
+    def _start(self):
+        # must be called with the condition held
+        if self._thread is None or not self._thread.is_alive():
+            self._workers = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="qabot-scheduler"
+            )
+            self._thread = threading.Thread(
+                target=self._run, name="qabot-scheduler-timer", daemon=True
+            )
+            self._thread.start()
+
+    def call_later(self, delay, func, key=None):
+        """
+        Run `func()` in `delay` seconds.
+        Returns False (and does nothing) if a task with the same `key` is already pending.
+        """
+        with self._cond:
+            if key is not None:
+                if key in self._pending_keys:
+                    log.debug(f"merging deferred task {key} into the pending one")
+                    return False
+                self._pending_keys.add(key)
+            heapq.heappush(
+                self._heap, (time.monotonic() + delay, next(self._seq), key, func)
+            )
+            self._start()
+            self._cond.notify()
+        return True
+
+    def pending(self, key=None):
+        with self._cond:
+            if key is not None:
+                return int(key in self._pending_keys)
+            return len(self._heap)
+
+    def _execute(self, key, func):
+        try:
+            func()
+        except Exception as e:
+            log.error(f"deferred task {key or func} failed: {e}")
+            traceback.print_exc()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    timeout = (
+                        self._heap[0][0] - time.monotonic() if self._heap else None
+                    )
+                    self._cond.wait(timeout)
+                _, _, key, func = heapq.heappop(self._heap)
+                # from now on, tasks with the same key are scheduled again
+                self._pending_keys.discard(key)
+            self._workers.submit(self._execute, key, func)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide Scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -1,12 +1,84 @@
-import json
 import logging
 import os
+import threading
 
-import requests
+from qabot.lib import transport
+from qabot.lib.directory import Directory
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# how often (in seconds) the Slack user directory is refreshed in the background
+SLACK_USER_DIRECTORY_TTL = int(os.environ.get("QABOT_SLACK_USER_DIRECTORY_TTL", "900"))
+# members per users.list page (Slack recommends no more than 200)
+SLACK_USERS_PAGE_SIZE = 200
+
+
+class SlackAPIError(Exception):
+    pass
+
+
+class SlackUserDirectory(Directory):
+    """
+    All the members of the Slack workspace, indexed by real_name, display_name and id.
+    Members whose `updated` timestamp did not change are not re-indexed on refresh.
+    """
+
+    name = "Slack user directory"
+
+    def __init__(self, base_url, token, ttl=SLACK_USER_DIRECTORY_TTL, **kwargs):
+        super().__init__(ttl, **kwargs)
+        self.base_url = base_url
+        self.token = token
+
+    def fetch_pages(self):
+        cursor = None
+        while True:
+            params = {"limit": SLACK_USERS_PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            response = transport.get(
+                f"{self.base_url}/users.list",
+                params=params,
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+            response.raise_for_status()
+            json_data = response.json()
+            if not json_data.get("ok"):
+                raise SlackAPIError(f"users.list failed: {json_data.get('error')}")
+            yield json_data["members"]
+            cursor = json_data.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return
+
+    def entry_id(self, member):
+        return member["id"]
+
+    def entry_version(self, member):
+        return member.get("updated")
+
+    def index_keys(self, member):
+        keys = {"id": [member["id"]]}
+        # deleted members keep their names, don't let them shadow active ones
+        if not member.get("deleted"):
+            profile = member.get("profile", {})
+            keys["real_name"] = [profile.get("real_name") or member.get("real_name")]
+            keys["display_name"] = [profile.get("display_name")]
+        return keys
+
+
+_slack_user_directories = {}
+_slack_user_directories_lock = threading.Lock()
+
+
+def get_slack_user_directory(base_url, token):
+    """Return the process-wide SlackUserDirectory of a workspace"""
+    with _slack_user_directories_lock:
+        key = (base_url, token)
+        if key not in _slack_user_directories:
+            _slack_user_directories[key] = SlackUserDirectory(base_url, token)
+        return _slack_user_directories[key]
+
 
 class SlackLib:
     def __init__(
@@ -20,23 +92,18 @@ class SlackLib:
         self.base_url = base_url
         self.token = token
 
+    def get_user_directory(self):
+        return get_slack_user_directory(self.base_url, self.token)
+
     def get_user_info(self, real_name):
-        try:
-            response = requests.get(
-                "{}/users.list?token={}".format(self.base_url, self.token)
-            )
-            response.raise_for_status()
-            json_data = response.json()
-            for member in json_data["members"]:
-                if member["profile"]["real_name"] == real_name:
-                    return member
-            return None
-        except requests.exceptions.HTTPError as httperr:
-            log.error(f"request failed due to the following error: {str(httperr)}")
-            return None
-        except json.JSONDecodeError as jsonerr:
-            log.error(f"error while trying to fetch json data - error: {str(jsonerr)}")
-            return None
+        """member of the workspace with the given real name, or None"""
+        return self.get_user_directory().lookup("real_name", real_name)
+
+    def get_user_info_by_display_name(self, display_name):
+        return self.get_user_directory().lookup("display_name", display_name)
+
+    def get_user_info_by_id(self, user_id):
+        return self.get_user_directory().lookup("id", user_id)
 
 
 if __name__ == "__main__":
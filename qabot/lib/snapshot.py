@@ -0,0 +1,139 @@
+import fnmatch
+import json
+import logging
+import os
+import tarfile
+import threading
+import time
+from collections import OrderedDict
+
+from qabot.lib import transport
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# files extracted from a repo archive by default
+DEFAULT_MEMBERS = ("*/manifest.json", "CODEOWNERS")
+MAX_SNAPSHOTS = int(os.environ.get("QABOT_MAX_REPO_SNAPSHOTS", "8"))
+
+
+def path_matches(path, patterns):
+    """
+    glob match where `*` does not cross folders, i.e. "*/manifest.json" only matches
+    manifests that sit right below the root of the repo
+    """
+    segments = path.split("/")
+    for pattern in patterns:
+        pattern_segments = pattern.split("/")
+        if len(segments) == len(pattern_segments) and all(
+            fnmatch.fnmatchcase(s, p) for s, p in zip(segments, pattern_segments)
+        ):
+            return True
+    return False
+
+
+class RepoSnapshot:
+    """
+    In-memory copy of selected files of a repo at a given commit
+    """
+
+    def __init__(self, repo, ref, files):
+        self.repo = repo
+        self.ref = ref
+        self.files = files
+        self.loaded_at = time.monotonic()
+        self._json = {}
+
+    def read(self, path):
+        return self.files.get(path)
+
+    def read_json(self, path):
+        if path not in self._json:
+            content = self.read(path)
+            self._json[path] = json.loads(content) if content is not None else None
+        return self._json[path]
+
+    def env_folders(self):
+        """env folders that contain a manifest.json"""
+        return sorted(
+            p.split("/")[0]
+            for p in self.files
+            if p.count("/") == 1 and p.endswith("/manifest.json")
+        )
+
+    def manifest(self, env):
+        return self.read_json(f"{env}/manifest.json")
+
+
+class SnapshotLib:
+    """
+    Loads repo snapshots from a single archive (tarball) download per commit.
+    The archive is streamed and only the requested members are kept in memory,
+    nothing is written to disk.
+    """
+
+    def __init__(self, org="uc-cdis", base_url="https://codeload.github.com"):
+        self.org = org
+        self.base_url = base_url
+
+    def get_archive_url(self, repo, ref):
+        return f"{self.base_url}/{self.org}/{repo}/tar.gz/{ref}"
+
+    def load_snapshot(self, repo, ref, members=DEFAULT_MEMBERS):
+        url = self.get_archive_url(repo, ref)
+        started_at = time.perf_counter()
+        files = {}
+        with transport.get(url, stream=True) as response:
+            response.raise_for_status()
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    # drop the "<repo>-<sha>/" folder github wraps the archive with
+                    path = member.name.split("/", 1)[-1]
+                    if path_matches(path, members):
+                        files[path] = archive.extractfile(member).read().decode()
+        log.info(
+            f"Loaded {len(files)} files from the {repo}@{ref} archive in {time.perf_counter() - started_at:.2f}s"
+        )
+        return RepoSnapshot(repo, ref, files)
+
+    def get_snapshot(self, repo, ref, members=DEFAULT_MEMBERS):
+        """
+        return the snapshot of `repo` at commit `ref`, downloading the archive only once per commit
+        """
+        key = (self.org, repo, ref, tuple(members))
+        with _snapshots_lock:
+            if key in _snapshots:
+                _snapshots.move_to_end(key)
+                return _snapshots[key]
+        snapshot = self.load_snapshot(repo, ref, members)
+        with _snapshots_lock:
+            _snapshots[key] = snapshot
+            while len(_snapshots) > MAX_SNAPSHOTS:
+                _snapshots.popitem(last=False)
+        return snapshot
+
+    def get_latest_loaded_snapshot(self, repo, max_age=300):
+        """
+        return the most recently loaded snapshot of `repo` (if any was loaded in the last
+        `max_age` seconds) without touching the network
+        """
+        with _snapshots_lock:
+            candidates = [
+                s
+                for (org, r, _, members), s in _snapshots.items()
+                if org == self.org and r == repo
+            ]
+        candidates = [s for s in candidates if time.monotonic() - s.loaded_at < max_age]
+        return max(candidates, key=lambda s: s.loaded_at) if candidates else None
+
+
+# process-wide snapshot store shared by every SnapshotLib instance
+_snapshots = OrderedDict()
+_snapshots_lock = threading.Lock()
+
+
+def clear_snapshots():
+    with _snapshots_lock:
+        _snapshots.clear()
@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# (connect timeout, read timeout) in seconds per upstream
+UPSTREAM_TIMEOUTS = {
+    "api.github.com": (5, 30),
+    "raw.githubusercontent.com": (5, 30),
+    "codeload.github.com": (5, 120),
+    "slack.com": (5, 30),
+    "ctds-planx.atlassian.net": (5, 30),
+    "cdistest-public-test-bucket.s3.amazonaws.com": (5, 30),
+}
+DEFAULT_TIMEOUT = (5, 60)
+
+# number of per-host connection pools to keep around and connections per pool
+POOL_CONNECTIONS = int(os.environ.get("QABOT_HTTP_POOL_CONNECTIONS", "16"))
+POOL_MAXSIZE = int(os.environ.get("QABOT_HTTP_POOL_MAXSIZE", "32"))
+
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_retry_strategy(total=3):
+    """
+    Retry idempotent requests on connection errors, 5xx and 429 responses
+    with exponential backoff + jitter (honoring Retry-After when present).
+    POST requests (e.g., workflow dispatches) are never retried.
+    """
+    return Retry(
+        total=total,
+        backoff_factor=0.5,
+        backoff_jitter=0.5,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        # hand the last response back to the caller so raise_for_status() still works
+        raise_on_status=False,
+    )
+
+
+def get_timeout(url):
+    return UPSTREAM_TIMEOUTS.get(urlsplit(url).hostname, DEFAULT_TIMEOUT)
+
+
+def get_session():
+    """
+    Return the process-wide requests session. Connections are kept alive and
+    pooled per host, so repeated calls to the same upstream skip the TCP+TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                log.info(
+                    f"Creating shared HTTP session ({POOL_CONNECTIONS} host pools x {POOL_MAXSIZE} connections)"
+                )
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    max_retries=get_retry_strategy(),
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def request(method, url, **kwargs):
+    """Drop-in replacement for requests.request() that goes through the shared session"""
+    kwargs.setdefault("timeout", get_timeout(url))
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
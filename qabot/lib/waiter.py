@@ -0,0 +1,119 @@
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+
+from qabot.lib.scheduler import Scheduler, get_scheduler
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+
+class ResourceWaiter:
+    """
+    Waits for resources that are expected to show up eventually (e.g., the PR opened by a workflow)
+    without holding a thread per waiter.
+    Polls are deferred tasks of the scheduler, repeated with exponential backoff + jitter until each
+    waiter is satisfied or reaches its deadline. Concurrent waiters registered under the same key
+    share a single poll.
+    """
+
+    def __init__(self, initial_delay=5, max_delay=60, jitter=0.2, scheduler=None):
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.scheduler = scheduler or Scheduler()
+        self._polls = {}
+        self._lock = threading.Lock()
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.initial_delay * (2**attempt))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def wait_for(self, key, poll, match, on_found, on_timeout, deadline=120):
+        """
+        Register a waiter.
+        - `poll()` fetches the current state of the resource (shared by every waiter with the same `key`)
+        - `match(state)` returns the resource this waiter is looking for, or None
+        - `on_found(resource)` / `on_timeout()` are called exactly once, from a scheduler worker
+        """
+        waiter = {
+            "match": match,
+            "on_found": on_found,
+            "on_timeout": on_timeout,
+            "deadline_at": time.monotonic() + deadline,
+        }
+        with self._lock:
+            if key in self._polls:
+                log.debug(f"joining the existing poll for {key}")
+                self._polls[key]["waiters"].append(waiter)
+                return
+            self._polls[key] = {"poll": poll, "waiters": [waiter], "attempt": 0}
+        self.scheduler.call_later(self._backoff(0), lambda: self._poll(key))
+
+    def pending(self, key=None):
+        with self._lock:
+            if key is not None:
+                return len(self._polls.get(key, {}).get("waiters", []))
+            return sum(len(p["waiters"]) for p in self._polls.values())
+
+    def _notify(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            log.error(f"resource waiter callback failed: {e}")
+            traceback.print_exc()
+
+    def _poll(self, key):
+        with self._lock:
+            entry = self._polls[key]
+
+        try:
+            state = entry["poll"]()
+        except Exception as e:
+            log.warning(f"poll for {key} failed: {e}")
+            state = None
+
+        next_poll_in = None
+        with self._lock:
+            now = time.monotonic()
+            found, expired, remaining = [], [], []
+            for waiter in entry["waiters"]:
+                resource = waiter["match"](state) if state is not None else None
+                if resource is not None:
+                    found.append((waiter, resource))
+                elif waiter["deadline_at"] <= now:
+                    expired.append(waiter)
+                else:
+                    remaining.append(waiter)
+            entry["waiters"] = remaining
+            if remaining:
+                entry["attempt"] += 1
+                next_poll_in = min(
+                    self._backoff(entry["attempt"]),
+                    min(w["deadline_at"] for w in remaining) - now,
+                )
+            else:
+                del self._polls[key]
+        if next_poll_in is not None:
+            self.scheduler.call_later(max(0, next_poll_in), lambda: self._poll(key))
+
+        for waiter, resource in found:
+            self._notify(waiter["on_found"], resource)
+        for waiter in expired:
+            self._notify(waiter["on_timeout"])
+
+
+_waiter = None
+_waiter_lock = threading.Lock()
+
+
+def get_resource_waiter():
+    """Return the process-wide ResourceWaiter"""
+    global _waiter
+    with _waiter_lock:
+        if _waiter is None:
+            _waiter = ResourceWaiter(scheduler=get_scheduler())
+        return _waiter
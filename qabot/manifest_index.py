@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import re
+import threading
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+
+def get_version_tag(image):
+    """'quay.io/cdis/fence:2024.05' -> '2024.05'"""
+    match = re.search(r".*\:(.*)$", image or "")
+    return match.group(1) if match else None
+
+
+def get_release_from_versions_block(versions_block):
+    """the release of an environment is the version of sheepdog (or indexd if there's no sheepdog)"""
+    image = (
+        versions_block["sheepdog"]
+        if "sheepdog" in versions_block.keys()
+        else versions_block.get("indexd")
+    )
+    return get_version_tag(image)
+
+
+class ManifestIndex:
+    """
+    Inverted index over the versions blocks of all the environment manifests of a repo:
+    - (service, version) -> envs
+    - env -> versions block
+    - release -> envs
+    The index is tied to the commit SHA it was built from, so it can be updated incrementally
+    by re-parsing only the env folders that changed since then.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.commit_sha = None
+        self.env_versions = {}
+        self.failed_envs = set()
+        self._by_service_version = {}
+        self._by_release = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                index.update(
+                    data["commit_sha"],
+                    data["env_versions"],
+                    data.get("failed_envs", []),
+                )
+                log.info(
+                    f"Loaded manifest index for {data['commit_sha']} with {len(index.env_versions)} envs from {path}"
+                )
+            except (OSError, ValueError, KeyError) as err:
+                log.warning(f"Ignoring unreadable manifest index {path}: {err}")
+                index = cls(path)
+        return index
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                "commit_sha": self.commit_sha,
+                "env_versions": self.env_versions,
+                "failed_envs": sorted(self.failed_envs),
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def _remove_env(self, env):
+        # must be called with the lock held
+        versions_block = self.env_versions.pop(env, None)
+        if versions_block is None:
+            return
+        for service, image in versions_block.items():
+            envs = self._by_service_version.get((service, get_version_tag(image)))
+            if envs:
+                envs.discard(env)
+        envs = self._by_release.get(get_release_from_versions_block(versions_block))
+        if envs:
+            envs.discard(env)
+
+    def _add_env(self, env, versions_block):
+        # must be called with the lock held
+        self.env_versions[env] = versions_block
+        for service, image in versions_block.items():
+            self._by_service_version.setdefault(
+                (service, get_version_tag(image)), set()
+            ).add(env)
+        self._by_release.setdefault(
+            get_release_from_versions_block(versions_block), set()
+        ).add(env)
+
+    def update(self, commit_sha, versions_by_env, failed_envs=(), removed_envs=()):
+        """
+        Apply the versions blocks re-parsed at `commit_sha`.
+        Envs that are not mentioned keep whatever was indexed before.
+        """
+        with self._lock:
+            for env in removed_envs:
+                self._remove_env(env)
+                self.failed_envs.discard(env)
+            for env, versions_block in versions_by_env.items():
+                self._remove_env(env)
+                self._add_env(env, versions_block)
+                self.failed_envs.discard(env)
+            for env in failed_envs:
+                self._remove_env(env)
+                self.failed_envs.add(env)
+            self.commit_sha = commit_sha
+
+    def envs(self):
+        with self._lock:
+            return sorted(self.env_versions.keys())
+
+    def envs_running(self, service, version):
+        with self._lock:
+            return sorted(self._by_service_version.get((service, version), ()))
+
+    def envs_on_release(self, release):
+        with self._lock:
+            return sorted(self._by_release.get(release, ()))
@@ -1,6 +1,8 @@
+from qabot.lib.crawler import Crawler
 from qabot.lib.githublib import GithubLib
 from qabot.lib.httplib import HttpLib
-from functools import lru_cache
+from qabot.lib.snapshot import SnapshotLib
+from qabot.manifest_index import ManifestIndex
 import time
 import logging
 import re
@@ -10,11 +12,18 @@ from pprint import pprint
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# how often (in seconds) to check whether the manifest index is behind the latest commit
+MANIFEST_INDEX_REFRESH_INTERVAL = int(
+    os.environ.get("QABOT_MANIFEST_INDEX_REFRESH_INTERVAL", "60")
+)
+
 
 class ManifestsChecker:
     def __init__(
         self,
         manifests_base_url="https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master",
+        raw_base_url="https://raw.githubusercontent.com/uc-cdis",
+        manifest_index_dir=os.environ.get("QABOT_MANIFEST_INDEX_DIR"),
     ):
         """
         Checks manifest.json files to assist with sign-off procedures
@@ -22,8 +31,14 @@ class ManifestsChecker:
         # example of raw url:
         # https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master/internalstaging.datastage.io/manifest.json
         self.manifests_base_url = manifests_base_url
+        self.raw_base_url = raw_base_url
         self.githublib = self.get_githublib()
         self.httplib = self.get_httplib()
+        self.crawler = self.get_crawler()
+        self.snapshotlib = self.get_snapshotlib()
+        self.manifest_index_dir = manifest_index_dir
+        self.manifest_indexes = {}
+        self.manifest_index_checked_at = {}
 
     def get_githublib(self):
         return GithubLib()
@@ -31,15 +46,15 @@ class ManifestsChecker:
     def get_httplib(self):
         return HttpLib()
 
-    def _get_ttl_hash(self, seconds=300):
-        """To facilitate caching: Return the same value withing `seconds` time period"""
-        return round(time.time() / seconds)
+    def get_crawler(self):
+        return Crawler()
+
+    def get_snapshotlib(self):
+        return SnapshotLib()
 
-    @lru_cache()
-    def _get_directories_from_repo(self, repo, ttl_hash=None):
-        del ttl_hash
+    def _get_directories_from_repo(self, repo, ref=None):
         github_client = GithubLib(repo=repo).get_github_client()
-        contents_from_repo = github_client.get_contents("/")
+        contents_from_repo = github_client.get_contents("/", ref=ref or "master")
         directories = []
         for file in contents_from_repo:
             if file.type == "dir":
@@ -47,6 +62,142 @@ class ManifestsChecker:
                 directories.append(file.name)
         return directories
 
+    def _get_head_sha(self, repo):
+        return GithubLib(repo=repo).get_head_sha()
+
+    def _get_changed_directories(self, repo, base_sha, head_sha):
+        """
+        (top-level folders touched between two commits, folders whose manifest was deleted),
+        or None if they can't be determined
+        """
+        changes = GithubLib(repo=repo).get_file_changes(base_sha, head_sha)
+        if changes is None:
+            return None
+        changed_dirs = {f.split("/")[0] for f in changes if "/" in f}
+        removed_dirs = {
+            f.split("/")[0]
+            for f, status in changes.items()
+            if f.count("/") == 1
+            and f.endswith("/manifest.json")
+            and status == "removed"
+        }
+        return changed_dirs, removed_dirs
+
+    def _get_manifest_index(self, repo):
+        if repo not in self.manifest_indexes:
+            path = (
+                os.path.join(self.manifest_index_dir, f"{repo}.json")
+                if self.manifest_index_dir
+                else None
+            )
+            self.manifest_indexes[repo] = ManifestIndex.load(path)
+        return self.manifest_indexes[repo]
+
+    def _index_from_snapshot(self, index, repo, head_sha, to_be_ignored):
+        """
+        (re)build the whole index from a single repo archive download instead of one request per manifest
+        """
+        try:
+            snapshot = self.snapshotlib.get_snapshot(repo, head_sha)
+        except Exception as err:
+            log.warning(
+                f"could not load a snapshot of {repo}@{head_sha}, fetching manifests one by one: {err}"
+            )
+            return False
+        log.info(f"building the manifest index of {repo} from the {head_sha} snapshot")
+        versions_by_env = {}
+        failed_envs = []
+        for env in snapshot.env_folders():
+            if env in to_be_ignored:
+                continue
+            try:
+                manifest = snapshot.manifest(env)
+            except ValueError:
+                manifest = None
+            if manifest and "versions" in manifest:
+                versions_by_env[env] = manifest["versions"]
+            else:
+                log.warning(f"could not read the versions block of {env}")
+                failed_envs.append(env)
+        removed_envs = (set(index.env_versions.keys()) | index.failed_envs) - set(
+            versions_by_env.keys()
+        )
+        index.update(head_sha, versions_by_env, failed_envs, removed_envs)
+        index.save()
+        return True
+
+    def refresh_manifest_index(self, repo, to_be_ignored=()):
+        """
+        Bring the manifest index of a repo up to date with its latest commit,
+        re-parsing only the env folders changed since the last indexed commit
+        """
+        index = self._get_manifest_index(repo)
+        last_checked_at = self.manifest_index_checked_at.get(repo, 0)
+        if (
+            index.commit_sha
+            and time.monotonic() - last_checked_at < MANIFEST_INDEX_REFRESH_INTERVAL
+        ):
+            return index
+        head_sha = self._get_head_sha(repo)
+        self.manifest_index_checked_at[repo] = time.monotonic()
+        if index.commit_sha == head_sha and not index.failed_envs:
+            log.debug(f"manifest index of {repo} is up to date ({head_sha})")
+            return index
+
+        changes = None
+        if index.commit_sha:
+            changes = self._get_changed_directories(repo, index.commit_sha, head_sha)
+        if changes is None and self._index_from_snapshot(
+            index, repo, head_sha, to_be_ignored
+        ):
+            return index
+
+        if changes is None:
+            log.info(f"building the manifest index of {repo} from scratch")
+            # listed at head_sha, like the manifests that are fetched below
+            envs_to_parse = {
+                d
+                for d in self._get_directories_from_repo(repo, head_sha)
+                if d not in to_be_ignored
+            }
+            removed_envs = (
+                set(index.env_versions.keys()) | index.failed_envs
+            ) - envs_to_parse
+        else:
+            # the compare API tells which env folders changed and which were deleted,
+            # no need to list the repo
+            changed_dirs, removed_envs = changes
+            envs_to_parse = (
+                {d for d in changed_dirs if d not in to_be_ignored} | index.failed_envs
+            ) - removed_envs
+            log.info(
+                f"updating the manifest index of {repo} from {index.commit_sha} to {head_sha}: {len(envs_to_parse)} env(s) to re-parse"
+            )
+
+        # manifest url -> env folder
+        manifest_urls = {
+            "{}/{}/{}/{}/manifest.json".format(
+                self.raw_base_url, repo, head_sha or "master", env
+            ): env
+            for env in envs_to_parse
+        }
+        versions_by_env = {}
+        failed_envs = []
+        # fetch the manifests concurrently and process them as they arrive
+        for manifest_url, manifest, error in self.crawler.crawl(
+            manifest_urls.keys(), self.httplib.fetch_json
+        ):
+            env = manifest_urls[manifest_url]
+            if error is None and manifest and "versions" in manifest:
+                versions_by_env[env] = manifest["versions"]
+            else:
+                log.warning(f"could not read the versions block of {env}")
+                failed_envs.append(env)
+
+        index.update(head_sha, versions_by_env, failed_envs, removed_envs)
+        index.save()
+        return index
+
     def whereis_version(self, looking_for, version):
         """
         Crawl through all the manifests in cdis-manifest & gitops-qa to check which environments are running a given Gen3 Core Release version or find environments running a specific version of a given service
@@ -61,38 +212,28 @@ class ManifestsChecker:
             "spoke1.workspace.occ-pla.net",
             "workspace.occ-pla.net",
         ]
-        list_of_environments = "```\n"
-        environments_count = 0
 
+        envs_with_version = []
+        environments_count = 0
+        failed_envs = []
         for repo in repos_with_manifests:
-            directories = self._get_directories_from_repo(repo, self._get_ttl_hash())
-            for env in directories:
-                log.debug(
-                    "looking for version: {} in env folder: {}...".format(version, env)
-                )
-                if env not in to_be_ignored:
-                    environments_count += 1
-                    manifest_url = "https://raw.githubusercontent.com/uc-cdis/{}/master/{}/manifest.json".format(
-                        repo, env
-                    )
-                    versions_block = self.httplib.fetch_json(manifest_url)["versions"]
-                    if looking_for == "release":
-                        the_version = (
-                            versions_block["sheepdog"]
-                            if "sheepdog" in versions_block.keys()
-                            else versions_block["indexd"]
-                        )
-                    elif looking_for in versions_block.keys():
-                        the_version = versions_block[looking_for]
-                    else:
-                        continue
-                    match = re.search(".*\:(.*)$", the_version)
-                    if match.group(1) == version:
-                        log.debug("found it!: {}".format(env))
-                        list_of_environments += env + "\n"
-        num_of_envs_with_version = len(list_of_environments.split("\n")) - 2
-        version_adoption = round(
-            (num_of_envs_with_version / environments_count) * 100, 2
+            index = self.refresh_manifest_index(repo, to_be_ignored)
+            if looking_for == "release":
+                envs_with_version += index.envs_on_release(version)
+            else:
+                envs_with_version += index.envs_running(looking_for, version)
+            environments_count += len(index.envs())
+            failed_envs += index.failed_envs
+
+        list_of_environments = "```\n"
+        for env in envs_with_version:
+            log.debug("found it!: {}".format(env))
+            list_of_environments += env + "\n"
+        num_of_envs_with_version = len(envs_with_version)
+        version_adoption = (
+            round((num_of_envs_with_version / environments_count) * 100, 2)
+            if environments_count
+            else 0.0
         )
         log.debug(
             "percentage of envs with [{}:{}]".format(looking_for, version_adoption)
@@ -106,6 +247,10 @@ class ManifestsChecker:
                 version_adoption, environments_count
             )
         )
+        if failed_envs:
+            bot_response += "\n:warning: Could not read the manifest of {} environment(s): {}".format(
+                len(failed_envs), ", ".join(sorted(failed_envs))
+            )
         return bot_response
 
     def compare_manifests(self, pr_to_be_verified, signed_off_env):
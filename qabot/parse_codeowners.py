@@ -1,16 +1,166 @@
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 
+import requests
+
 from qabot.lib.httplib import HttpLib
+from qabot.lib.snapshot import SnapshotLib
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
-CDIS_MANIFEST_LINK = (
-    "https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master/CODEOWNERS"
-)
-GITOPS_QA_LINK = "https://raw.githubusercontent.com/uc-cdis/gitops-qa/master/CODEOWNERS"
+# repos whose CODEOWNERS file maps environments to their owners
+CODEOWNERS_REPOS = ("gen3-gitops", "gen3-gitops-dev", "cdis-manifest", "gitops-qa")
+# how long (in seconds) a parsed CODEOWNERS file is trusted before being revalidated (by ETag)
+CODEOWNERS_TTL = int(os.environ.get("QABOT_CODEOWNERS_TTL", "60"))
+# co-owner of every environment, not an actual owner
+QA_TEAM_HANDLE = "@uc-cdis/planx-qa"
+
+
+def normalize_handle(handle):
+    """'Theowner' / '@theowner' -> '@theowner' (github handles are case insensitive)"""
+    return "@" + handle.strip().lstrip("@").lower()
+
+
+def get_env_folder(pattern):
+    """
+    'gen3.theanvil.io', 'gen3.theanvil.io/' or '/gen3.theanvil.io/' -> 'gen3.theanvil.io',
+    or None if the CODEOWNERS pattern is not an environment folder, i.e. a top-level folder
+    named after a hostname (e.g., '*', '.github/', '/docs/', 'gen3.theanvil.io/portal/')
+    """
+    env = pattern.strip("/")
+    if "*" in env or "/" in env or env.startswith(".") or "." not in env:
+        return None
+    return env
+
+
+def parse_codeowners(codeowners):
+    """
+    {env: [owners]} from the content of a CODEOWNERS file
+    (comments, patterns that are not environment folders and the QA team are ignored)
+    """
+    env_owners = {}
+    for line in codeowners.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        pattern, *handles = line.split()
+        env = get_env_folder(pattern)
+        if env is None:
+            continue
+        env_owners[env] = [
+            h
+            for h in handles
+            if h.startswith("@") and normalize_handle(h) != QA_TEAM_HANDLE
+        ]
+    return env_owners
+
+
+class OwnershipIndex:
+    """
+    Parsed CODEOWNERS files of several repos, indexed in both directions:
+    env -> owners and owner (normalized handle) -> envs.
+    Each repo is tagged with the version (ETag or commit) it was parsed from, so an unchanged
+    file is not parsed again, and is not even revalidated for `ttl` seconds.
+    """
+
+    def __init__(self, ttl=CODEOWNERS_TTL):
+        self.ttl = ttl
+        # repo -> {"version", "checked_at", "env_owners", "owner_envs"}
+        self._repos = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, repo):
+        with self._lock:
+            entry = self._repos.get(repo)
+            return bool(entry) and time.monotonic() - entry["checked_at"] < self.ttl
+
+    def update(self, repo, codeowners, version=None):
+        """index the CODEOWNERS file of `repo`, unless the same version is already indexed"""
+        with self._lock:
+            entry = self._repos.get(repo)
+            if entry and version is not None and entry["version"] == version:
+                entry["checked_at"] = time.monotonic()
+                return False
+        env_owners = parse_codeowners(codeowners)
+        owner_envs = {}
+        for env, owners in env_owners.items():
+            for owner in owners:
+                owner_envs.setdefault(normalize_handle(owner), []).append(env)
+        with self._lock:
+            self._repos[repo] = {
+                "version": version,
+                "checked_at": time.monotonic(),
+                "env_owners": env_owners,
+                "owner_envs": owner_envs,
+            }
+        log.info(f"Indexed the owners of {len(env_owners)} environments of {repo}")
+        return True
+
+    def envs_owned(self, owner, repo):
+        with self._lock:
+            entry = self._repos.get(repo)
+            return (
+                list(entry["owner_envs"].get(normalize_handle(owner), []))
+                if entry
+                else []
+            )
+
+    def envs(self, repo):
+        """all the environments listed in the CODEOWNERS file of `repo`"""
+        with self._lock:
+            entry = self._repos.get(repo)
+            return list(entry["env_owners"]) if entry else []
+
+    def owners(self, env, repos=CODEOWNERS_REPOS):
+        """owners of `env` in the first of `repos` that lists it"""
+        with self._lock:
+            for repo in repos:
+                entry = self._repos.get(repo)
+                if entry and env in entry["env_owners"]:
+                    return list(entry["env_owners"][env])
+        return []
+
+    def env_owners(self, repos=CODEOWNERS_REPOS):
+        """{env: [owners]} merged over `repos`"""
+        env_owners = {}
+        with self._lock:
+            for repo in repos:
+                entry = self._repos.get(repo)
+                if entry:
+                    env_owners.update(
+                        {
+                            env: list(owners)
+                            for env, owners in entry["env_owners"].items()
+                        }
+                    )
+        return env_owners
+
+    def owner_envs(self, repos=CODEOWNERS_REPOS):
+        """{repo: {owner: [envs]}}"""
+        with self._lock:
+            return {
+                repo: {o: list(e) for o, e in self._repos[repo]["owner_envs"].items()}
+                for repo in repos
+                if repo in self._repos
+            }
+
+
+_ownership_index = None
+_ownership_index_lock = threading.Lock()
+
+
+def get_ownership_index():
+    """Return the process-wide OwnershipIndex"""
+    global _ownership_index
+    with _ownership_index_lock:
+        if _ownership_index is None:
+            _ownership_index = OwnershipIndex()
+        return _ownership_index
 
 
 class EnvironmentsManager:
@@ -19,40 +169,78 @@ class EnvironmentsManager:
         Provides utilitary functions to manage environments and their respective config (e.g., owners, etc.)
         """
         self.httplib = self.get_httplib()
+        self.snapshotlib = self.get_snapshotlib()
+        self.ownership_index = self.get_ownership_index()
 
     def get_httplib(self):
         return HttpLib()
 
-    def get_envs_owned(self, user, repo):
-        url = f"https://raw.githubusercontent.com/uc-cdis/{repo}/master/CODEOWNERS"
-        codeowners = self.httplib.fetch_raw_data(url)
-        envs = []
-        if codeowners is None:
-            return []
-        for line in codeowners.splitlines():
-            if user in line:
-                envs.append(line.split()[0])
-        return envs
-
-    def create_dict(self, repo, dict):
+    def get_snapshotlib(self):
+        return SnapshotLib()
+
+    def get_ownership_index(self):
+        return get_ownership_index()
+
+    def _get_codeowners(self, repo):
+        """return the CODEOWNERS file of `repo` and its version (commit or ETag)"""
+        # reuse the snapshot of the repo if one has just been loaded (e.g., by the manifests checker)
+        snapshot = self.snapshotlib.get_latest_loaded_snapshot(repo)
+        if snapshot and snapshot.read("CODEOWNERS") is not None:
+            return snapshot.read("CODEOWNERS"), f"commit:{snapshot.ref}"
         url = f"https://raw.githubusercontent.com/uc-cdis/{repo}/master/CODEOWNERS"
-        CODEOWNERS = self.httplib.fetch_raw_data(url)
-        lines = CODEOWNERS.splitlines()
+        body, etag = self.httplib.fetch_raw_data_with_etag(url)
+        return body, etag and f"etag:{etag}"
+
+    def _refresh_repo(self, repo):
+        try:
+            codeowners, version = self._get_codeowners(repo)
+        except requests.exceptions.RequestException as err:
+            # keep serving the last version we know of
+            log.error(f"could not fetch the CODEOWNERS file of {repo}: {err}")
+            return
+        self.ownership_index.update(repo, codeowners, version)
+
+    def refresh_ownership_index(self, repos=CODEOWNERS_REPOS):
+        """(re)index the CODEOWNERS files of `repos` that are not fresh, concurrently"""
+        stale = [repo for repo in repos if not self.ownership_index.is_fresh(repo)]
+        if not stale:
+            return
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+            list(executor.map(self._refresh_repo, stale))
+        log.info(
+            f"Refreshed the CODEOWNERS of {', '.join(stale)} in {time.perf_counter() - started_at:.2f}s"
+        )
 
-        for line in lines:
-            if line != "":
-                githubIDs = line.split()
-                env = githubIDs.pop(0)
-                # pop planxqa at the end
-                githubIDs.pop(-1)
+    def get_envs_owned(self, user, repo):
+        self.refresh_ownership_index([repo])
+        return self.ownership_index.envs_owned(user, repo)
 
-                dict[env] = githubIDs
+    def get_envs_owned_by(self, users, repos=CODEOWNERS_REPOS):
+        """
+        {repo: [envs]} owned by any of `users` (or every environment if `users` is None),
+        resolved from a single refresh of the ownership index
+        """
+        self.refresh_ownership_index(repos)
+        envs_by_repo = {}
+        for repo in repos:
+            if users is None:
+                envs = self.ownership_index.envs(repo)
+            else:
+                envs = []
+                for user in users:
+                    envs += self.ownership_index.envs_owned(user, repo)
+            # an environment co-owned by several users is only listed once
+            envs_by_repo[repo] = list(dict.fromkeys(envs))
+        return envs_by_repo
 
-    def map_environments_and_owners(self):
-        envdict = {}
+    def get_owners(self, env, repos=CODEOWNERS_REPOS):
+        self.refresh_ownership_index(repos)
+        return self.ownership_index.owners(env, repos)
 
-        self.create_dict(CDIS_MANIFEST_LINK, envdict)
-        self.create_dict(GITOPS_QA_LINK, envdict)
+    def map_environments_and_owners(self, repos=("cdis-manifest", "gitops-qa")):
+        self.refresh_ownership_index(repos)
+        envdict = self.ownership_index.env_owners(repos)
 
         log.info(
             "Returning a map of environments and owners with {} keys".format(
@@ -64,4 +252,4 @@ class EnvironmentsManager:
 
 if __name__ == "__main__":
     em = EnvironmentsManager()
-    print(em.map_environments_and_owners())
+    pprint(em.map_environments_and_owners())
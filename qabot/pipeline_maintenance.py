@@ -1,23 +1,40 @@
-import datetime
 import json
 import logging
 import os
 import re
 import subprocess
+import threading
 import time
 
 import requests
 from ascii_graph import Pyasciigraph
 from requests.exceptions import RequestException
 
+from qabot.ci_stats import get_ci_stats
+from qabot.lib import transport
 from qabot.lib.githublib import GithubLib
 from qabot.lib.influxlib import InfluxLib
 from qabot.lib.jiralib import JiraLib
+from qabot.lib.k8slib import KubernetesError, get_k8slib
+from qabot.lib.scheduler import get_scheduler
 from qabot.lib.slacklib import SlackLib
+from qabot.lib.snapshot import SnapshotLib
+from qabot.suite_index import SUITE_MEMBERS, SuiteIndex
 
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# how often (in seconds) the suite index is checked against the latest commit of gen3-qa
+SUITE_INDEX_REFRESH_INTERVAL = int(
+    os.environ.get("QABOT_SUITE_INDEX_REFRESH_INTERVAL", "300")
+)
+# how long (in seconds) to wait for the post-RunTests stages of a nightly build
+NIGHTLY_BUILD_FOLLOWUP_DELAY = int(
+    os.environ.get("QABOT_NIGHTLY_BUILD_FOLLOWUP_DELAY", "60")
+)
+# e.g., test-portal-homepageTest
+SUITE_LABEL_REGEX = re.compile(r"^test-\w+-\w+$")
+
 
 def singleton(cls):
     instances = {}
@@ -41,8 +58,7 @@ class PipelineMaintenance:
         self.cdis_public_bucket_base_url = (
             "https://cdistest-public-test-bucket.s3.amazonaws.com/"
         )
-        self.in_memory_ci_stats = {}
-        self.in_memory_ci_stats["repos"] = {}
+        self.ci_stats = get_ci_stats()
         self.ci_env_pools = {
             "services": [
                 "jenkins-brain",
@@ -59,6 +75,10 @@ class PipelineMaintenance:
                 "jenkins-new-4",
             ],
         }
+        self.snapshotlib = self.get_snapshotlib()
+        self.suite_index = SuiteIndex.load(os.environ.get("QABOT_SUITE_INDEX_PATH"))
+        self.suite_index_checked_at = 0
+        self._suite_index_lock = threading.Lock()
 
     def get_slacklib(self):
         return SlackLib()
@@ -66,6 +86,57 @@ class PipelineMaintenance:
     def get_githublib(self):
         return GithubLib()
 
+    def get_snapshotlib(self):
+        return SnapshotLib()
+
+    def get_k8slib(self):
+        return get_k8slib()
+
+    def _get_head_sha(self, repo):
+        return GithubLib(repo=repo).get_head_sha()
+
+    def refresh_suite_index(self, wait=True):
+        """
+        Rebuild the suite index from a single snapshot of the gen3-qa suites
+        if master moved since the index was built
+        """
+        if not self._suite_index_lock.acquire(blocking=wait):
+            # another refresh is already running
+            return
+        try:
+            head_sha = self._get_head_sha("gen3-qa")
+            self.suite_index_checked_at = time.monotonic()
+            if head_sha != self.suite_index.commit_sha:
+                snapshot = self.snapshotlib.get_snapshot(
+                    "gen3-qa", head_sha, members=SUITE_MEMBERS
+                )
+                self.suite_index.rebuild(head_sha, snapshot.files)
+                self.suite_index.save()
+        except Exception as err:
+            log.warning(f"could not refresh the suite index: {err}")
+        finally:
+            self._suite_index_lock.release()
+
+    def lookup_test_suite(self, label):
+        """
+        Return the script + feature name of a suite label (None if there's no such suite).
+        Lookups are answered from the suite index, which is refreshed in the background
+        once it gets stale. Only the very first lookup waits for the index to be built.
+        """
+        if self.suite_index.commit_sha is None:
+            self.refresh_suite_index()
+        elif (
+            time.monotonic() - self.suite_index_checked_at
+            > SUITE_INDEX_REFRESH_INTERVAL
+        ):
+            threading.Thread(
+                target=self.refresh_suite_index,
+                kwargs={"wait": False},
+                name="qabot-suite-index",
+                daemon=True,
+            ).start()
+        return self.suite_index.lookup(label)
+
     def _get_ci_env_pool(self, ci_env):
         if ci_env in self.ci_env_pools["services"]:
             return "services"
@@ -77,7 +148,7 @@ class PipelineMaintenance:
     def _get_test_script_source(self, test_script):
         try:
             # try to find the test script that corresponds to the test suite name
-            test_script_lookup = requests.get(
+            test_script_lookup = transport.get(
                 f"https://raw.githubusercontent.com/uc-cdis/gen3-qa/master/{test_script}"
             )
             test_script_lookup.raise_for_status()
@@ -103,6 +174,21 @@ class PipelineMaintenance:
         return feature_name
 
     def unquarantine_ci_env(self, ci_env_name):
+        try:
+            k8slib = self.get_k8slib()
+        except KubernetesError as e:
+            log.error(e)
+            return f"Failed to unquarantine environment {ci_env_name}, please try again or contact QA team"
+        if k8slib:
+            try:
+                # a single patch instead of two kubectl calls
+                k8slib.label_namespace(
+                    ci_env_name, {"quarantine": None, "teardown": "true"}
+                )
+                return f"The environment {ci_env_name} has been removed from quarantine. :awesome-face:"
+            except (KubernetesError, RequestException) as e:
+                log.info(e)
+                return f"Failed to unquarantine environment {ci_env_name}, please try again or contact QA team"
         try:
             command = ["kubectl", "label", "namespace", ci_env_name, "quarantine-"]
             result = subprocess.run(command, capture_output=True, text=True, check=True)
@@ -123,6 +209,18 @@ class PipelineMaintenance:
             return f"Failed to unquarantine environment {ci_env_name}, please try again or contact QA team"
 
     def quarantine_ci_env(self, ci_env_name):
+        try:
+            k8slib = self.get_k8slib()
+        except KubernetesError as e:
+            log.error(e)
+            return f"Failed to quarantine environment {ci_env_name}, please try again or contact QA team"
+        if k8slib:
+            try:
+                k8slib.label_namespace(ci_env_name, {"quarantine": "true"})
+                return f"The environment {ci_env_name} has been placed under quarantine. :face_with_thermometer:"
+            except (KubernetesError, RequestException) as e:
+                log.info(e)
+                return f"Failed to quarantine environment {ci_env_name}, please try again or contact QA team"
         command = [
             "kubectl",
             "label",
@@ -146,47 +244,51 @@ class PipelineMaintenance:
         """
         bot_response = ""
 
-        log.info(f"Fetching feature name from codeceptjs script: {test_suite_name}")
-        # converting label to test script path + file name
-        test_label = test_suite_name.split("-")
-        test_script = "suites/" + test_label[1] + "/" + test_label[2] + ".js"
-
-        try:
-            # try to find the test script that corresponds to the test suite name
-            test_script_source = self._get_test_script_source(test_script)
-        except Exception as err:
-            log.error(str(err))
-            return str(err)
+        if not SUITE_LABEL_REGEX.match(test_suite_name):
+            return f"Invalid test suite label `{test_suite_name}` (e.g., `test-portal-homepageTest`) :thinking:"
 
-        log.debug(f"Looking for the name of the feature in: {test_script}")
-        try:
-            feature_name = self._get_feature_name_from_source(test_script_source)
-        except Exception as err:
-            log.error(str(err))
-            return str(err)
+        suite = self.lookup_test_suite(test_suite_name)
+        if self.suite_index.commit_sha is not None:
+            if suite is None:
+                return (
+                    f"There is no `{test_suite_name}` test suite in gen3-qa :thinking:"
+                )
+            feature_name = suite["feature"]
+            if feature_name is None:
+                return f":facepalm: Could not find the CodeceptJs feature name in script `{suite['script']}`"
+        else:
+            # the index could not be built, read the feature name from the script itself
+            log.info(f"Fetching feature name from codeceptjs script: {test_suite_name}")
+            # converting label to test script path + file name
+            test_label = test_suite_name.split("-")
+            test_script = "suites/" + test_label[1] + "/" + test_label[2] + ".js"
+
+            try:
+                # try to find the test script that corresponds to the test suite name
+                test_script_source = self._get_test_script_source(test_script)
+            except Exception as err:
+                log.error(str(err))
+                return str(err)
+
+            log.debug(f"Looking for the name of the feature in: {test_script}")
+            try:
+                feature_name = self._get_feature_name_from_source(test_script_source)
+            except Exception as err:
+                log.error(str(err))
+                return str(err)
 
         influxlib = InfluxLib()
-        data_points = influxlib.query_ci_metrics(
-            "fail_count", {"suite_name": feature_name}
+        # count the failures of the suite per repo and PR on the server
+        failure_counts = influxlib.count_ci_metrics(
+            "fail_count",
+            {"suite_name": feature_name},
+            group_by=("repo_name", "pr_num"),
         )
-        if data_points:
-            # crunch numbers here
+        if failure_counts:
             test_suite_failures = {}
-
-            # iterate through influxdb's data points obtained from query response
-            for point in data_points:
-                # initialize nested-dictionary of PRs inside the repo_name key if it is not yet created
-                if point["repo_name"] not in test_suite_failures:
-                    test_suite_failures[point["repo_name"]] = {}
-
-                # Count failed PRs per repo_name
-                repo_key = test_suite_failures[point["repo_name"]]
-                (
-                    repo_key.__setitem__(
-                        point["pr_num"], int(repo_key[point["pr_num"]]) + 1
-                    )
-                    if point["pr_num"] in repo_key
-                    else repo_key.__setitem__(point["pr_num"], 1)
+            for row in failure_counts:
+                test_suite_failures.setdefault(row["repo_name"], {})[row["pr_num"]] = (
+                    int(row["count"])
                 )
 
             log.debug(f"###  ## FINAL test_suite_failures: {test_suite_failures}")
@@ -210,39 +312,8 @@ class PipelineMaintenance:
         return bot_response
 
     def _populate_ci_stats(self, msg_event_ts, repo_name, pr_number, ci_results):
-        msg_timestamp = datetime.datetime.fromtimestamp(msg_event_ts)
-        print(f"### ## msg_timestamp: {msg_timestamp}")
-
-        # purge ci stats from the past whenever a new jenkins msg is sent on the next day
-        # if we don't do this, the in-memory dict will keep growing indefinitely
-        if "latest_entry_ts" in self.in_memory_ci_stats:
-            date1 = self.in_memory_ci_stats["latest_entry_ts"]
-            date2 = msg_timestamp
-            # diff between timestamps
-            diff_between_timestamps = abs(date2 - date1).days
-            log.debug(f"### ## diff between timestamps: {diff_between_timestamps}")
-
-            if diff_between_timestamps > 0:
-                # reset everything so we don't store more than a day's worth of CI stats
-                log.warn("Resetting CI stats...")
-                self.in_memory_ci_stats["repos"] = {}
-        else:
-            self.in_memory_ci_stats["latest_entry_ts"] = msg_timestamp
-
-        if repo_name not in self.in_memory_ci_stats:
-            self.in_memory_ci_stats["repos"][repo_name] = {}
-
         stats_key = "failed" if "failed" in ci_results else "successful"
-        if stats_key not in self.in_memory_ci_stats["repos"][repo_name]:
-            self.in_memory_ci_stats["repos"][repo_name][stats_key] = {}
-
-        pr = f"PR-{pr_number}"
-        repo_stats_mapping = self.in_memory_ci_stats["repos"][repo_name][stats_key]
-        (
-            repo_stats_mapping.__setitem__(pr, repo_stats_mapping[pr] + 1)
-            if pr in repo_stats_mapping
-            else repo_stats_mapping.__setitem__(pr, 1)
-        )
+        self.ci_stats.record(msg_event_ts, repo_name, pr_number, stats_key)
 
     def _identify_pr_details_from_jenkins_notification(self, jenkins_msg):
         # identify repo_name and pr_number in the msg
@@ -263,34 +334,63 @@ class PipelineMaintenance:
             )
             return None, None
 
+    def _nightly_build_followup(self, repo_name, pr_number, msg_event_ts, reply):
+        """
+        Collect the stats of a nightly-build run once its post-RunTests stages are done
+        and post them as a threaded reply
+        """
+        bot_response = "Additional nightly-build stats :moon: \n"
+        bot_response += self.ci_benchmarking(repo_name, pr_number, "K8sReset")
+        bot_response += self.ci_benchmarking(repo_name, pr_number, "RunTests")
+        ci_results = self.fetch_ci_failures(repo_name, pr_number)
+        bot_response += ci_results
+        log.info("populating ci stats....")
+        self._populate_ci_stats(msg_event_ts, repo_name, pr_number, ci_results)
+        if reply:
+            reply(bot_response)
+        else:
+            log.info(bot_response)
+
     # TODO: This should empower auto-replay features
     # based on test suite's failure rate
-    def react_to_jenkins_updates(self, jenkins_slack_msg_raw):
+    def react_to_jenkins_updates(self, jenkins_slack_msg_raw, reply=None):
+        """
+        Track the CI results announced by Jenkins on Slack.
+        For nightly builds, the stats are collected once the remaining pipeline stages
+        had time to finish (without blocking the caller) and posted through `reply(text)`,
+        which should answer in the thread of the Jenkins message.
+        All the notifications of a PR received while its follow-up is pending (e.g., the
+        per-stage messages of a single nightly run) are folded into that follow-up,
+        so they account for a single CI stats sample.
+        Not connected to the Slack message events yet: fetch_ci_failures and
+        ci_benchmarking are still to be implemented.
+        """
         log.debug(f"###  ## Slack msg from Jenkins: {jenkins_slack_msg_raw}")
         msg_event_ts = int(jenkins_slack_msg_raw["event_ts"].split(".")[0])
 
-        bot_response = ""
         actual_msg = jenkins_slack_msg_raw["attachments"][0]["fields"][0]["value"]
 
         # if a CI notification is sent to the #nightly-builds channel
         if jenkins_slack_msg_raw["channel"] == "C01TS6PDMRT":
             log.info("new Jenkins msg on the #nightly-builds channel...")
-            bot_response += "Additional nightly-build stats :moon: \n"
             repo_name, pr_number = self._identify_pr_details_from_jenkins_notification(
                 actual_msg
             )
 
             if repo_name and pr_number:
-                bot_response += self.ci_benchmarking(repo_name, pr_number, "K8sReset")
-                bot_response += self.ci_benchmarking(repo_name, pr_number, "RunTests")
-                # wait for the remaining pipeline stages (post-RunTests)
-                time.sleep(60)
-                ci_results = self.fetch_ci_failures(repo_name, pr_number)
-                bot_response += ci_results
-                log.info("populating ci stats....")
-                self._populate_ci_stats(msg_event_ts, repo_name, pr_number, ci_results)
-
-                return bot_response
+                # wait for the remaining pipeline stages (post-RunTests),
+                # notifications of the same run that arrive meanwhile share the follow-up
+                scheduled = get_scheduler().call_later(
+                    NIGHTLY_BUILD_FOLLOWUP_DELAY,
+                    lambda: self._nightly_build_followup(
+                        repo_name, pr_number, msg_event_ts, reply
+                    ),
+                    key=("nightly-build-followup", repo_name, pr_number),
+                )
+                if not scheduled:
+                    log.info(
+                        f"nightly-build stats of {repo_name} #{pr_number} are already on their way"
+                    )
         # if a CI notification is sent to the #gen3-qa-notifications channel
         elif jenkins_slack_msg_raw["channel"] == "C0183EFTPLG":
             log.info("new Jenkins msg on the #gen3-qa-notifications channel...")
@@ -334,7 +434,7 @@ class PipelineMaintenance:
         contents_url = (
             "https://api.github.com/repos/uc-cdis/qa-bot/contents/qabot/repo_owner.json"
         )
-        contents_url_info = requests.get(
+        contents_url_info = transport.get(
             contents_url,
             headers={
                 "Authorization": "token {}".format(os.environ["GITHUB_TOKEN"].strip()),
@@ -342,7 +442,7 @@ class PipelineMaintenance:
             },
         ).json()
         download_url = contents_url_info["download_url"]
-        r = requests.get(
+        r = transport.get(
             download_url,
             headers={
                 "Authorization": "token {}".format(os.environ["GITHUB_TOKEN"].strip())
@@ -363,34 +463,23 @@ class PipelineMaintenance:
         return bot_response
 
     def get_ci_summary(self):
-        print(f"### ## self.in_memory_ci_stats: {self.in_memory_ci_stats}")
-
-        prs_tuples = {"failed": [], "successful": []}
-        repos_list = self.in_memory_ci_stats["repos"].keys()
-
-        for result in ["failed", "successful"]:
-            for repo in repos_list:
-                per_repo_counter = 0
-                if result in self.in_memory_ci_stats["repos"][repo]:
-                    for pr in self.in_memory_ci_stats["repos"][repo][result].keys():
-                        per_repo_counter += self.in_memory_ci_stats["repos"][repo][
-                            result
-                        ][pr]
-                prs_tuples[result].append((repo, per_repo_counter))
-
-        failed_prs = prs_tuples["failed"]
-
         bot_response = "CI Summary:"
         output = "```"
         graph = Pyasciigraph()
-        for line in graph.graph("Failed PR checks:", failed_prs):
-            output += line + "\n"
-
-        successful_prs = prs_tuples["successful"]
-
-        output += "\n"
-        for line in graph.graph("Successful PR checks:", successful_prs):
-            output += line + "\n"
+        for period, hours in (("last 24h", 24), ("last 7d", 24 * 7)):
+            repo_totals = sorted(self.ci_stats.repo_totals(hours).items())
+            log.debug(f"CI stats ({period}): {repo_totals}")
+            for result, title in (
+                ("failed", "Failed PR checks"),
+                ("successful", "Successful PR checks"),
+            ):
+                prs_tuples = [(repo, totals[result]) for repo, totals in repo_totals]
+                if not prs_tuples:
+                    output += f"{title} ({period}): none\n\n"
+                    continue
+                for line in graph.graph(f"{title} ({period}):", prs_tuples):
+                    output += line + "\n"
+                output += "\n"
 
         output += "```"
         bot_response += output
@@ -405,15 +494,11 @@ class PipelineMaintenance:
             if " " in labels:
                 raise Exception("Whitespace found in comma-separated list of labels")
             if len(labels) > 0:
-                labels = labels.split(",")
+                labels = [label.replace("*", "") for label in labels.split(",")]
                 log.info("applying labels...")
-                for i, label in enumerate(labels):
-                    # only override all labels on the first iteration
-                    override_all = i == 0
-                    githublib.set_label_to_pr(
-                        int(pr_number), label.replace("*", ""), override_all
-                    )
-                    log.debug("applied label: {}".format(label))
+                # override all the existing labels with a single call
+                githublib.set_labels_to_pr(int(pr_number), labels)
+                log.debug("applied labels: {}".format(labels))
             else:
                 log.info("Replaying PR without labels...")
         except Exception as err:
@@ -472,7 +557,7 @@ class PipelineMaintenance:
             raise Exception(f"Failed to trigger workflow: {bot_response.status_code}")
         return bot_response
 
-    def test_external_pr(self, repo_name, pr_num):
+    def test_external_pr(self, repo_name, pr_num, reply=None):
         workflow_repo_name = "gen3-code-vigil"
         githublib = GithubLib(repo=workflow_repo_name)
 
@@ -488,6 +573,19 @@ class PipelineMaintenance:
         )
         if bot_response.status_code == 204:
             log.info("Workflow triggered successfully.")
+            if reply:
+                # reply in the thread once the PR shows up instead of holding a worker
+                githublib.wait_for_external_pr(
+                    repo_name=repo_name,
+                    search_title=pr_num,
+                    on_found=lambda url: reply(
+                        f"Started external pr testing. URL: {url}. :awesome-face:"
+                    ),
+                    on_timeout=lambda: reply(
+                        "Could not find the external testing pr, please contact QA team."
+                    ),
+                )
+                return f"Triggered external pr testing for {repo_name} PR #{pr_num}, I'll post the testing PR here as soon as it shows up. :eyes:"
             extenral_testing_pr_url = githublib.get_external_pr_number(
                 repo_name=repo_name, search_title=pr_num
             )
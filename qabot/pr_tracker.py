@@ -0,0 +1,177 @@
+import logging
+import os
+import sqlite3
+import threading
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# PRs kept per repo: older ones fall out of every window listed by `pull_requests`
+PR_TRACKER_MAX_PRS = int(os.environ.get("QABOT_PR_TRACKER_MAX_PRS", "2000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pull_requests (
+    repo TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    env_folder TEXT,
+    state TEXT NOT NULL,
+    merged_at TEXT,
+    title TEXT,
+    html_url TEXT,
+    head_sha TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (repo, number)
+);
+CREATE INDEX IF NOT EXISTS pull_requests_by_env ON pull_requests (repo, env_folder);
+CREATE TABLE IF NOT EXISTS sync_cursors (
+    repo TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL
+);
+"""
+
+COLUMNS = (
+    "repo",
+    "number",
+    "env_folder",
+    "state",
+    "merged_at",
+    "title",
+    "html_url",
+    "head_sha",
+    "updated_at",
+)
+
+
+class PRTracker:
+    """
+    Local store of the PRs of the manifest repos, keyed by (repo, PR number).
+    It keeps the env folder, state and merge date of every PR it has seen plus,
+    for every repo, the `updated_at` of the most recent PR synced (the sync cursor),
+    so each sync only needs to fetch the PRs that changed since the previous one.
+    The store lives in a sqlite file (or in memory if no path is given) and only keeps
+    the `max_prs` most recent PRs of each repo, so it does not grow forever.
+    """
+
+    def __init__(self, path=None, max_prs=PR_TRACKER_MAX_PRS):
+        self.path = path
+        self.max_prs = max_prs
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def get_cursor(self, repo):
+        """`updated_at` of the most recent PR synced for `repo` (None if never synced)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated_at FROM sync_cursors WHERE repo = ?", (repo,)
+            ).fetchone()
+        return row["updated_at"] if row else None
+
+    def set_cursor(self, repo, updated_at):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sync_cursors (repo, updated_at) VALUES (?, ?)",
+                (repo, updated_at),
+            )
+
+    def get(self, repo, numbers):
+        """return the stored PRs of `repo` with the given numbers, keyed by number"""
+        numbers = list(numbers)
+        if not numbers:
+            return {}
+        placeholders = ",".join("?" * len(numbers))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM pull_requests WHERE repo = ? AND number IN ({placeholders})",
+                [repo] + numbers,
+            ).fetchall()
+        return {row["number"]: dict(row) for row in rows}
+
+    def upsert(self, repo, pull_requests):
+        """
+        store PRs as returned by the REST API (or the GraphQL backend of GithubLib)
+        with an extra `env_folder` key
+        """
+        rows = [
+            (
+                repo,
+                pr["number"],
+                pr.get("env_folder"),
+                pr["state"],
+                pr["merged_at"],
+                pr["title"],
+                pr["html_url"],
+                pr["head"]["sha"],
+                pr["updated_at"],
+            )
+            for pr in pull_requests
+        ]
+        with self._lock, self._db:
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO pull_requests ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+            pruned = self._db.execute(
+                """
+                DELETE FROM pull_requests WHERE repo = ? AND number < (
+                    SELECT MIN(number) FROM (
+                        SELECT number FROM pull_requests WHERE repo = ?
+                        ORDER BY number DESC LIMIT ?
+                    )
+                )
+                """,
+                (repo, repo, self.max_prs),
+            ).rowcount
+        if pruned:
+            log.debug(f"pruned {pruned} old PR(s) of {repo} from the tracker")
+
+    def pull_requests(self, repo, state="all", limit=50, env_folders=None):
+        """
+        return the `limit` most recent PRs of `repo` in the given state ("open", "closed" or "all"),
+        newest first, leaving out the abandoned ones (closed without merging) and,
+        if `env_folders` is given, the ones that do not touch any of them
+        """
+        query = "SELECT * FROM pull_requests WHERE repo = ?"
+        params = [repo]
+        if state != "all":
+            query += " AND state = ?"
+            params.append(state)
+        # same window as listing the most recent PRs with the REST API
+        query = f"SELECT * FROM ({query} ORDER BY number DESC LIMIT ?)"
+        params.append(limit)
+        query += " WHERE NOT (state = 'closed' AND merged_at IS NULL)"
+        if env_folders is not None:
+            env_folders = list(env_folders)
+            query += f" AND env_folder IN ({','.join('?' * len(env_folders))})"
+            params += env_folders
+        query += " ORDER BY number DESC"
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, repo=None):
+        with self._lock:
+            if repo is None:
+                row = self._db.execute("SELECT COUNT(*) FROM pull_requests").fetchone()
+            else:
+                row = self._db.execute(
+                    "SELECT COUNT(*) FROM pull_requests WHERE repo = ?", (repo,)
+                ).fetchone()
+        return row[0]
+
+
+_tracker = None
+_tracker_lock = threading.Lock()
+
+
+def get_pr_tracker():
+    """Return the process-wide PRTracker (stored in QABOT_PR_TRACKER_DB, if set)"""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = PRTracker(os.environ.get("QABOT_PR_TRACKER_DB"))
+        return _tracker
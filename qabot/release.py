@@ -1,5 +1,8 @@
 import logging
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from qabot.lib.githublib import GithubLib
 from qabot.parse_codeowners import EnvironmentsManager
@@ -7,6 +10,21 @@ from qabot.parse_codeowners import EnvironmentsManager
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# gitops repos the monthly releases are rolled out to
+RELEASE_TARGET_REPOS = ("gen3-gitops-dev", "gen3-gitops")
+# process-wide cache of the latest release: {"release", "commit_sha"}
+_latest_release = {}
+_latest_release_lock = threading.Lock()
+
+
+def clear_latest_release_cache():
+    with _latest_release_lock:
+        _latest_release.clear()
+
+
+def format_timings(timings):
+    return ", ".join(f"{step} {seconds:.2f}s" for step, seconds in timings.items())
+
 
 class ReleaseManager:
     def __init__(self):
@@ -18,83 +36,199 @@ class ReleaseManager:
     def get_githublib(self):
         return GithubLib()
 
-    def find_latest_release(self):
-        # find latest published gen3 release
-        github_client = self.get_githublib()
-
-        # TODO: Make sure only PMs are allowed to invoke this command
-        # Correlate Slack user ID and Slack Full Name with the github user id in CODEOWNERS
+    def get_environments_manager(self):
+        return EnvironmentsManager()
 
+    def _list_latest_release(self, github_client, ref):
         # TODO: Figure out a better way to identify the latest release
         # Identify most recent year folder among published releases
-        year_folders = github_client.list_files_in_dir("releases")
+        year_folders = github_client.list_files_in_dir("releases", ref=ref)
         latest_year = sorted(year_folders)[-1]
         log.info("latest_year: {}".format(latest_year))
         # Identify most recent month folder among published releases
         month_folders = github_client.list_files_in_dir(
-            "releases/{}".format(latest_year)
+            "releases/{}".format(latest_year), ref=ref
         )
         latest_month = sorted(month_folders)[-1]
 
-        latest_release = "{}.{}".format(latest_year, latest_month)
+        return "{}.{}".format(latest_year, latest_month)
 
-        log.info("The latest published Gen3 Release is {}".format(latest_release))
+    def find_latest_release(self):
+        """
+        find latest published gen3 release.
+        The head commit of the releases repo is checked on every call (a single request),
+        the release folders are only listed again when it moved.
+        """
+        with _latest_release_lock:
+            cached = dict(_latest_release)
 
+        # TODO: Make sure only PMs are allowed to invoke this command
+        # Correlate Slack user ID and Slack Full Name with the github user id in CODEOWNERS
+        github_client = self.githublib
+        commit_sha = github_client.get_head_sha()
+        if cached and cached["commit_sha"] == commit_sha:
+            latest_release = cached["release"]
+        else:
+            latest_release = self._list_latest_release(github_client, commit_sha)
+            log.info("The latest published Gen3 Release is {}".format(latest_release))
+        with _latest_release_lock:
+            _latest_release.update(release=latest_release, commit_sha=commit_sha)
         return latest_release
 
+    def _dispatch_release(self, repo_name, env_list, latest_release, user, thread_ts):
+        """trigger the thor workflow that creates the release PRs of `env_list` in `repo_name`"""
+        # Print out the envs release PR creation message
+        [log.info(f"creating release PR for {e}") for e in env_list]
+
+        json_params = {
+            "RELEASE_VERSION": latest_release,
+            "LIST_OF_ENVIRONMENTS": ",".join(env_list),
+            "TARGET_REPO_NAME": repo_name,
+            "TRIGGERED_BY_USER": user,
+            "SLACK_THREAD_TS": str(thread_ts),
+        }
+        bot_response = self.githublib.trigger_gh_action_workflow(
+            workflow_repo="thor",
+            workflow_filename="deploy_monthly_release.yaml",
+            ref="master",
+            inputs=json_params,
+        )
+        if bot_response.status_code == 204:
+            log.info("Workflow triggered successfully.")
+        else:
+            log.error(bot_response.text)
+            raise Exception(f"Failed to trigger workflow: {bot_response.status_code}")
+
+    def _roll_out_to_repo(self, em, repo_name, latest_release, user, thread_ts):
+        """
+        trigger the release PRs of the environments of `repo_name` owned by `user`.
+        Returns (envs, {step: seconds})
+        """
+        timings = {}
+        started_at = time.perf_counter()
+        env_list = em.get_envs_owned(user, repo_name)
+        timings[f"{repo_name} ownership"] = time.perf_counter() - started_at
+
+        # Nothing to roll out in this repo
+        if len(env_list) == 0:
+            return env_list, timings
+
+        started_at = time.perf_counter()
+        self._dispatch_release(repo_name, env_list, latest_release, user, thread_ts)
+        timings[f"{repo_name} dispatch"] = time.perf_counter() - started_at
+        return env_list, timings
+
     def roll_out_latest_gen3_release_to_environments(self, user, thread_ts):
-        latest_release = self.find_latest_release()
+        # "all" or a comma-separated list of github handles
+        if user == "all" or "," in user:
+            return self.roll_out_latest_gen3_release_to_owners(user, thread_ts)
 
-        # find all environments owned by the user
-        em = EnvironmentsManager()
+        timings = {}
+        started_at = time.perf_counter()
+        latest_release = self.find_latest_release()
+        timings["latest release"] = time.perf_counter() - started_at
+
+        # find all environments owned by the user, one repo per thread
+        em = self.get_environments_manager()
+        with ThreadPoolExecutor(max_workers=len(RELEASE_TARGET_REPOS)) as executor:
+            futures = [
+                executor.submit(
+                    self._roll_out_to_repo,
+                    em,
+                    repo_name,
+                    latest_release,
+                    user,
+                    thread_ts,
+                )
+                for repo_name in RELEASE_TARGET_REPOS
+            ]
+            results = [future.result() for future in futures]
 
         prs_count = 0
-        ghl = self.githublib
         url_list = []
-
-        for repo_name in ["gen3-gitops-dev", "gen3-gitops"]:
-            env_list = em.get_envs_owned(user, repo_name)
+        for repo_name, (env_list, repo_timings) in zip(RELEASE_TARGET_REPOS, results):
+            timings.update(repo_timings)
             prs_count += len(env_list)
-
-            # Continue to the next env_list if no entries in current env list
-            if len(env_list) == 0:
-                continue
-
-            # Print out the envs release PR creation message
-            [log.info(f"creating release PR for {e}") for e in env_list]
-
-            json_params = {
-                "RELEASE_VERSION": latest_release,
-                "LIST_OF_ENVIRONMENTS": ",".join(env_list),
-                "TARGET_REPO_NAME": repo_name,
-                "TRIGGERED_BY_USER": user,
-                "SLACK_THREAD_TS": str(thread_ts),
-            }
-            bot_response = ghl.trigger_gh_action_workflow(
-                workflow_repo="thor",
-                workflow_filename="deploy_monthly_release.yaml",
-                ref="master",
-                inputs=json_params,
-            )
-            if bot_response.status_code == 204:
-                log.info("Workflow triggered successfully.")
-            else:
-                log.error(bot_response.text)
-                raise Exception(
-                    f"Failed to trigger workflow: {bot_response.status_code}"
-                )
-            url_list.append(f"https://github.com/uc-cdis/{repo_name}/pulls")
+            if env_list:
+                url_list.append(f"https://github.com/uc-cdis/{repo_name}/pulls")
+        timings["total"] = time.perf_counter() - started_at
 
         log.info(
-            f"Creating release PRs for {prs_count} environments owned by user {user}"
+            f"Creating release PRs for {prs_count} environments owned by user {user} ({format_timings(timings)})"
         )
         if prs_count == 0:
             bot_response = "Please check the github handle of the user, could not find any environments owned"
         else:
             bot_response = f"The release is being rolled out... :clock1: Check {', '.join(url_list)} to see the PRs"
-        return bot_response
+        return f"{bot_response}\n_timings: {format_timings(timings)}_"
+
+    def roll_out_latest_gen3_release_to_owners(self, owners, thread_ts):
+        """
+        Roll out the latest release to the environments of several owners at once
+        (`owners`: list or comma-separated github handles, or "all"), with a single
+        workflow dispatch per target repo
+        """
+        if isinstance(owners, str):
+            owners = None if owners == "all" else [o for o in owners.split(",") if o]
+        triggered_by = "all" if owners is None else ",".join(owners)
+
+        timings = {}
+        started_at = time.perf_counter()
+        latest_release = self.find_latest_release()
+        timings["latest release"] = time.perf_counter() - started_at
+
+        step_started_at = time.perf_counter()
+        em = self.get_environments_manager()
+        envs_by_repo = em.get_envs_owned_by(owners, RELEASE_TARGET_REPOS)
+        timings["ownership"] = time.perf_counter() - step_started_at
+        unknown_owners = [
+            owner
+            for owner in owners or []
+            if not any(
+                em.ownership_index.envs_owned(owner, repo)
+                for repo in RELEASE_TARGET_REPOS
+            )
+        ]
+
+        repos = [repo for repo in RELEASE_TARGET_REPOS if envs_by_repo[repo]]
+        step_started_at = time.perf_counter()
+        if repos:
+            with ThreadPoolExecutor(max_workers=len(repos)) as executor:
+                futures = [
+                    executor.submit(
+                        self._dispatch_release,
+                        repo_name,
+                        envs_by_repo[repo_name],
+                        latest_release,
+                        triggered_by,
+                        thread_ts,
+                    )
+                    for repo_name in repos
+                ]
+                [future.result() for future in futures]
+        timings["dispatch"] = time.perf_counter() - step_started_at
+        timings["total"] = time.perf_counter() - started_at
+
+        prs_count = sum(len(envs_by_repo[repo]) for repo in repos)
+        log.info(
+            f"Creating release PRs for {prs_count} environments owned by {triggered_by} "
+            f"with {len(repos)} dispatch(es) ({format_timings(timings)})"
+        )
+        if prs_count == 0:
+            bot_response = (
+                "Please check the github handles, could not find any environments owned"
+            )
+        else:
+            summary = ", ".join(
+                f"{len(envs_by_repo[repo])} in https://github.com/uc-cdis/{repo}/pulls"
+                for repo in repos
+            )
+            bot_response = f"The release is being rolled out to {prs_count} environments... :clock1: Check the PRs ({summary})"
+        if unknown_owners:
+            bot_response += f"\nNo environments owned by {', '.join(unknown_owners)}"
+        return f"{bot_response}\n_timings: {format_timings(timings)}_"
 
 
 if __name__ == "__main__":
     rm = ReleaseManager()
-    print(rm.roll_out_latest_gen3_release_to_environments("gkuffel"))
+    print(rm.roll_out_latest_gen3_release_to_environments("gkuffel", None))
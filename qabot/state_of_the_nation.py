@@ -1,15 +1,25 @@
-import requests
+from qabot.lib import transport
+from qabot.lib.crawler import Crawler
 from qabot.lib.slacklib import SlackLib
-from qabot.lib.githublib import GithubLib
+from qabot.lib.githublib import GithubGraphQLError, GithubLib, log_api_usage
 from qabot.lib.httplib import HttpLib
+from qabot.lib.snapshot import SnapshotLib
+from qabot.pr_tracker import get_pr_tracker
 import json
 import os
 import re
 import logging
 
+from requests.exceptions import RequestException
+
 logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
 log = logging.getLogger(__name__)
 
+# how many of the most recently updated PRs are synced the first time a repo is tracked
+PR_TRACKER_BACKFILL = int(os.environ.get("QABOT_PR_TRACKER_BACKFILL", "200"))
+# upper bound of the PRs fetched by a single incremental sync
+MAX_SYNCED_PRS = 1000
+
 
 class StateOfTheNation:
     def __init__(self):
@@ -172,6 +182,9 @@ class StateOfTheNation:
         self.slacklib = self.get_slacklib()
         self.githublib = self.get_githublib()
         self.httplib = self.get_httplib()
+        self.snapshotlib = self.get_snapshotlib()
+        self.crawler = self.get_crawler()
+        self.pr_tracker = self.get_pr_tracker()
 
     def get_slacklib(self):
         return SlackLib()
@@ -182,8 +195,148 @@ class StateOfTheNation:
     def get_httplib(self):
         return HttpLib()
 
+    def get_snapshotlib(self):
+        return SnapshotLib()
+
+    def get_crawler(self):
+        return Crawler()
+
+    def get_pr_tracker(self):
+        return get_pr_tracker()
+
+    def _get_repo_snapshot(self, repo):
+        try:
+            head_sha = GithubLib(repo=repo).get_head_sha()
+            return self.snapshotlib.get_snapshot(repo, head_sha)
+        except Exception as err:
+            log.warning(
+                f"could not load a snapshot of {repo}, fetching manifests one by one: {err}"
+            )
+            return None
+
+    def _get_versions_block(self, snapshot, repo, env):
+        manifest = snapshot.manifest(env) if snapshot else None
+        if manifest is None:
+            manifest_url = "https://raw.githubusercontent.com/uc-cdis/{}/master/{}/manifest.json".format(
+                repo, env
+            )
+            manifest = self.httplib.fetch_json(manifest_url)
+        return manifest["versions"]
+
+    def _resolve_pr_env_folders(self, repo, pull_requests, token):
+        """
+        Map PR numbers to the env folder of the first file they touch.
+        Env folders already tracked for the same head SHA are reused
+        and the remaining lookups are fanned out concurrently.
+        """
+        env_folders = {}
+        files_urls = {}
+        tracked = self.pr_tracker.get(repo, [pr["number"] for pr in pull_requests])
+        for pr in pull_requests:
+            known = tracked.get(pr["number"])
+            if (
+                known
+                and known["head_sha"] == pr["head"]["sha"]
+                and known["env_folder"] is not None
+            ):
+                env_folders[pr["number"]] = known["env_folder"]
+                continue
+            # abandoned PRs (closed without merging) are never reported
+            if pr["state"] == "closed" and not pr["merged_at"]:
+                env_folders[pr["number"]] = ""
+                continue
+            # only the first file is needed
+            files_urls[
+                f"https://api.github.com/repos/uc-cdis/{repo}/pulls/{pr['number']}/files?per_page=1"
+            ] = pr["number"]
+        log.info(
+            f"{len(env_folders)} PR(s) resolved from the tracker, fetching files of {len(files_urls)} PR(s)"
+        )
+        log_api_usage("rest", "pull request files", len(files_urls))
+
+        def fetch_pr_files(url):
+            response = transport.get(url, auth=("PlanXCyborg", token))
+            response.raise_for_status()
+            return response.json()
+
+        for url, pr_files, error in self.crawler.crawl(
+            files_urls.keys(), fetch_pr_files
+        ):
+            if error is not None:
+                continue
+            env_folder_name = pr_files[0]["filename"].split("/")[0] if pr_files else ""
+            env_folders[files_urls[url]] = env_folder_name
+        return env_folders
+
+    def _get_updated_pull_requests(self, ghlib, repo, since, limit):
+        """
+        Fetch (at most `limit` of) the PRs of `repo` updated since `since`, most recently
+        updated first, and map them to the env folder of the first file they touch.
+        The GraphQL backend returns both in a single paged query,
+        the REST backend needs one extra request per PR (see _resolve_pr_env_folders).
+        """
+        if ghlib.use_graphql():
+            try:
+                pull_requests = GithubLib(
+                    repo=repo, token=ghlib.token
+                ).get_pull_requests_with_files("all", limit, updated_since=since)
+                env_folders = {
+                    pr["number"]: pr["files"][0].split("/")[0] if pr["files"] else ""
+                    for pr in pull_requests
+                }
+                return pull_requests, env_folders
+            except (GithubGraphQLError, RequestException) as err:
+                log.warning(f"GraphQL lookup failed, falling back to REST: {err}")
+
+        pull_requests = []
+        per_page = min(limit, 100)
+        page = 1
+        while len(pull_requests) < limit:
+            url = f"https://api.github.com/repos/uc-cdis/{repo}/pulls?state=all&sort=updated&direction=desc&per_page={per_page}&page={page}"
+            log.info(f"Shooting a GET request to {url}...")
+            response = transport.get(url, auth=("PlanXCyborg", ghlib.token))
+            response.raise_for_status()
+            batch = response.json()
+            recent = [pr for pr in batch if not since or pr["updated_at"] >= since]
+            pull_requests += recent
+            if len(batch) < per_page or len(recent) < len(batch):
+                break
+            page += 1
+        log_api_usage("rest", "pull requests", page)
+        pull_requests = pull_requests[:limit]
+        env_folders = self._resolve_pr_env_folders(repo, pull_requests, ghlib.token)
+        return pull_requests, env_folders
+
+    def sync_pull_requests(self, ghlib, repo):
+        """
+        Bring the PR tracker up to date with the PRs of `repo` changed since the last sync
+        """
+        since = self.pr_tracker.get_cursor(repo)
+        limit = MAX_SYNCED_PRS if since else PR_TRACKER_BACKFILL
+        pull_requests, env_folders = self._get_updated_pull_requests(
+            ghlib, repo, since, limit
+        )
+        for pr in pull_requests:
+            pr["env_folder"] = env_folders.get(pr["number"])
+        self.pr_tracker.upsert(repo, pull_requests)
+
+        # PRs whose files could not be fetched are picked up again by the next sync
+        unresolved = [
+            pr["updated_at"] for pr in pull_requests if pr["env_folder"] is None
+        ]
+        if unresolved:
+            self.pr_tracker.set_cursor(repo, min(unresolved))
+        elif pull_requests:
+            self.pr_tracker.set_cursor(
+                repo, max(pr["updated_at"] for pr in pull_requests)
+            )
+        log.info(
+            f"Synced {len(pull_requests)} PR(s) of {repo} updated since {since}, tracking {self.pr_tracker.count(repo)} PR(s)"
+        )
+
     def get_slack_user_id(self, real_name):
-        return self.get_slacklib(real_name)["id"]
+        user = self.slacklib.get_user_info(real_name)
+        return user["id"] if user else None
 
     def run_state_of_the_nation_report(
         self, project_name, state_of_the_prs, num_of_prs_to_scan=50
@@ -204,62 +357,44 @@ class StateOfTheNation:
 
         # Fetch all the PRs opened for the environments correspondent to the project
         ghlib = self.get_githublib()
-        github_client = ghlib.get_github_client()
 
         # TODO: Also track PRs in gitops-qa
-        # fetch the most recent PRs (arbitrarily 200 of them... that should be enough)
-        log.info(
-            f"Shooting a GET request to https://api.github.com/repos/uc-cdis/cdis-manifest/pulls?per_page={num_of_prs_to_scan}&state={state_of_the_prs}..."
-        )
-        get_pull_requests = requests.get(
-            f"https://api.github.com/repos/uc-cdis/cdis-manifest/pulls?per_page={num_of_prs_to_scan}&state={state_of_the_prs}",
-            auth=("PlanXCyborg", ghlib.token),
-        )
-        # print(pull_requests_resp.json())
-
-        for pr in get_pull_requests.json():
-            log.info(f"pr #: {pr['number']}")
-            # fetch the first file referenced on the PR
-            get_pr_files = requests.get(
-                f"https://api.github.com/repos/uc-cdis/cdis-manifest/pulls/{pr['number']}/files",
-                auth=("PlanXCyborg", ghlib.token),
+        the_repo = "cdis-manifest"
+        try:
+            self.sync_pull_requests(ghlib, the_repo)
+        except Exception as err:
+            log.warning(
+                f"could not sync the PRs of {the_repo}, using the last sync: {err}"
             )
-            pr_files = get_pr_files.json()
-            env_folder_name = pr_files[0]["filename"].split("/")[0]
-            log.debug(f"1st file from this pr: {env_folder_name}")
-
-            # ignore dotted files
-            if env_folder_name[0] == ".":
-                continue
-
-            # ignore PRs that are closed without merging (abandoned)
-            if pr["state"] == "closed" and not pr["merged_at"]:
-                continue
 
-            # check if the folder associated with the PR matches any of the project's environments
-            if env_folder_name in envs:
-                pr_deets = {
+        # the env folder of every tracked PR is known, so only the project's PRs are loaded
+        pending_prs_by_env = {e: [] for e in envs}
+        for pr in self.pr_tracker.pull_requests(
+            the_repo, state_of_the_prs, num_of_prs_to_scan, env_folders=envs
+        ):
+            log.info(f"pr #: {pr['number']}")
+            pending_prs_by_env[pr["env_folder"]].append(
+                {
                     "html_url": pr["html_url"],
                     "title": pr["title"],
                     "tier": self.prj_envs_map[project_name]["environments"][
-                        env_folder_name
+                        pr["env_folder"]
                     ]["tier"],
                     "state": pr["state"],
                     "merged_at": pr["merged_at"],
                 }
-                self.prj_envs_map[project_name]["environments"][env_folder_name][
-                    "pending_prs"
-                ].append(pr_deets)
+            )
 
         bot_response += f":book: State of the nation report for {project_name}: \n"
         bot_response += f"~ \n"
 
-        # TODO: There are too many http requests here.
-        # We need to move them to diff functions and utilize some cache
-        # Similar to: https://github.com/uc-cdis/qa-bot/blob/master/qabot/manifests_checker.py#L38
+        # TODO: When the snapshot can't be loaded, the manifests are still fetched one by one
+        # (through the ETag cache of HttpLib), they could be crawled concurrently like in manifests_checker.py
 
         # Determine versions that are currently_running on each environment associated to the project
         # populate bot response with the PRs correspondent to the project_name
+        # (all the manifests are read from a single snapshot of cdis-manifest)
+        manifests_snapshot = self._get_repo_snapshot("cdis-manifest")
         for e in envs:
             # scan the versions block of each manifest
             # TODO: Also track QA envs -> self.prj_envs_map[project_name]['environments'][e]['repo']
@@ -270,10 +405,7 @@ class StateOfTheNation:
             ):
                 continue
             the_repo = "cdis-manifest"
-            manifest_url = "https://raw.githubusercontent.com/uc-cdis/{}/master/{}/manifest.json".format(
-                the_repo, e
-            )
-            versions_block = self.httplib.fetch_json(manifest_url)["versions"]
+            versions_block = self._get_versions_block(manifests_snapshot, the_repo, e)
 
             # TODO: Move this logic to manifests_checker.py later
             third_party_svcs_to_ignore = [
@@ -318,9 +450,7 @@ class StateOfTheNation:
             bot_response += f"Currently running: {versions}: \n"
 
             # PRs for a given environment
-            pending_prs = self.prj_envs_map[project_name]["environments"][e][
-                "pending_prs"
-            ]
+            pending_prs = pending_prs_by_env[e]
 
             if len(pending_prs) > 0:
                 bot_response += f"*PRs:* \n"
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import re
+import threading
+
+logging.basicConfig(level=os.environ.get("LOGLEVEL", "INFO"))
+log = logging.getLogger(__name__)
+
+# gen3-qa files the index is built from
+SUITE_MEMBERS = ("suites/*/*.js",)
+
+
+def get_suite_label(script_path):
+    """'suites/portal/homepageTest.js' -> 'test-portal-homepageTest'"""
+    _, folder, file_name = script_path.split("/")
+    return f"test-{folder}-{file_name[: -len('.js')]}"
+
+
+def get_feature_name(script_source):
+    """
+    name of the CodeceptJS feature declared in a test script, as tagged in InfluxDB
+    (whitespaces converted to underscores), or None if there's no Feature() line
+    """
+    match = re.search(r"Feature\('(.*)'\).*", script_source)
+    return match.group(1).replace(" ", "_") if match else None
+
+
+class SuiteIndex:
+    """
+    Maps each test suite label (e.g., test-portal-homepageTest) to its CodeceptJS script
+    and the name of the feature it declares, for all the suites of gen3-qa at a given commit.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.commit_sha = None
+        self.suites = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path)
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                index.commit_sha = data["commit_sha"]
+                index.suites = data["suites"]
+                log.info(
+                    f"Loaded suite index for {index.commit_sha} with {len(index.suites)} suites from {path}"
+                )
+            except (OSError, ValueError, KeyError) as err:
+                log.warning(f"Ignoring unreadable suite index {path}: {err}")
+                index = cls(path)
+        return index
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"commit_sha": self.commit_sha, "suites": self.suites}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(self.path + ".tmp", self.path)
+
+    def rebuild(self, commit_sha, files):
+        """
+        index the suites among `files` ({path: source}) in a single pass
+        """
+        suites = {}
+        for path, source in files.items():
+            if path.count("/") != 2 or not path.endswith(".js"):
+                continue
+            suites[get_suite_label(path)] = {
+                "script": path,
+                "feature": get_feature_name(source),
+            }
+        with self._lock:
+            self.commit_sha = commit_sha
+            self.suites = suites
+        log.info(f"Indexed {len(suites)} test suites of gen3-qa@{commit_sha}")
+
+    def lookup(self, label):
+        """return {"script": ..., "feature": ...} for a suite label, or None if unknown"""
+        with self._lock:
+            return self.suites.get(label)
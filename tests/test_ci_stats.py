@@ -0,0 +1,122 @@
+import os
+import tempfile
+import time
+import unittest
+
+from qabot.ci_stats import CIStats
+
+HOUR = 3600
+NOW = 1_700_000_000
+
+
+class CIStatsTestCase(unittest.TestCase):
+    """Tests for ci_stats.py"""
+
+    def test_counts_per_repo_and_pr(self):
+        stats = CIStats(window_hours=24 * 7)
+        stats.record(NOW - 2 * HOUR, "fence", 1, "failed")
+        stats.record(NOW - HOUR, "fence", 1, "failed")
+        stats.record(NOW - HOUR, "fence", "2", "successful")
+        stats.record(NOW, "indexd", 3, "successful")
+
+        self.assertEqual(
+            {
+                ("fence", "1"): {"failed": 2, "successful": 0},
+                ("fence", "2"): {"failed": 0, "successful": 1},
+                ("indexd", "3"): {"failed": 0, "successful": 1},
+            },
+            stats.pr_totals(24, now=NOW),
+        )
+        # events of other repos do not reset the counters of a repo
+        self.assertEqual(
+            {
+                "fence": {"failed": 2, "successful": 1},
+                "indexd": {"failed": 0, "successful": 1},
+            },
+            stats.repo_totals(24, now=NOW),
+        )
+
+    def test_sliding_window(self):
+        stats = CIStats(window_hours=24 * 7)
+        stats.record(NOW - 3 * 24 * HOUR, "fence", 1, "failed")
+        stats.record(NOW - 23 * HOUR, "fence", 1, "failed")
+        # right after midnight, the last 24h are still there
+        self.assertEqual(
+            {"fence": {"failed": 1, "successful": 0}}, stats.repo_totals(24, now=NOW)
+        )
+        self.assertEqual(
+            {"fence": {"failed": 2, "successful": 0}},
+            stats.repo_totals(24 * 7, now=NOW),
+        )
+        # 8 days later, everything slid out of the window
+        self.assertEqual({}, stats.repo_totals(24 * 7, now=NOW + 8 * 24 * HOUR))
+
+    def test_memory_is_bounded_by_the_window(self):
+        stats = CIStats(window_hours=24)
+        for hour in range(24 * 30):
+            stats.record(NOW + hour * HOUR, "fence", 1, "failed")
+
+        self.assertEqual(24, len(stats._slots))
+        self.assertEqual(
+            {"fence": {"failed": 24, "successful": 0}},
+            stats.repo_totals(24, now=NOW + (24 * 30 - 1) * HOUR),
+        )
+        # results older than the window are ignored
+        stats.record(NOW, "fence", 1, "failed")
+        self.assertEqual(
+            {"fence": {"failed": 24, "successful": 0}},
+            stats.repo_totals(24, now=NOW + (24 * 30 - 1) * HOUR),
+        )
+
+    def test_snapshot_round_trip(self):
+        stats = CIStats(window_hours=24 * 7)
+        stats.record(NOW - 30 * HOUR, "fence", 1, "failed")
+        stats.record(NOW, "indexd", 3, "successful")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stats", "ci_stats.json")
+            stats.save(path)
+            # nothing changed, nothing to save
+            os.utime(path, (0, 0))
+            stats.save(path)
+            self.assertEqual(0, os.path.getmtime(path))
+
+            restored = CIStats.load(path, window_hours=24 * 7)
+            self.assertEqual(
+                stats.pr_totals(24 * 7, now=NOW), restored.pr_totals(24 * 7, now=NOW)
+            )
+            # a narrower window keeps the most recent buckets
+            narrower = CIStats.load(path, window_hours=24)
+            self.assertEqual(
+                {"indexd": {"failed": 0, "successful": 1}},
+                narrower.repo_totals(24, now=NOW),
+            )
+
+    def test_a_week_of_stats_loads_fast(self):
+        stats = CIStats(window_hours=24 * 7)
+        for hour in range(24 * 7):
+            for pr in range(50):
+                stats.record(NOW + hour * HOUR, f"repo-{pr % 10}", pr, "failed")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ci_stats.json")
+            stats.save(path)
+            started_at = time.perf_counter()
+            restored = CIStats.load(path, window_hours=24 * 7)
+            self.assertLess(time.perf_counter() - started_at, 1)
+        now = NOW + (24 * 7 - 1) * HOUR
+        self.assertEqual(
+            stats.repo_totals(24 * 7, now), restored.repo_totals(24 * 7, now)
+        )
+
+    def test_unreadable_snapshot(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "ci_stats.json")
+            with open(path, "w") as f:
+                f.write("{not json")
+            self.assertEqual({}, CIStats.load(path).repo_totals(24 * 7))
+            self.assertEqual(
+                {}, CIStats.load(os.path.join(tmp, "missing.json")).repo_totals(24)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
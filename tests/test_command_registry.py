@@ -0,0 +1,51 @@
+import sys
+import unittest
+
+from qabot.command_registry import CommandRegistry
+
+
+class CommandRegistryTestCase(unittest.TestCase):
+    """Tests for command_registry.py"""
+
+    def setUp(self):
+        sys.modules.pop("qabot.greeter", None)
+        self.registry = CommandRegistry(
+            {
+                "hello": {
+                    "args": "",
+                    "example": "@qa-bot hello",
+                    "handler": "qabot.greeter.Greeter.say_hello",
+                    "pass_thread_ts": False,
+                },
+                "help": {
+                    "args": "",
+                    "example": "@qa-bot help",
+                    "handler": lambda: "help!",
+                    "pass_thread_ts": False,
+                },
+            }
+        )
+
+    def test_handlers_are_loaded_on_first_use(self):
+        self.assertNotIn("qabot.greeter", sys.modules)
+        self.assertEqual([], self.registry.loaded_handlers())
+
+        self.assertEqual("hello", self.registry.resolve("hello")())
+        self.assertIn("qabot.greeter", sys.modules)
+        self.assertEqual(["hello"], self.registry.loaded_handlers())
+
+        # the handler object is built only once
+        self.assertIs(
+            self.registry.resolve("hello").__self__,
+            self.registry.resolve("hello").__self__,
+        )
+
+    def test_callable_handlers_and_metadata(self):
+        self.assertEqual("help!", self.registry.resolve("help")())
+        self.assertIn("help", self.registry)
+        self.assertEqual("@qa-bot hello", self.registry["hello"]["example"])
+        self.assertEqual(["hello", "help"], list(self.registry.keys()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import threading
+import time
+import unittest
+
+from qabot.executor import CommandExecutor
+
+
+class CommandExecutorTestCase(unittest.TestCase):
+    """Tests for executor.py"""
+
+    def setUp(self):
+        self.executor = CommandExecutor()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def _collect(self):
+        results = []
+        done = threading.Event()
+
+        def on_done(result):
+            results.append(result)
+            done.set()
+
+        return results, done, on_done
+
+    def test_result_is_delivered(self):
+        results, done, on_done = self._collect()
+        self.executor.submit("hello", lambda: "hello", on_done, timeout=5)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(["hello"], results)
+
+    def test_slow_command_does_not_block_cheap_ones(self):
+        release = threading.Event()
+        slow_results, slow_done, slow_on_done = self._collect()
+        self.executor.submit(
+            "run-gen3-job",
+            lambda: release.wait(5) and "job done",
+            slow_on_done,
+            max_concurrency=1,
+            timeout=10,
+        )
+        fast_results, fast_done, fast_on_done = self._collect()
+        self.executor.submit("help", lambda: "all commands", fast_on_done, timeout=5)
+
+        # the cheap command must complete while the heavy one is still running
+        self.assertTrue(fast_done.wait(5))
+        self.assertEqual(["all commands"], fast_results)
+        self.assertFalse(slow_done.is_set())
+        self.assertEqual(1, self.executor.in_flight("run-gen3-job"))
+
+        release.set()
+        self.assertTrue(slow_done.wait(5))
+        self.assertEqual(["job done"], slow_results)
+
+    def test_concurrency_limit_is_enforced(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def work():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+            return "ok"
+
+        finished = threading.Semaphore(0)
+        for _ in range(6):
+            self.executor.submit(
+                "roll",
+                work,
+                lambda result: finished.release(),
+                max_concurrency=2,
+                timeout=5,
+            )
+        for _ in range(6):
+            self.assertTrue(finished.acquire(timeout=5))
+        self.assertEqual(2, max(peak))
+
+    def test_timeout_message_is_delivered_once(self):
+        release = threading.Event()
+        results, done, on_done = self._collect()
+        future = self.executor.submit(
+            "roll", lambda: release.wait(5) and "rolled", on_done, timeout=0.1
+        )
+        self.assertTrue(done.wait(5))
+        release.set()
+        future.result(timeout=5)
+        self.assertEqual(1, len(results))
+        self.assertIn("taking longer than 0.1s", results[0])
+
+    def test_exceptions_are_reported(self):
+        def boom():
+            raise ValueError("boom")
+
+        results, done, on_done = self._collect()
+        self.executor.submit("hello", boom, on_done, timeout=5)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(["Something went wrong. Contact the QA team"], results)
+
+
+if __name__ == "__main__":
+    unittest.main()
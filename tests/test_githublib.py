@@ -0,0 +1,311 @@
+import json
+import time
+import unittest
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs
+
+from httmock import HTTMock, urlmatch
+
+from qabot.lib import githublib
+from qabot.lib.githublib import GithubLib, clear_github_cache
+from qabot.lib.scheduler import Scheduler
+from qabot.lib.waiter import ResourceWaiter
+
+
+class GithubLibTestCase(unittest.TestCase):
+    """Tests for githublib.py"""
+
+    def setUp(self):
+        clear_github_cache()
+        self.github_client = Mock(name="GithubClientMock")
+        self.patch1 = patch.object(
+            githublib, "Github", Mock(return_value=self.github_client)
+        )
+        self.patch1.start()
+        self.patch2 = patch.object(githublib, "GITHUB_BACKEND", "rest")
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+        clear_github_cache()
+
+    def test_repo_handles_are_reused(self):
+        GithubLib(repo="gen3-qa").get_github_client()
+        GithubLib(repo="gen3-qa").get_github_client()
+        GithubLib(repo="fence").get_github_client()
+
+        self.assertEqual(1, githublib.Github.call_count)
+        self.assertEqual(
+            ["uc-cdis/gen3-qa", "uc-cdis/fence"],
+            [c.args[0] for c in self.github_client.get_repo.call_args_list],
+        )
+
+    def test_repo_handles_expire(self):
+        with patch.object(githublib, "REPO_HANDLE_TTL", -1):
+            GithubLib(repo="gen3-qa").get_github_client()
+            GithubLib(repo="gen3-qa").get_github_client()
+        self.assertEqual(2, self.github_client.get_repo.call_count)
+
+    def test_multi_label_replay_fetches_the_pr_once(self):
+        repo = self.github_client.get_repo.return_value
+        ghl = GithubLib(repo="gen3-qa")
+        ghl.set_labels_to_pr(
+            549, ["test-portal-homepageTest", "test-apis-dataUploadTest"]
+        )
+        ghl.set_label_to_pr(549, "test-apis-dbgapTest")
+
+        repo.get_pull.assert_called_once_with(549)
+        pr = repo.get_pull.return_value
+        pr.set_labels.assert_called_once_with(
+            "test-portal-homepageTest", "test-apis-dataUploadTest"
+        )
+        pr.add_to_labels.assert_called_once_with("test-apis-dbgapTest")
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r".*/actions/workflows$")
+    def workflows_mock(self, url, request):
+        self.api_calls.append(url.path)
+        return {
+            "status_code": 200,
+            "content": {
+                "workflows": [
+                    {"id": 11, "name": "Build Image"},
+                    {"id": 22, "name": "Integration Tests"},
+                ]
+            },
+        }
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r".*/actions/workflows/22/runs$")
+    def workflow_runs_mock(self, url, request):
+        self.api_calls.append(url.path)
+        self.assertIn("head_sha=abc123", url.query)
+        return {
+            "status_code": 200,
+            "content": {
+                "workflow_runs": [
+                    {"id": 1002, "workflow_id": 22, "head_sha": "abc123"},
+                    {"id": 1001, "workflow_id": 22, "head_sha": "abc123"},
+                ]
+            },
+        }
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r".*/actions/runs/1002/rerun$")
+    def rerun_mock(self, url, request):
+        self.api_calls.append(url.path)
+        return {"status_code": 201, "content": ""}
+
+    def test_replay_pr_uses_filtered_run_lookup(self):
+        self.api_calls = []
+        ghl = GithubLib(repo="gen3-qa")
+        pr = Mock(name="PullRequestMock")
+        pr.head.sha = "abc123"
+        with patch.object(GithubLib, "get_pull", Mock(return_value=pr)):
+            with HTTMock(self.workflows_mock, self.workflow_runs_mock, self.rerun_mock):
+                first = ghl.replay_pr(549)
+                second = ghl.replay_pr(549)
+
+        self.assertIn("actions/runs/1002", first)
+        self.assertEqual(first, second)
+        # the workflow id and the run id are only looked up once
+        self.assertEqual(
+            [
+                "/repos/uc-cdis/gen3-qa/actions/workflows",
+                "/repos/uc-cdis/gen3-qa/actions/workflows/22/runs",
+                "/repos/uc-cdis/gen3-qa/actions/runs/1002/rerun",
+                "/repos/uc-cdis/gen3-qa/actions/runs/1002/rerun",
+            ],
+            self.api_calls,
+        )
+
+    def test_reran_runs_are_indexed(self):
+        self.api_calls = []
+        ghl = GithubLib(repo="gen3-qa")
+        with HTTMock(self.workflows_mock, self.rerun_mock):
+            ghl.rerun_workflow_run(1002, workflow_id=22, head_sha="abc123")
+            # no need to list the runs of the workflow
+            self.assertEqual(
+                1002, ghl.find_workflow_run_id("Integration Tests", "abc123")
+            )
+        self.assertEqual(
+            [
+                "/repos/uc-cdis/gen3-qa/actions/runs/1002/rerun",
+                "/repos/uc-cdis/gen3-qa/actions/workflows",
+            ],
+            self.api_calls,
+        )
+
+    def pr_node(self, number, files, state="OPEN", merged_at=None):
+        return {
+            "number": number,
+            "title": f"PR {number}",
+            "url": f"https://github.com/uc-cdis/cdis-manifest/pull/{number}",
+            "state": state,
+            "mergedAt": merged_at,
+            "updatedAt": "2024-05-02T10:00:00Z",
+            "headRefOid": f"sha{number}",
+            "mergeable": "MERGEABLE",
+            "labels": {"nodes": [{"name": "doc-only"}]},
+            "files": {
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [{"path": f} for f in files],
+            },
+        }
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r"/graphql$", method="POST")
+    def graphql_mock(self, url, request):
+        body = json.loads(request.body)
+        variables = body["variables"]
+        self.graphql_calls.append(variables)
+        self.graphql_queries.append(body["query"])
+        if "number" in variables:
+            # a PR whose files span two pages
+            files = {None: ["README.md"], "f1": ["gen3.theanvil.io/manifest.json"]}
+            pr = self.pr_node(variables["number"], files[variables["after"]])
+            pr["files"]["pageInfo"] = {
+                "hasNextPage": variables["after"] is None,
+                "endCursor": "f1",
+            }
+            data = {"repository": {"pullRequest": pr}}
+        else:
+            pages = {
+                None: ([self.pr_node(3, ["a/manifest.json"])], True, "p1"),
+                "p1": (
+                    [self.pr_node(2, ["b/manifest.json"], "MERGED", "2024-05-01")],
+                    True,
+                    "p2",
+                ),
+                "p2": ([self.pr_node(1, ["c/manifest.json"], "CLOSED")], False, None),
+            }
+            nodes, has_next, cursor = pages[variables["after"]]
+            data = {
+                "repository": {
+                    "pullRequests": {
+                        "pageInfo": {"hasNextPage": has_next, "endCursor": cursor},
+                        "nodes": nodes,
+                    }
+                }
+            }
+        data["rateLimit"] = {"cost": 1, "remaining": 4999}
+        return {"status_code": 200, "content": {"data": data}}
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r"/graphql$", method="POST")
+    def graphql_error_mock(self, url, request):
+        self.graphql_calls.append(json.loads(request.body)["variables"])
+        return {"status_code": 200, "content": {"errors": [{"message": "boom"}]}}
+
+    def test_graphql_pull_requests_are_paged_with_cursors(self):
+        self.graphql_calls = []
+        self.graphql_queries = []
+        with patch.object(githublib, "GITHUB_BACKEND", "graphql"), patch.object(
+            githublib, "GRAPHQL_PAGE_SIZE", 1
+        ), HTTMock(self.graphql_mock):
+            prs = GithubLib().get_pull_requests_with_files("closed", limit=2)
+
+        self.assertEqual([3, 2], [pr["number"] for pr in prs])
+        self.assertEqual([None, "p1"], [c["after"] for c in self.graphql_calls])
+        self.assertEqual(["CLOSED", "MERGED"], self.graphql_calls[0]["states"])
+        # most recently updated first, with or without updated_since
+        self.assertIn(
+            "orderBy: {field: UPDATED_AT, direction: DESC}", self.graphql_queries[0]
+        )
+        self.assertEqual("open", prs[0]["state"])
+        self.assertEqual("closed", prs[1]["state"])
+        self.assertEqual("2024-05-01", prs[1]["merged_at"])
+        self.assertEqual("sha2", prs[1]["head"]["sha"])
+        self.assertEqual(["b/manifest.json"], prs[1]["files"])
+        self.assertEqual([{"name": "doc-only"}], prs[1]["labels"])
+
+    def test_graphql_file_raw_url(self):
+        self.graphql_calls = []
+        self.graphql_queries = []
+        with patch.object(githublib, "GITHUB_BACKEND", "graphql"), HTTMock(
+            self.graphql_mock
+        ):
+            raw_url = GithubLib().get_file_raw_url(42, "manifest.json")
+
+        self.assertEqual(
+            "https://raw.githubusercontent.com/uc-cdis/cdis-manifest/sha42/gen3.theanvil.io/manifest.json",
+            raw_url,
+        )
+        self.assertEqual([None, "f1"], [c["after"] for c in self.graphql_calls])
+        self.github_client.get_repo.assert_not_called()
+
+    def test_graphql_errors_fall_back_to_rest(self):
+        self.graphql_calls = []
+        self.graphql_queries = []
+        file = Mock(filename="gen3.theanvil.io/manifest.json", raw_url="rest-raw-url")
+        pr = self.github_client.get_repo.return_value.get_pull.return_value
+        pr.get_files.return_value = [file]
+        with patch.object(githublib, "GITHUB_BACKEND", "graphql"), HTTMock(
+            self.graphql_error_mock
+        ):
+            raw_url = GithubLib().get_file_raw_url(42, "manifest.json")
+
+        self.assertEqual("rest-raw-url", raw_url)
+        self.assertEqual(1, len(self.graphql_calls))
+
+    def test_replay_pr_head_sha_from_graphql(self):
+        self.api_calls = []
+        self.graphql_calls = []
+        self.graphql_queries = []
+        with patch.object(githublib, "GITHUB_BACKEND", "graphql"), HTTMock(
+            self.graphql_mock, self.workflows_mock, self.rerun_mock
+        ):
+            with patch.object(
+                GithubLib, "find_workflow_run_id", Mock(return_value=1002)
+            ) as find_run:
+                result = GithubLib(repo="gen3-qa").replay_pr(549)
+
+        find_run.assert_called_once_with("Integration Tests", "sha549")
+        self.assertIn("actions/runs/1002", result)
+        # only the first page of files is needed to know the head sha
+        self.assertEqual(1, len(self.graphql_calls))
+        self.github_client.get_repo.assert_not_called()
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r"/search/issues$")
+    def search_mock(self, url, request):
+        self.api_calls.append(parse_qs(url.query)["q"][0])
+        return {
+            "status_code": 200,
+            "content": {
+                "items": [
+                    # an older testing PR, reused for this run
+                    {
+                        "title": "Testing PR-1234 of fence",
+                        "html_url": "https://github.com/uc-cdis/gen3-code-vigil/pull/7",
+                    },
+                    {
+                        "title": "Testing PR-123 of fence",
+                        "html_url": "https://github.com/uc-cdis/gen3-code-vigil/pull/8",
+                    },
+                ]
+            },
+        }
+
+    def test_external_pr_is_searched_by_title(self):
+        self.api_calls = []
+        waiter = ResourceWaiter(initial_delay=0, scheduler=Scheduler())
+        with patch.object(
+            githublib, "get_resource_waiter", Mock(return_value=waiter)
+        ), HTTMock(self.search_mock):
+            url = GithubLib().get_external_pr_number(
+                "gen3-code-vigil", "PR-123", deadline=5
+            )
+
+        self.assertEqual("https://github.com/uc-cdis/gen3-code-vigil/pull/8", url)
+        self.assertEqual(
+            ['"PR-123" in:title repo:uc-cdis/gen3-code-vigil type:pr'], self.api_calls
+        )
+
+    def test_get_external_pr_number_does_not_outlive_its_deadline(self):
+        # the shared poll never gets to run
+        with patch.object(githublib, "get_resource_waiter", Mock()):
+            started_at = time.monotonic()
+            self.assertFalse(
+                GithubLib().get_external_pr_number("gen3-qa", "PR-123", deadline=0.1)
+            )
+        self.assertLess(time.monotonic() - started_at, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from httmock import HTTMock, urlmatch
+
+from qabot.lib.httplib import HttpCache, HttpLib
+
+MANIFEST_ETAG = '"a1b2c3"'
+
+
+class HttpLibTestCase(unittest.TestCase):
+    """Tests for httplib.py"""
+
+    def setUp(self):
+        self.requests_seen = []
+
+    @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$", path=r".*manifest.json$")
+    def manifest_mock(self, url, request):
+        self.requests_seen.append(request)
+        if request.headers.get("If-None-Match") == MANIFEST_ETAG:
+            return {"status_code": 304, "content": ""}
+        return {
+            "status_code": 200,
+            "headers": {"ETag": MANIFEST_ETAG},
+            "content": {"versions": {"fence": "quay.io/cdis/fence:2024.05"}},
+        }
+
+    def test_conditional_get_is_served_from_cache(self):
+        httplib = HttpLib(cache=HttpCache())
+        url = "https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master/gen3.theanvil.io/manifest.json"
+        with HTTMock(self.manifest_mock):
+            first = httplib.fetch_json(url)
+            second = httplib.fetch_json(url)
+
+        self.assertEqual(first, second)
+        self.assertEqual("quay.io/cdis/fence:2024.05", second["versions"]["fence"])
+        self.assertNotIn("If-None-Match", self.requests_seen[0].headers)
+        self.assertEqual(MANIFEST_ETAG, self.requests_seen[1].headers["If-None-Match"])
+        stats = httplib.cache_stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(1, stats["revalidations"])
+        self.assertEqual(0.5, stats["hit_ratio"])
+
+    def test_fetch_raw_data_with_etag(self):
+        httplib = HttpLib(cache=HttpCache())
+        url = "https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master/gen3.theanvil.io/manifest.json"
+        with HTTMock(self.manifest_mock):
+            first = httplib.fetch_raw_data_with_etag(url)
+            second = httplib.fetch_raw_data_with_etag(url)
+
+        self.assertEqual(MANIFEST_ETAG, first[1])
+        self.assertEqual(first, second)
+        self.assertEqual(1, httplib.cache_stats()["hits"])
+
+    def test_lru_eviction(self):
+        cache = HttpCache(max_bytes=10)
+        cache.put("https://example.org/a", "12345", etag='"a"')
+        cache.put("https://example.org/b", "12345", etag='"b"')
+        cache.get("https://example.org/a")
+        cache.put("https://example.org/c", "12345", etag='"c"')
+        self.assertIsNotNone(cache.get("https://example.org/a"))
+        self.assertIsNone(cache.get("https://example.org/b"))
+        self.assertIsNotNone(cache.get("https://example.org/c"))
+
+    def test_disk_tier_survives_restarts(self):
+        url = (
+            "https://raw.githubusercontent.com/uc-cdis/cdis-manifest/master/CODEOWNERS"
+        )
+        with tempfile.TemporaryDirectory() as cache_dir:
+            HttpCache(cache_dir=cache_dir).put(url, "caninedc.org @theowner", '"xyz"')
+            entry = HttpCache(cache_dir=cache_dir).get(url)
+        self.assertEqual("caninedc.org @theowner", entry["body"])
+        self.assertEqual('"xyz"', entry["etag"])
+
+    def test_disk_tier_is_bounded(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = HttpCache(max_bytes=10, cache_dir=cache_dir)
+            cache.put("https://example.org/a", "12345", etag='"a"')
+            cache.put("https://example.org/b", "12345", etag='"b"')
+            cache.put("https://example.org/c", "12345", etag='"c"')
+            # a was evicted from memory and from disk
+            self.assertEqual(2, len(os.listdir(cache_dir)))
+            self.assertIsNone(
+                HttpCache(cache_dir=cache_dir).get("https://example.org/a")
+            )
+
+            # files left by a previous run are pruned down to max_bytes on startup
+            file_size = max(
+                os.path.getsize(os.path.join(cache_dir, name))
+                for name in os.listdir(cache_dir)
+            )
+            HttpCache(max_bytes=file_size + 1, cache_dir=cache_dir)
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
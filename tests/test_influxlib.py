@@ -0,0 +1,120 @@
+import json
+import unittest
+from unittest.mock import patch
+from urllib.parse import parse_qs
+
+from httmock import HTTMock, urlmatch
+from influxdb.exceptions import InfluxDBServerError
+from influxdb.resultset import ResultSet
+
+from qabot.lib.influxlib import InfluxLib
+
+
+class InfluxLibTestCase(unittest.TestCase):
+    """Tests for influxlib.py"""
+
+    # recorded response of a COUNT() ... GROUP BY "repo_name" query
+    recorded_counts = {
+        "results": [
+            {
+                "statement_id": 0,
+                "series": [
+                    {
+                        "name": "fail_count",
+                        "tags": {"repo_name": "fence"},
+                        "columns": ["time", "count"],
+                        "values": [["1970-01-01T00:00:00Z", 3]],
+                    }
+                ],
+            }
+        ]
+    }
+    empty_response = {"results": [{"statement_id": 0}]}
+
+    @urlmatch(netloc=r"influxdb:8086$", path=r"/query$")
+    def influxdb_mock(self, url, request):
+        params = parse_qs(url.query)
+        self.queries.append((params["q"][0], json.loads(params["params"][0])))
+        self.assertEqual("true", params["chunked"][0])
+        # nothing in the last month
+        if "now() - 60d" in params["q"][0] and "Fence" in params["params"][0]:
+            return {"status_code": 200, "content": self.recorded_counts}
+        return {"status_code": 200, "content": self.empty_response}
+
+    def setUp(self):
+        self.queries = []
+        InfluxLib().clear_cache()
+
+    def test_count_ci_metrics_widens_the_window(self):
+        with HTTMock(self.influxdb_mock):
+            rows = InfluxLib().count_ci_metrics(
+                "fail_count", {"suite_name": "Fence"}, group_by=("repo_name",)
+            )
+
+        self.assertEqual(
+            [{"repo_name": "fence", "time": "1970-01-01T00:00:00Z", "count": 3}],
+            rows,
+        )
+        query = 'SELECT COUNT("fail_count") AS "count" FROM "fail_count" WHERE "suite_name" = $suite_name AND '
+        # each step only scans the days that were not scanned yet and it stops at the first non-empty window
+        self.assertEqual(
+            [
+                query + 'time > now() - 14d GROUP BY "repo_name"',
+                query
+                + 'time > now() - 30d AND time <= now() - 14d GROUP BY "repo_name"',
+                query
+                + 'time > now() - 60d AND time <= now() - 30d GROUP BY "repo_name"',
+            ],
+            [q for q, _ in self.queries],
+        )
+        self.assertTrue(all(p == {"suite_name": "Fence"} for _, p in self.queries))
+
+    def test_windows_are_cached(self):
+        with HTTMock(self.influxdb_mock):
+            first = InfluxLib().count_ci_metrics(
+                "fail_count", {"suite_name": "Fence"}, group_by=("repo_name",)
+            )
+            second = InfluxLib().count_ci_metrics(
+                "fail_count", {"suite_name": "Fence"}, group_by=("repo_name",)
+            )
+
+        self.assertEqual(first, second)
+        self.assertEqual(3, len(self.queries))
+
+    def test_nothing_found(self):
+        with HTTMock(self.influxdb_mock):
+            rows = InfluxLib().count_ci_metrics(
+                "fail_count", {"suite_name": "Unknown"}, group_by=("repo_name",)
+            )
+        self.assertIsNone(rows)
+
+    def failing_stream(self, query, **kwargs):
+        # the first chunk is fine, the connection breaks while reading the second one
+        yield ResultSet(self.recorded_counts["results"][0])
+        raise InfluxDBServerError("connection reset")
+
+    def test_errors_in_a_later_chunk_do_not_escape(self):
+        client = InfluxLib().client
+        with patch.object(client, "query", side_effect=self.failing_stream):
+            rows = InfluxLib().count_ci_metrics(
+                "fail_count", {"suite_name": "Fence"}, group_by=("repo_name",)
+            )
+            points = InfluxLib().query_ci_metrics("fail_count", {"suite_name": "Fence"})
+            self.assertEqual([3], [p["count"] for p in points])
+        self.assertIsNone(rows)
+
+    def test_query_ci_metrics_filters_tags_on_the_server(self):
+        with HTTMock(self.influxdb_mock):
+            points = InfluxLib().query_ci_metrics(
+                "fail_count", {"suite_name": "Fence", "repo_name": "fence"}
+            )
+            self.assertEqual(3, next(points)["count"])
+
+        self.assertEqual(
+            'SELECT * FROM "fail_count" WHERE "suite_name" = $suite_name AND "repo_name" = $repo_name AND time > now() - 14d',
+            self.queries[0][0],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
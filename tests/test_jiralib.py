@@ -0,0 +1,102 @@
+import unittest
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs, urlparse
+
+from httmock import HTTMock, urlmatch
+
+from qabot.lib import directory, jiralib
+from qabot.lib.jiralib import JiraLib, JiraUserDirectory
+
+USERS = [
+    {"accountId": "1", "displayName": "Atharva Rane"},
+    {"accountId": "2", "displayName": "Marcelo Rodrigues Costa"},
+    {"accountId": "3", "displayName": "Pauline Ribeyre"},
+]
+
+
+class JiraLibTestCase(unittest.TestCase):
+    """Tests for jiralib.py"""
+
+    def setUp(self):
+        self.users = list(USERS)
+        self.requests = []
+        self.directory = JiraUserDirectory(
+            "https://jira.example", "qa", "token", scheduler=Mock()
+        )
+        self.patch1 = patch.object(jiralib, "JIRA_USERS_PAGE_SIZE", 2)
+        self.patch1.start()
+        self.patch2 = patch.object(
+            JiraLib, "get_user_directory", Mock(return_value=self.directory)
+        )
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+
+    def jira_mock(self):
+        @urlmatch(netloc="jira.example", path="/rest/api/3/user/search")
+        def users(url, request):
+            self.requests.append(url)
+            params = parse_qs(urlparse(request.url).query)
+            start_at = int(params["startAt"][0])
+            max_results = int(params["maxResults"][0])
+            return {
+                "status_code": 200,
+                "content": self.users[start_at : start_at + max_results],
+            }
+
+        return HTTMock(users)
+
+    def test_pages_through_all_users(self):
+        with self.jira_mock():
+            self.directory.refresh()
+        # 2 full pages, then an empty one
+        self.assertEqual(3, len(self.requests))
+        self.assertEqual(3, len(self.directory))
+        self.assertEqual("3", JiraLib().get_jira_user_id("Pauline Ribeyre"))
+
+    def test_lookups_by_normalized_name_do_not_call_the_api(self):
+        with self.jira_mock():
+            self.directory.refresh()
+            self.requests.clear()
+            jl = JiraLib()
+            self.assertEqual("2", jl.get_jira_user_id("Marcelo Rodrigues Costa"))
+            self.assertEqual("2", jl.get_jira_user_id("Marcelo_Rodrigues_Costa"))
+            self.assertEqual("1", jl.get_jira_user_id("atharva_rane"))
+            self.assertEqual("-1", jl.get_jira_user_id("Nobody"))
+        self.assertEqual([], self.requests)
+
+    def test_unknown_user_waits_once_for_the_initial_load(self):
+        # the directory never gets loaded (the refresh is never scheduled)
+        with patch.object(self.directory.loaded, "wait") as wait:
+            self.assertEqual("-1", JiraLib().get_jira_user_id("Nobody"))
+        wait.assert_called_once_with(directory.INITIAL_LOAD_WAIT)
+
+    def test_refresh_drops_users_that_are_gone(self):
+        with self.jira_mock():
+            self.directory.refresh()
+            self.users = [USERS[0], {"accountId": "2", "displayName": "Marcelo Costa"}]
+            self.directory.refresh()
+        self.assertEqual(2, len(self.directory))
+        jl = JiraLib()
+        self.assertEqual("-1", jl.get_jira_user_id("Pauline Ribeyre"))
+        self.assertEqual("-1", jl.get_jira_user_id("Marcelo Rodrigues Costa"))
+        self.assertEqual("2", jl.get_jira_user_id("Marcelo Costa"))
+
+    def test_failed_refresh_keeps_the_directory(self):
+        with self.jira_mock():
+            self.directory.refresh()
+        with patch.object(
+            jiralib.transport, "get", Mock(side_effect=Exception("down"))
+        ):
+            self.directory._refresh_periodically()
+        # the next refresh is still scheduled
+        self.assertEqual(
+            3600, self.directory.scheduler.call_later.call_args_list[0].args[0]
+        )
+        self.assertEqual("1", JiraLib().get_jira_user_id("Atharva Rane"))
+
+
+if __name__ == "__main__":
+    unittest.main()
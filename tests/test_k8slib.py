@@ -0,0 +1,283 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+from qabot.env_maintenance import EnvMaintenance
+from qabot.lib import k8slib
+from qabot.lib.k8slib import K8sLib, KubernetesError
+
+
+class FakeAPIServer(BaseHTTPRequestHandler):
+    """
+    Tiny in-memory Kubernetes API server: deployments become available on the second read
+    after a restart, and jobs complete on the second read
+    """
+
+    state = {}
+    requests_seen = []
+
+    @classmethod
+    def reset(cls):
+        cls.requests_seen = []
+        cls.state = {
+            "namespaces": {"jenkins-brain": {"labels": {"quarantine": "true"}}},
+            "deployments": {
+                name: {"generation": 1, "reads": 0}
+                for name in ("fence-deployment", "sower")
+            },
+            "jobs": {},
+        }
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _deployment(self, name):
+        deployment = self.state["deployments"][name]
+        deployment["reads"] += 1
+        ready = deployment["reads"] > 1
+        return {
+            "metadata": {"name": name, "generation": deployment["generation"]},
+            "spec": {"replicas": 1},
+            "status": {
+                "observedGeneration": deployment["generation"],
+                "replicas": 1,
+                "updatedReplicas": 1 if ready else 0,
+                "availableReplicas": 1 if ready else 0,
+            },
+        }
+
+    def handle_request(self):
+        self.requests_seen.append(
+            (self.command, self.path, self.headers.get("Content-Type"))
+        )
+        if self.headers.get("Authorization") != "Bearer s3cr3t":
+            return self._send(401, {"message": "Unauthorized"})
+        parts = self.path.strip("/").split("/")
+        body = self._body()
+        if parts[:3] == ["api", "v1", "namespaces"]:
+            namespace = self.state["namespaces"].get(parts[3])
+            if namespace is None:
+                return self._send(
+                    404, {"message": f'namespaces "{parts[3]}" not found'}
+                )
+            for label, value in body["metadata"]["labels"].items():
+                if value is None:
+                    namespace["labels"].pop(label, None)
+                else:
+                    namespace["labels"][label] = value
+            return self._send(200, {"metadata": namespace})
+        if parts[:2] == ["apis", "apps"]:
+            if len(parts) == 6:
+                return self._send(
+                    200,
+                    {"items": [self._deployment(n) for n in self.state["deployments"]]},
+                )
+            name = parts[6]
+            if name not in self.state["deployments"]:
+                return self._send(404, {"message": f'deployments "{name}" not found'})
+            if self.command == "PATCH":
+                self.state["deployments"][name] = {
+                    "generation": self.state["deployments"][name]["generation"] + 1,
+                    "reads": 0,
+                }
+            return self._send(200, self._deployment(name))
+        if parts[:2] == ["apis", "batch"] and parts[5] == "cronjobs":
+            return self._send(
+                200,
+                {
+                    "metadata": {"name": parts[6], "uid": "uid-1"},
+                    "spec": {
+                        "jobTemplate": {
+                            "metadata": {"labels": {"app": "gen3job"}},
+                            "spec": {"template": {"spec": {"containers": []}}},
+                        }
+                    },
+                },
+            )
+        if parts[:2] == ["apis", "batch"] and self.command == "POST":
+            self.state["jobs"][body["metadata"]["name"]] = {"job": body, "reads": 0}
+            return self._send(201, body)
+        if parts[:2] == ["apis", "batch"]:
+            job = self.state["jobs"][parts[6]]
+            job["reads"] += 1
+            conditions = (
+                [{"type": "Complete", "status": "True"}] if job["reads"] > 1 else []
+            )
+            return self._send(200, {**job["job"], "status": {"conditions": conditions}})
+        self._send(404, {"message": "not found"})
+
+    do_GET = do_PATCH = do_POST = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class K8sLibTestCase(unittest.TestCase):
+    """Tests for k8slib.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeAPIServer)
+        cls.api_server = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        FakeAPIServer.reset()
+        self.k8slib = K8sLib(self.api_server, token="s3cr3t")
+        self.patch1 = patch.object(k8slib, "K8S_POLL_INTERVAL", 0.01)
+        self.patch1.start()
+        self.patch2 = patch.object(
+            EnvMaintenance, "get_k8slib", lambda self_: self.k8slib
+        )
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+
+    def test_label_namespace_in_a_single_call(self):
+        self.k8slib.label_namespace(
+            "jenkins-brain", {"quarantine": None, "teardown": "true"}
+        )
+        self.assertEqual(
+            {"teardown": "true"},
+            FakeAPIServer.state["namespaces"]["jenkins-brain"]["labels"],
+        )
+        self.assertEqual(
+            [
+                (
+                    "PATCH",
+                    "/api/v1/namespaces/jenkins-brain",
+                    "application/merge-patch+json",
+                )
+            ],
+            FakeAPIServer.requests_seen,
+        )
+
+    def test_errors(self):
+        with self.assertRaises(KubernetesError) as cm:
+            self.k8slib.label_namespace("jenkins-nope", {"quarantine": "true"})
+        self.assertEqual(404, cm.exception.status_code)
+        self.assertIn('namespaces "jenkins-nope" not found', str(cm.exception))
+
+        with self.assertRaises(KubernetesError) as cm:
+            K8sLib(self.api_server, token="wrong").list_deployments("jenkins-brain")
+        self.assertEqual(401, cm.exception.status_code)
+
+    def test_roll_service(self):
+        response = EnvMaintenance().roll_service("fence", "jenkins-brain")
+        self.assertEqual(
+            "The service fence has been rolled on jenkins-brain. :awesome-face:",
+            response,
+        )
+        self.assertEqual(
+            2, FakeAPIServer.state["deployments"]["fence-deployment"]["generation"]
+        )
+        self.assertEqual(1, FakeAPIServer.state["deployments"]["sower"]["generation"])
+        self.assertEqual(
+            [
+                "PATCH /apis/apps/v1/namespaces/jenkins-brain/deployments/fence-deployment",
+                # the patch response counts as the first read, the rollout is done on the next one
+                "GET /apis/apps/v1/namespaces/jenkins-brain/deployments/fence-deployment",
+            ],
+            [f"{method} {path}" for method, path, _ in FakeAPIServer.requests_seen],
+        )
+
+    def test_roll_all_services(self):
+        response = EnvMaintenance().roll_service("all", "jenkins-brain")
+        self.assertEqual(
+            "All services have been rolled on jenkins-brain. :awesome-face:", response
+        )
+        self.assertEqual(
+            {"fence-deployment": 2, "sower": 2},
+            {
+                name: d["generation"]
+                for name, d in FakeAPIServer.state["deployments"].items()
+            },
+        )
+
+    def test_run_gen3_job(self):
+        response = EnvMaintenance().run_gen3_job("etl", "jenkins-brain")
+        self.assertRegex(
+            response,
+            r"^Job etl-\w{4} executed and completed on jenkins-brain. :checkered_flag:$",
+        )
+        (job,) = [j["job"] for j in FakeAPIServer.state["jobs"].values()]
+        self.assertEqual("CronJob", job["metadata"]["ownerReferences"][0]["kind"])
+        self.assertEqual("etl-cronjob", job["metadata"]["ownerReferences"][0]["name"])
+        self.assertEqual({"app": "gen3job"}, job["metadata"]["labels"])
+
+    def test_failures_are_reported(self):
+        response = EnvMaintenance().roll_service("indexd", "jenkins-brain")
+        self.assertEqual(
+            "Failed to roll service(s) on jenkins-brain, please try again or contact QA team",
+            response,
+        )
+
+    def test_kubectl_fallback(self):
+        with patch.object(EnvMaintenance, "get_k8slib", lambda self_: None), patch(
+            "qabot.env_maintenance.subprocess.run"
+        ) as run:
+            EnvMaintenance().roll_service("fence", "jenkins-brain")
+        self.assertEqual(
+            [
+                [
+                    "kubectl",
+                    "rollout",
+                    "restart",
+                    "deployment/fence-deployment",
+                    "-n",
+                    "jenkins-brain",
+                ],
+                [
+                    "kubectl",
+                    "rollout",
+                    "status",
+                    "deployment/fence-deployment",
+                    "-n",
+                    "jenkins-brain",
+                ],
+            ],
+            [c.args[0] for c in run.call_args_list],
+        )
+        self.assertEqual([], FakeAPIServer.requests_seen)
+
+    def test_api_backend_without_api_does_not_fall_back_to_kubectl(self):
+        self.patch2.stop()
+        try:
+            with patch.object(k8slib, "K8S_BACKEND", "api"), patch.object(
+                k8slib, "_k8slib", None
+            ), patch.object(k8slib, "_k8slib_checked", False), patch.object(
+                K8sLib, "from_environment", return_value=None
+            ), patch(
+                "qabot.env_maintenance.subprocess.run"
+            ) as run:
+                with self.assertRaises(KubernetesError):
+                    k8slib.get_k8slib()
+                em = EnvMaintenance()
+                self.assertIn("Failed to execute etl-", em.run_gen3_job("etl", "qa"))
+                self.assertIn("Failed to scaleup namespace", em.scaleup_namespace("qa"))
+                self.assertIn("Failed to roll service(s)", em.roll_service("all", "qa"))
+            run.assert_not_called()
+        finally:
+            self.patch2.start()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from qabot import manifests_checker
+from qabot.manifest_index import ManifestIndex
+from qabot.manifests_checker import ManifestsChecker
+
+
+def versions(release, fence=None):
+    return {
+        "fence": f"quay.io/cdis/fence:{fence or release}",
+        "sheepdog": f"quay.io/cdis/sheepdog:{release}",
+    }
+
+
+class ManifestIndexTestCase(unittest.TestCase):
+    """Tests for manifest_index.py"""
+
+    def test_queries_and_incremental_updates(self):
+        index = ManifestIndex()
+        index.update(
+            "sha1",
+            {
+                "gen3.theanvil.io": versions("2024.05"),
+                "gen3.datacommons.io": versions("2024.04", fence="10.1.0"),
+                "caninedc.org": {"indexd": "quay.io/cdis/indexd:2024.05"},
+            },
+        )
+        self.assertEqual(
+            ["caninedc.org", "gen3.theanvil.io"], index.envs_on_release("2024.05")
+        )
+        self.assertEqual(["gen3.datacommons.io"], index.envs_running("fence", "10.1.0"))
+
+        index.update(
+            "sha2",
+            {"gen3.datacommons.io": versions("2024.05")},
+            removed_envs=["caninedc.org"],
+        )
+        self.assertEqual("sha2", index.commit_sha)
+        self.assertEqual(
+            ["gen3.datacommons.io", "gen3.theanvil.io"],
+            index.envs_on_release("2024.05"),
+        )
+        self.assertEqual([], index.envs_running("fence", "10.1.0"))
+        self.assertEqual([], index.envs_on_release("2024.04"))
+
+    def test_index_is_persisted(self):
+        with tempfile.TemporaryDirectory() as index_dir:
+            path = os.path.join(index_dir, "cdis-manifest.json")
+            index = ManifestIndex(path)
+            index.update("sha1", {"gen3.theanvil.io": versions("2024.05")})
+            index.save()
+
+            reloaded = ManifestIndex.load(path)
+        self.assertEqual("sha1", reloaded.commit_sha)
+        self.assertEqual(
+            ["gen3.theanvil.io"], reloaded.envs_running("fence", "2024.05")
+        )
+
+    def test_only_changed_envs_are_reparsed(self):
+        manifests = {
+            "gen3.theanvil.io": versions("2024.04"),
+            "gen3.datacommons.io": versions("2024.04"),
+            "caninedc.org": versions("2024.04"),
+        }
+        fetched = []
+
+        def fetch_json(url):
+            fetched.append(url)
+            return {"versions": manifests[url.split("/")[-2]]}
+
+        httplib = Mock(name="HttpLibMock")
+        httplib.fetch_json = fetch_json
+        snapshotlib = Mock(name="SnapshotLibMock")
+        snapshotlib.get_snapshot.side_effect = Exception("no archive")
+        head = {"sha": "sha1"}
+        changes = {
+            "sha2": ({"caninedc.org", ".github"}, set()),
+            "sha3": ({"gen3.datacommons.io"}, {"gen3.datacommons.io"}),
+        }
+        with patch.object(
+            ManifestsChecker, "get_githublib", lambda self: Mock()
+        ), patch.object(
+            ManifestsChecker, "get_httplib", lambda self: httplib
+        ), patch.object(
+            ManifestsChecker, "get_snapshotlib", lambda self: snapshotlib
+        ), patch.object(
+            ManifestsChecker,
+            "_get_directories_from_repo",
+            lambda self, repo, ref=None: sorted(manifests.keys()),
+        ), patch.object(
+            ManifestsChecker, "_get_head_sha", lambda self, repo: head["sha"]
+        ), patch.object(
+            ManifestsChecker,
+            "_get_changed_directories",
+            lambda self, repo, base, head: changes[head],
+        ), patch.object(
+            manifests_checker, "MANIFEST_INDEX_REFRESH_INTERVAL", 0
+        ):
+            checker = ManifestsChecker()
+            checker.refresh_manifest_index("cdis-manifest", [".github"])
+            self.assertEqual(3, len(fetched))
+
+            # nothing changed since the last indexed commit
+            checker.refresh_manifest_index("cdis-manifest", [".github"])
+            self.assertEqual(3, len(fetched))
+
+            manifests["caninedc.org"] = versions("2024.05")
+            head["sha"] = "sha2"
+            index = checker.refresh_manifest_index("cdis-manifest", [".github"])
+
+            self.assertEqual(4, len(fetched))
+            self.assertIn("/cdis-manifest/sha2/caninedc.org/manifest.json", fetched[-1])
+            self.assertEqual(["caninedc.org"], index.envs_on_release("2024.05"))
+
+            # the compare API reports the deleted env folder, nothing is fetched
+            del manifests["gen3.datacommons.io"]
+            head["sha"] = "sha3"
+            index = checker.refresh_manifest_index("cdis-manifest", [".github"])
+
+        self.assertEqual(4, len(fetched))
+        self.assertEqual(["gen3.theanvil.io"], index.envs_on_release("2024.04"))
+        self.assertEqual(set(), index.failed_envs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -55,6 +55,10 @@ class ManifestsCheckerTestCase(unittest.TestCase):
             },
         }
 
+    @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$", path=r".*genomel.*$")
+    def broken_manifest_mock(self, url, request):
+        return {"status_code": 200, "content": {"global": {}}}
+
     @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$", path=r".*")
     def manifest_without_release_mock(self, url, request):
         return {
@@ -85,7 +89,7 @@ class ManifestsCheckerTestCase(unittest.TestCase):
             return githublibMock
 
         # mock _get_directories_from_repo function to return arbitrary list of dirs
-        def _get_directories_from_repo(self, repo, ttl_hash=None):
+        def _get_directories_from_repo(self, repo, ref=None):
             return [
                 "gen3.datacommons.io",
                 "gen3.theanvil.io",
@@ -97,8 +101,20 @@ class ManifestsCheckerTestCase(unittest.TestCase):
         self.patch2 = patch.object(
             ManifestsChecker, "_get_directories_from_repo", _get_directories_from_repo
         )
+        # mock _get_head_sha so the manifest index is built from an arbitrary commit
+        self.patch3 = patch.object(
+            ManifestsChecker, "_get_head_sha", lambda self, repo: "c0ffee"
+        )
+        # no repo archives in these tests, manifests are fetched one by one
+        snapshotlibMock = Mock(name="SnapshotLibMock")
+        snapshotlibMock.get_snapshot.side_effect = Exception("no archive")
+        self.patch4 = patch.object(
+            ManifestsChecker, "get_snapshotlib", lambda self: snapshotlibMock
+        )
         self.patch1.start()
         self.patch2.start()
+        self.patch3.start()
+        self.patch4.start()
 
         # initialize the ManifestsChecker instance
         self.manifests_checker = ManifestsChecker()
@@ -106,6 +122,8 @@ class ManifestsCheckerTestCase(unittest.TestCase):
     def tearDown(self):
         self.patch1.stop()
         self.patch2.stop()
+        self.patch3.stop()
+        self.patch4.stop()
 
     def test_compare_manifests(self):
         with HTTMock(self.pr_manifest_mock, self.signed_off_manifest_mock):
@@ -142,6 +160,21 @@ class ManifestsCheckerTestCase(unittest.TestCase):
                 "Must show list of environments running that specific fence version",
             )
 
+    def test_whereis_version_with_broken_manifest(self):
+        with HTTMock(
+            self.broken_manifest_mock,
+            self.manifest_with_release_mock,
+            self.manifest_without_release_mock,
+        ):
+            result = self.manifests_checker.whereis_version("release", "2020.02")
+            # a manifest without a versions block must not break the whole command
+            self.assertEqual(
+                "\nThe following environments are running [release:2020.02]:\n```\ngen3.theanvil.io\ninternalstaging.theanvil.io\n```\n This represents a *66.67%* adoption across *3* environments."
+                + "\n:warning: Could not read the manifest of 1 environment(s): genomel.bionimbus.org",
+                result,
+                "Must skip environments whose manifest cannot be read",
+            )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,14 +1,59 @@
 from httmock import urlmatch, HTTMock
+import threading
+import time
 import unittest
 import os
 from pprint import pprint
+from unittest.mock import patch
 
-from qabot.parse_codeowners import EnvironmentsManager
+from qabot.lib.httplib import HttpCache, HttpLib
+from qabot.parse_codeowners import (
+    EnvironmentsManager,
+    OwnershipIndex,
+    parse_codeowners,
+)
+
+GITOPS_CODEOWNERS = """# environments of the gen3-gitops repo
+* @uc-cdis/planx-qa
+.github/ @theowner @uc-cdis/planx-qa
+/docs/ @someoneelse
+gen3.theanvil.io @theowner @uc-cdis/planx-qa
+data.midrc.org @the @SomeoneElse @uc-cdis/planx-qa
+nci-crdc.datacommons.io @someoneelse @uc-cdis/planx-qa  # shared
+/gen3.datacommons.io/ @another @uc-cdis/planx-qa
+"""
 
 
 class EnvironmentsManagerTestCase(unittest.TestCase):
     """Tests for parse_codeowners.py"""
 
+    def setUp(self):
+        self.requests_seen = []
+        self.patch1 = patch.object(
+            EnvironmentsManager, "get_ownership_index", lambda self: OwnershipIndex()
+        )
+        self.patch1.start()
+        self.patch2 = patch.object(
+            EnvironmentsManager, "get_httplib", lambda self: HttpLib(cache=HttpCache())
+        )
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+
+    @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$", path=r".*CODEOWNERS$")
+    def gitops_mock(self, url, request):
+        self.requests_seen.append(request)
+        etag = f'"{url.path.split("/")[2]}-v1"'
+        if request.headers.get("If-None-Match") == etag:
+            return {"status_code": 304, "content": ""}
+        return {
+            "status_code": 200,
+            "headers": {"ETag": etag},
+            "content": GITOPS_CODEOWNERS,
+        }
+
     # Utilizing httpmock to obtain a fake dictionary that maps caninedc against a fake owner (@theowner)
     @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$", path=r".*CODEOWNERS$")
     def codeowners_mock(self, url, request):
@@ -33,6 +78,81 @@ class EnvironmentsManagerTestCase(unittest.TestCase):
                 'Must return a dictionary containing the expected owner list ["@theowner"] for the environment "caninedc.org"',
             )
 
+    def test_parse_codeowners(self):
+        self.assertEqual(
+            {
+                "gen3.theanvil.io": ["@theowner"],
+                "data.midrc.org": ["@the", "@SomeoneElse"],
+                "nci-crdc.datacommons.io": ["@someoneelse"],
+                # anchored to the root of the repo
+                "gen3.datacommons.io": ["@another"],
+            },
+            parse_codeowners(GITOPS_CODEOWNERS),
+        )
+
+    def test_handles_are_matched_exactly(self):
+        em = EnvironmentsManager()
+        with HTTMock(self.gitops_mock):
+            # "@the" is a substring of "@theowner" but does not own its environments
+            self.assertEqual(
+                ["data.midrc.org"], em.get_envs_owned("the", "gen3-gitops")
+            )
+            self.assertEqual(
+                ["gen3.theanvil.io"], em.get_envs_owned("@TheOwner", "gen3-gitops")
+            )
+            self.assertEqual(
+                ["data.midrc.org", "nci-crdc.datacommons.io"],
+                em.get_envs_owned("someoneelse", "gen3-gitops"),
+            )
+            self.assertEqual([], em.get_envs_owned("uc-cdis/planx-qa", "gen3-gitops"))
+            self.assertEqual(["@the", "@SomeoneElse"], em.get_owners("data.midrc.org"))
+
+    def test_codeowners_are_fetched_concurrently_and_revalidated_by_etag(self):
+        em = EnvironmentsManager()
+        in_flight, max_in_flight = [0], [0]
+        lock = threading.Lock()
+
+        @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$")
+        def slow_mock(url, request):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return self.gitops_mock(url, request)
+
+        with HTTMock(slow_mock):
+            em.refresh_ownership_index()
+        self.assertEqual(4, len(self.requests_seen))
+        self.assertGreater(max_in_flight[0], 1)
+
+        with HTTMock(self.gitops_mock), patch(
+            "qabot.parse_codeowners.parse_codeowners", wraps=parse_codeowners
+        ) as parse:
+            # still fresh: no request at all
+            em.get_envs_owned("theowner", "gen3-gitops-dev")
+            self.assertEqual(4, len(self.requests_seen))
+            # stale: revalidated, but not parsed again since the ETag did not change
+            em.ownership_index.ttl = 0
+            self.assertEqual(
+                ["gen3.theanvil.io"], em.get_envs_owned("theowner", "gen3-gitops-dev")
+            )
+        self.assertEqual(5, len(self.requests_seen))
+        self.assertEqual(
+            '"gen3-gitops-dev-v1"', self.requests_seen[-1].headers["If-None-Match"]
+        )
+        parse.assert_not_called()
+
+    def test_unreachable_codeowners(self):
+        @urlmatch(netloc=r"(.*\.)?raw\.githubusercontent\.com$")
+        def not_found_mock(url, request):
+            return {"status_code": 404, "content": "404: Not Found"}
+
+        em = EnvironmentsManager()
+        with HTTMock(not_found_mock):
+            self.assertEqual([], em.get_envs_owned("theowner", "gen3-gitops"))
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -1,12 +1,18 @@
-import os
+import json
+import threading
+import time
 import unittest
-from pprint import pprint
 from unittest.mock import Mock, patch
+from urllib.parse import parse_qs
 
 from httmock import HTTMock, urlmatch
 
+from qabot.ci_stats import CIStats
 from qabot.lib.influxlib import InfluxLib
+from qabot.lib.scheduler import Scheduler
+from qabot.lib.snapshot import RepoSnapshot
 from qabot.pipeline_maintenance import PipelineMaintenance
+from qabot.suite_index import SuiteIndex
 
 
 class PipelineMaintenanceTestCase(unittest.TestCase):
@@ -17,7 +23,9 @@ class PipelineMaintenanceTestCase(unittest.TestCase):
     )
     def get_test_script_source_mock(self, url, request):
         # mock JS source code containing a Feature() line
-        return """
+        return self.test_script_source
+
+    test_script_source = """
             const fetch = require('node-fetch');
 
             Feature('MockHomepage').retry(2);
@@ -27,64 +35,76 @@ class PipelineMaintenanceTestCase(unittest.TestCase):
             });
         """
 
-    mock_influx_query_results = [
-        {
-            "time": "2021-01-27T19:20:20Z",
-            "ci_environment": "jenkins-dcp",
-            "fail_count": 1.0,
-            "pr_num": "123",
-            "repo_name": "myRepo",
-            "run_time": "0.492",
-            "selenium_grid_sessions": "1",
-            "suite_name": "MockHomepage",
-            "test_name": "login_@portal",
-        },
-        {
-            "time": "2021-01-27T19:20:21Z",
-            "ci_environment": "jenkins-genomel",
-            "fail_count": 1.0,
-            "pr_num": "456",
-            "repo_name": "myOtherRepo",
-            "run_time": "0.326",
-            "selenium_grid_sessions": "1",
-            "suite_name": "MockHomepage",
-            "test_name": "login_@portal_@topBarLogin",
-        },
-        {
-            "time": "2021-01-26T12:00:00Z",
-            "ci_environment": "jenkins-brain",
-            "fail_count": 1.0,
-            "pr_num": "456",
-            "repo_name": "myOtherRepo",
-            "run_time": "0.326",
-            "selenium_grid_sessions": "1",
-            "suite_name": "MockHomepage",
-            "test_name": "login_@portal_@topBarLogin",
-        },
-    ]
-
-    def setUp(self):
-        # mock InfluxLib "query_ci_metrics" function
-        influxdb = InfluxLib()
+    # recorded response of:
+    # SELECT COUNT("fail_count") AS "count" FROM "fail_count"
+    # WHERE "suite_name" = $suite_name AND time > now() - 14d GROUP BY "repo_name", "pr_num"
+    recorded_fail_counts = {
+        "results": [
+            {
+                "statement_id": 0,
+                "series": [
+                    {
+                        "name": "fail_count",
+                        "tags": {"pr_num": "123", "repo_name": "myRepo"},
+                        "columns": ["time", "count"],
+                        "values": [["1970-01-01T00:00:00Z", 1]],
+                    },
+                    {
+                        "name": "fail_count",
+                        "tags": {"pr_num": "456", "repo_name": "myOtherRepo"},
+                        "columns": ["time", "count"],
+                        "values": [["1970-01-01T00:00:00Z", 2]],
+                    },
+                ],
+            }
+        ]
+    }
 
-        def query_ci_metrics(influxdb, measurement, tags):
-            # expect {"suite_name": "MockHomepage"}
-            if tags["suite_name"] == "MockHomepage":
-                return self.mock_influx_query_results
-            else:
-                return "could not identify the name of the feature"
+    @urlmatch(netloc=r"influxdb:8086$", path=r"/query$")
+    def influxdb_mock(self, url, request):
+        params = parse_qs(url.query)
+        self.influx_queries.append(params["q"][0])
+        if json.loads(params["params"][0]) == {"suite_name": "MockHomepage"}:
+            return {"status_code": 200, "content": self.recorded_fail_counts}
+        return {"status_code": 200, "content": {"results": [{"statement_id": 0}]}}
 
-        self.patch1 = patch.object(InfluxLib, "query_ci_metrics", query_ci_metrics)
-        self.patch1.start()
+    def get_head_sha(self, repo):
+        self.head_sha_requests.append(repo)
+        return "sha1"
 
-        # initialize the ManifestsChecker instance
+    def setUp(self):
+        self.influx_queries = []
+        self.head_sha_requests = []
+        InfluxLib().clear_cache()
+        # initialize the PipelineMaintenance instance
         self.pipeline_maintenance = PipelineMaintenance()
+        self.pipeline_maintenance.suite_index = SuiteIndex()
+        self.pipeline_maintenance.ci_stats = CIStats()
+        gen3_qa = RepoSnapshot(
+            "gen3-qa",
+            "sha1",
+            {
+                "suites/portal/mockHomepageTest.js": self.test_script_source,
+                "suites/apis/noFeatureTest.js": "Scenario('no feature', () => {});",
+            },
+        )
+        self.patch1 = patch.object(
+            self.pipeline_maintenance, "_get_head_sha", self.get_head_sha
+        )
+        self.patch1.start()
+        self.patch2 = patch.object(
+            self.pipeline_maintenance,
+            "snapshotlib",
+            Mock(get_snapshot=Mock(return_value=gen3_qa)),
+        )
+        self.patch2.start()
 
     def tearDown(self):
         self.patch1.stop()
+        self.patch2.stop()
 
     def test_failure_rate_for_test_suite(self):
-        with HTTMock(self.get_test_script_source_mock):
+        with HTTMock(self.influxdb_mock):
             result = self.pipeline_maintenance.failure_rate_for_test_suite(
                 "test-portal-mockHomepageTest"
             )
@@ -94,6 +114,146 @@ class PipelineMaintenanceTestCase(unittest.TestCase):
                 result,
                 "Must show statistics on how often the test suite failed across diff repos/PRs",
             )
+        # the failures are filtered and counted by the server in a single query
+        self.assertEqual(
+            [
+                'SELECT COUNT("fail_count") AS "count" FROM "fail_count" WHERE "suite_name" = $suite_name AND time > now() - 14d GROUP BY "repo_name", "pr_num"'
+            ],
+            self.influx_queries,
+        )
+
+        # the feature name comes from the suite index
+        self.assertEqual(["gen3-qa"], self.head_sha_requests)
+        self.pipeline_maintenance.snapshotlib.get_snapshot.assert_called_once_with(
+            "gen3-qa", "sha1", members=("suites/*/*.js",)
+        )
+
+    def test_unknown_suites_are_rejected_without_network_calls(self):
+        result = self.pipeline_maintenance.failure_rate_for_test_suite("mockHomepage")
+        self.assertIn("Invalid test suite label", result)
+        self.assertEqual([], self.head_sha_requests)
+
+        # build the index
+        self.pipeline_maintenance.lookup_test_suite("test-portal-mockHomepageTest")
+        self.assertEqual(["gen3-qa"], self.head_sha_requests)
+
+        with HTTMock(self.influxdb_mock):
+            result = self.pipeline_maintenance.failure_rate_for_test_suite(
+                "test-portal-unknownTest"
+            )
+            self.assertIn("There is no `test-portal-unknownTest` test suite", result)
+            result = self.pipeline_maintenance.failure_rate_for_test_suite(
+                "test-apis-noFeatureTest"
+            )
+            self.assertIn("suites/apis/noFeatureTest.js", result)
+        self.assertEqual(["gen3-qa"], self.head_sha_requests)
+        self.assertEqual([], self.influx_queries)
+
+    def test_feature_name_from_the_script_without_an_index(self):
+        def github_is_down(repo):
+            raise Exception("github is down")
+
+        with patch.object(
+            self.pipeline_maintenance, "_get_head_sha", github_is_down
+        ), HTTMock(self.get_test_script_source_mock, self.influxdb_mock):
+            result = self.pipeline_maintenance.failure_rate_for_test_suite(
+                "test-portal-mockHomepageTest"
+            )
+        self.assertIn("2 time(s) on PR-456 from repo myOtherRepo", result)
+
+    def test_ci_summary(self):
+        now = time.time()
+        self.pipeline_maintenance._populate_ci_stats(
+            now - 2 * 24 * 3600, "fence", "1", "failed: test-portal-homepageTest"
+        )
+        self.pipeline_maintenance._populate_ci_stats(now, "fence", "2", "all good")
+        self.pipeline_maintenance._populate_ci_stats(
+            now, "indexd", "3", "failed: test-apis-dbgapTest"
+        )
+
+        summary = self.pipeline_maintenance.get_ci_summary()
+        failed_24h = summary.split("Failed PR checks (last 24h):")[1].split(
+            "Successful"
+        )[0]
+        failed_7d = summary.split("Failed PR checks (last 7d):")[1].split("Successful")[
+            0
+        ]
+        # the failure from 2 days ago only shows up in the 7d summary
+        self.assertRegex(failed_24h, r"0\s+fence")
+        self.assertRegex(failed_24h, r"1\s+indexd")
+        self.assertRegex(failed_7d, r"1\s+fence")
+        self.assertRegex(failed_7d, r"1\s+indexd")
+
+    def test_nightly_build_followups_are_deferred_and_merged(self):
+        scheduler = Scheduler()
+        replies = []
+        replied = threading.Event()
+        fetch_ci_failures = Mock(return_value="failed: test-portal-homepageTest")
+
+        def reply(text):
+            replies.append(text)
+            replied.set()
+
+        notification = {
+            "event_ts": f"{int(time.time())}.000100",
+            "channel": "C01TS6PDMRT",
+            "attachments": [
+                {"fields": [{"value": "<https://github.com/uc-cdis/gen3-qa/pull/549>"}]}
+            ],
+        }
+        with patch(
+            "qabot.pipeline_maintenance.get_scheduler", lambda: scheduler
+        ), patch(
+            "qabot.pipeline_maintenance.NIGHTLY_BUILD_FOLLOWUP_DELAY", 0.2
+        ), patch.object(
+            # not implemented yet, which is why the Slack handler is not wired
+            self.pipeline_maintenance,
+            "fetch_ci_failures",
+            fetch_ci_failures,
+            create=True,
+        ), patch.object(
+            self.pipeline_maintenance,
+            "ci_benchmarking",
+            lambda repo, pr, stage: f"{stage} took 1 min\n",
+            create=True,
+        ):
+            started_at = time.monotonic()
+            self.pipeline_maintenance.react_to_jenkins_updates(notification, reply)
+            self.pipeline_maintenance.react_to_jenkins_updates(notification, reply)
+            # nothing blocks while waiting for the post-RunTests stages
+            self.assertLess(time.monotonic() - started_at, 0.2)
+            self.assertTrue(replied.wait(5))
+
+        fetch_ci_failures.assert_called_once_with("gen3-qa", "549")
+        self.assertEqual(1, len(replies))
+        self.assertIn("Additional nightly-build stats :moon:", replies[0])
+        self.assertIn("RunTests took 1 min", replies[0])
+        self.assertEqual(
+            {"gen3-qa": {"failed": 1, "successful": 0}},
+            self.pipeline_maintenance.ci_stats.repo_totals(24),
+        )
+
+    def test_quarantine_through_the_kubernetes_api(self):
+        k8slib = Mock(name="K8sLibMock")
+        with patch.object(
+            self.pipeline_maintenance, "get_k8slib", return_value=k8slib
+        ), patch("qabot.pipeline_maintenance.subprocess.run") as run:
+            self.assertIn(
+                "placed under quarantine",
+                self.pipeline_maintenance.quarantine_ci_env("jenkins-brain"),
+            )
+            self.assertIn(
+                "removed from quarantine",
+                self.pipeline_maintenance.unquarantine_ci_env("jenkins-brain"),
+            )
+        run.assert_not_called()
+        self.assertEqual(
+            [
+                (("jenkins-brain", {"quarantine": "true"}),),
+                (("jenkins-brain", {"quarantine": None, "teardown": "true"}),),
+            ],
+            [(c.args,) for c in k8slib.label_namespace.call_args_list],
+        )
 
 
 if __name__ == "__main__":
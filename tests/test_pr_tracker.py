@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+
+from qabot.pr_tracker import PRTracker
+
+
+def pr(number, state="open", merged_at=None, env_folder="env.org", updated_at="t1"):
+    return {
+        "number": number,
+        "state": state,
+        "merged_at": merged_at,
+        "title": f"PR {number}",
+        "html_url": f"https://github.com/uc-cdis/cdis-manifest/pull/{number}",
+        "head": {"sha": f"sha{number}"},
+        "updated_at": updated_at,
+        "env_folder": env_folder,
+    }
+
+
+class PRTrackerTestCase(unittest.TestCase):
+    """Tests for pr_tracker.py"""
+
+    def test_upsert_replaces_prs(self):
+        tracker = PRTracker()
+        tracker.upsert("cdis-manifest", [pr(1), pr(2)])
+        tracker.upsert(
+            "cdis-manifest", [pr(1, "closed", "2024-05-03", updated_at="t2")]
+        )
+
+        self.assertEqual(2, tracker.count("cdis-manifest"))
+        self.assertEqual(
+            "2024-05-03", tracker.get("cdis-manifest", [1])[1]["merged_at"]
+        )
+        self.assertEqual({}, tracker.get("gitops-qa", [1]))
+
+    def test_old_prs_are_pruned(self):
+        tracker = PRTracker(max_prs=3)
+        tracker.upsert("cdis-manifest", [pr(n) for n in range(1, 6)])
+        tracker.upsert("gitops-qa", [pr(1)])
+        tracker.upsert("cdis-manifest", [pr(2, "closed", "2024-05-03")])
+
+        self.assertEqual(3, tracker.count("cdis-manifest"))
+        self.assertEqual(
+            [5, 4, 3],
+            [p["number"] for p in tracker.pull_requests("cdis-manifest", limit=10)],
+        )
+        self.assertEqual(1, tracker.count("gitops-qa"))
+
+    def test_pull_requests_query(self):
+        tracker = PRTracker()
+        tracker.upsert(
+            "cdis-manifest",
+            [
+                pr(1, "closed", "2024-05-01"),
+                pr(2, "closed", None),  # abandoned
+                pr(3, env_folder="other.org"),
+                pr(4),
+                pr(5),
+            ],
+        )
+
+        self.assertEqual(
+            [5, 4, 1],
+            [
+                p["number"]
+                for p in tracker.pull_requests(
+                    "cdis-manifest", "all", env_folders=["env.org"]
+                )
+            ],
+        )
+        self.assertEqual(
+            [1], [p["number"] for p in tracker.pull_requests("cdis-manifest", "closed")]
+        )
+        # the window is applied before leaving out abandoned PRs and other envs
+        self.assertEqual(
+            [5, 4],
+            [
+                p["number"]
+                for p in tracker.pull_requests(
+                    "cdis-manifest", "all", limit=3, env_folders=["env.org"]
+                )
+            ],
+        )
+
+    def test_store_is_persisted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trackers", "prs.db")
+            tracker = PRTracker(path)
+            tracker.upsert("cdis-manifest", [pr(1)])
+            tracker.set_cursor("cdis-manifest", "2024-05-02T10:00:00Z")
+
+            reloaded = PRTracker(path)
+            self.assertEqual(1, reloaded.count())
+            self.assertEqual(
+                "2024-05-02T10:00:00Z", reloaded.get_cursor("cdis-manifest")
+            )
+            self.assertIsNone(reloaded.get_cursor("gitops-qa"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+from qabot.parse_codeowners import EnvironmentsManager, OwnershipIndex
+from qabot.release import ReleaseManager, clear_latest_release_cache
+
+ENVS_OWNED = {
+    "gen3-gitops-dev": ["qa.planx-pla.net"],
+    "gen3-gitops": ["gen3.theanvil.io", "data.midrc.org"],
+}
+
+
+class ReleaseManagerTestCase(unittest.TestCase):
+    """Tests for release.py"""
+
+    def setUp(self):
+        clear_latest_release_cache()
+        self.githublib = Mock(name="GithubLibMock")
+        self.githublib.get_head_sha.return_value = "sha1"
+        self.githublib.list_files_in_dir.side_effect = lambda dir, ref=None: (
+            ["2023", "2024"] if dir == "releases" else ["01", "02", "03"]
+        )
+        self.githublib.trigger_gh_action_workflow.return_value = Mock(status_code=204)
+        self.em = Mock(name="EnvironmentsManagerMock")
+        self.em.get_envs_owned.side_effect = lambda user, repo: list(ENVS_OWNED[repo])
+        self.patch1 = patch.object(
+            ReleaseManager, "get_githublib", lambda self_: self.githublib
+        )
+        self.patch1.start()
+        self.patch2 = patch.object(
+            ReleaseManager, "get_environments_manager", lambda self_: self.em
+        )
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+        clear_latest_release_cache()
+
+    def test_latest_release_is_cached(self):
+        rm = ReleaseManager()
+        self.assertEqual("2024.03", rm.find_latest_release())
+        self.assertEqual(2, self.githublib.list_files_in_dir.call_count)
+        self.githublib.list_files_in_dir.assert_called_with("releases/2024", ref="sha1")
+
+        # same commit: the releases are not listed again
+        self.assertEqual("2024.03", rm.find_latest_release())
+        self.assertEqual(2, self.githublib.get_head_sha.call_count)
+        self.assertEqual(2, self.githublib.list_files_in_dir.call_count)
+
+        # a release published right after the previous lookup is picked up right away
+        self.githublib.get_head_sha.return_value = "sha2"
+        self.githublib.list_files_in_dir.side_effect = lambda dir, ref=None: (
+            ["2023", "2024"] if dir == "releases" else ["01", "02", "03", "04"]
+        )
+        self.assertEqual("2024.04", rm.find_latest_release())
+        self.assertEqual(4, self.githublib.list_files_in_dir.call_count)
+        self.githublib.list_files_in_dir.assert_called_with("releases/2024", ref="sha2")
+
+    def test_repos_are_rolled_out_concurrently(self):
+        in_flight, max_in_flight = [0], [0]
+        lock = threading.Lock()
+
+        def dispatch(**kwargs):
+            with lock:
+                in_flight[0] += 1
+                max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            return Mock(status_code=204)
+
+        self.githublib.trigger_gh_action_workflow.side_effect = dispatch
+        response = ReleaseManager().roll_out_latest_gen3_release_to_environments(
+            "theowner", "123.456"
+        )
+
+        self.assertEqual(2, max_in_flight[0])
+        inputs = {
+            c.kwargs["inputs"]["TARGET_REPO_NAME"]: c.kwargs["inputs"]
+            for c in self.githublib.trigger_gh_action_workflow.call_args_list
+        }
+        self.assertEqual(
+            "gen3.theanvil.io,data.midrc.org",
+            inputs["gen3-gitops"]["LIST_OF_ENVIRONMENTS"],
+        )
+        self.assertEqual("2024.03", inputs["gen3-gitops-dev"]["RELEASE_VERSION"])
+        self.assertIn(
+            "https://github.com/uc-cdis/gen3-gitops-dev/pulls, https://github.com/uc-cdis/gen3-gitops/pulls",
+            response,
+        )
+        for step in ("latest release", "gen3-gitops ownership", "gen3-gitops dispatch"):
+            self.assertIn(step, response)
+
+    def test_no_environments_owned(self):
+        self.em.get_envs_owned.side_effect = lambda user, repo: []
+        response = ReleaseManager().roll_out_latest_gen3_release_to_environments(
+            "nobody", "123.456"
+        )
+        self.assertIn("could not find any environments owned", response)
+        self.githublib.trigger_gh_action_workflow.assert_not_called()
+
+    def test_failed_dispatch(self):
+        self.githublib.trigger_gh_action_workflow.return_value = Mock(
+            status_code=422, text="nope"
+        )
+        with self.assertRaisesRegex(Exception, "422"):
+            ReleaseManager().roll_out_latest_gen3_release_to_environments(
+                "theowner", "123.456"
+            )
+
+    def batch_environments_manager(self):
+        index = OwnershipIndex(ttl=3600)
+        index.update(
+            "gen3-gitops-dev",
+            "qa.planx-pla.net @theowner @uc-cdis/planx-qa\n"
+            "preprod.gen3.io @someoneelse @uc-cdis/planx-qa\n",
+        )
+        index.update(
+            "gen3-gitops",
+            "* @uc-cdis/planx-qa\n"
+            ".github/ @theowner @uc-cdis/planx-qa\n"
+            "gen3.theanvil.io @theowner @uc-cdis/planx-qa\n"
+            "data.midrc.org @theowner @someoneelse @uc-cdis/planx-qa\n"
+            "nci-crdc.datacommons.io @another @uc-cdis/planx-qa\n"
+            "/docs/ @another\n"
+            "/gen3.datacommons.io/ @another @uc-cdis/planx-qa\n",
+        )
+        em = EnvironmentsManager.__new__(EnvironmentsManager)
+        em.ownership_index = index
+        em.httplib = em.snapshotlib = Mock()
+        return em
+
+    def test_batch_release_dispatches_once_per_repo(self):
+        self.em = self.batch_environments_manager()
+        response = ReleaseManager().roll_out_latest_gen3_release_to_environments(
+            "theowner,someoneelse,ghost", "123.456"
+        )
+
+        # CODEOWNERS is not fetched again while the index is fresh
+        self.em.httplib.fetch_raw_data_with_etag.assert_not_called()
+        self.assertEqual(2, self.githublib.trigger_gh_action_workflow.call_count)
+        inputs = {
+            c.kwargs["inputs"]["TARGET_REPO_NAME"]: c.kwargs["inputs"]
+            for c in self.githublib.trigger_gh_action_workflow.call_args_list
+        }
+        self.assertEqual(
+            "qa.planx-pla.net,preprod.gen3.io",
+            inputs["gen3-gitops-dev"]["LIST_OF_ENVIRONMENTS"],
+        )
+        # co-owned environments are only listed once
+        self.assertEqual(
+            "gen3.theanvil.io,data.midrc.org",
+            inputs["gen3-gitops"]["LIST_OF_ENVIRONMENTS"],
+        )
+        self.assertEqual(
+            "theowner,someoneelse,ghost", inputs["gen3-gitops"]["TRIGGERED_BY_USER"]
+        )
+        self.assertIn("rolled out to 4 environments", response)
+        self.assertIn("No environments owned by ghost", response)
+
+    def test_batch_release_to_all(self):
+        self.em = self.batch_environments_manager()
+        response = ReleaseManager().roll_out_latest_gen3_release_to_owners(
+            "all", "123.456"
+        )
+
+        inputs = [
+            c.kwargs["inputs"]
+            for c in self.githublib.trigger_gh_action_workflow.call_args_list
+        ]
+        self.assertEqual(2, len(inputs))
+        self.assertEqual(
+            {
+                "qa.planx-pla.net,preprod.gen3.io",
+                "gen3.theanvil.io,data.midrc.org,nci-crdc.datacommons.io,gen3.datacommons.io",
+            },
+            {i["LIST_OF_ENVIRONMENTS"] for i in inputs},
+        )
+        self.assertIn("rolled out to 6 environments", response)
+
+
+if __name__ == "__main__":
+    unittest.main()
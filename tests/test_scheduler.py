@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from qabot.lib.scheduler import Scheduler
+
+
+class SchedulerTestCase(unittest.TestCase):
+    """Tests for scheduler.py"""
+
+    def setUp(self):
+        self.scheduler = Scheduler(max_workers=2)
+
+    def test_tasks_run_in_order_of_their_deadline(self):
+        ran = []
+        done = threading.Event()
+        self.scheduler.call_later(0.1, lambda: (ran.append("late"), done.set()))
+        self.scheduler.call_later(0.01, lambda: ran.append("early"))
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual(["early", "late"], ran)
+
+    def test_calls_do_not_block(self):
+        started_at = time.monotonic()
+        for i in range(100):
+            self.scheduler.call_later(60, lambda: None)
+        self.assertLess(time.monotonic() - started_at, 1)
+        self.assertEqual(100, self.scheduler.pending())
+
+    def test_tasks_with_the_same_key_are_merged(self):
+        ran = []
+        done = threading.Event()
+        self.assertTrue(
+            self.scheduler.call_later(
+                0.05, lambda: (ran.append(1), done.set()), key="fence#1"
+            )
+        )
+        self.assertFalse(
+            self.scheduler.call_later(0.05, lambda: ran.append(2), key="fence#1")
+        )
+        self.assertEqual(1, self.scheduler.pending("fence#1"))
+
+        self.assertTrue(done.wait(5))
+        self.assertEqual([1], ran)
+        # once the task ran, the key can be scheduled again
+        self.assertTrue(self.scheduler.call_later(0, lambda: None, key="fence#1"))
+
+    def test_failing_tasks_do_not_stop_the_scheduler(self):
+        done = threading.Event()
+        self.scheduler.call_later(0, lambda: 1 / 0)
+        self.scheduler.call_later(0.05, done.set)
+        self.assertTrue(done.wait(5))
+
+
+if __name__ == "__main__":
+    unittest.main()
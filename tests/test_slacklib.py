@@ -0,0 +1,114 @@
+import unittest
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs, urlparse
+
+from httmock import HTTMock, urlmatch
+
+from qabot.lib import slacklib
+from qabot.lib.slacklib import SlackAPIError, SlackLib, SlackUserDirectory
+
+
+def member(user_id, real_name, display_name, updated=1, deleted=False):
+    return {
+        "id": user_id,
+        "deleted": deleted,
+        "updated": updated,
+        "profile": {"real_name": real_name, "display_name": display_name},
+    }
+
+
+class SlackLibTestCase(unittest.TestCase):
+    """Tests for slacklib.py"""
+
+    def setUp(self):
+        self.members = [
+            member("U1", "Andrew Prokhorenkov", "andrew"),
+            member("U2", "Pauline Ribeyre", "pauline"),
+            member("U3", "Atharva Rane", "atharva"),
+            member("U4", "Atharva Rane", "old-atharva", deleted=True),
+        ]
+        self.requests = []
+        self.directory = SlackUserDirectory(
+            "https://slack.example/api", "xoxb-token", scheduler=Mock()
+        )
+        self.patch1 = patch.object(slacklib, "SLACK_USERS_PAGE_SIZE", 3)
+        self.patch1.start()
+        self.patch2 = patch.object(
+            SlackLib, "get_user_directory", Mock(return_value=self.directory)
+        )
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+
+    def slack_mock(self, ok=True):
+        @urlmatch(netloc="slack.example", path="/api/users.list")
+        def users_list(url, request):
+            self.requests.append(request)
+            if not ok:
+                return {"status_code": 200, "content": {"ok": False, "error": "boom"}}
+            params = parse_qs(urlparse(request.url).query)
+            start = int(params.get("cursor", ["0"])[0])
+            limit = int(params["limit"][0])
+            next_cursor = (
+                str(start + limit) if start + limit < len(self.members) else ""
+            )
+            return {
+                "status_code": 200,
+                "content": {
+                    "ok": True,
+                    "members": self.members[start : start + limit],
+                    "response_metadata": {"next_cursor": next_cursor},
+                },
+            }
+
+        return HTTMock(users_list)
+
+    def test_follows_the_cursor_and_sends_the_token_in_a_header(self):
+        with self.slack_mock():
+            self.directory.refresh()
+        self.assertEqual(2, len(self.requests))
+        for request in self.requests:
+            self.assertEqual("Bearer xoxb-token", request.headers["Authorization"])
+            self.assertNotIn("token", request.url)
+        # the last member is on the second page
+        self.assertEqual(4, len(self.directory))
+
+    def test_lookups_come_from_memory(self):
+        with self.slack_mock():
+            self.directory.refresh()
+            self.requests.clear()
+            sl = SlackLib()
+            self.assertEqual("U1", sl.get_user_info("Andrew Prokhorenkov")["id"])
+            # deleted members do not shadow active ones
+            self.assertEqual("U3", sl.get_user_info("Atharva Rane")["id"])
+            self.assertEqual("U2", sl.get_user_info_by_display_name("pauline")["id"])
+            self.assertEqual("U4", sl.get_user_info_by_id("U4")["id"])
+            self.assertIsNone(sl.get_user_info("Nobody"))
+        self.assertEqual([], self.requests)
+
+    def test_refresh_only_reindexes_updated_members(self):
+        with self.slack_mock():
+            self.directory.refresh()
+            self.members[1] = member("U2", "Pauline R.", "pauline", updated=2)
+            self.members.pop(0)
+            with patch.object(
+                self.directory, "_remove", wraps=self.directory._remove
+            ) as remove:
+                self.directory.refresh()
+        # U2 was updated, U1 is gone, U3 and U4 were left alone
+        self.assertEqual(["U2", "U1"], [c.args[0] for c in remove.call_args_list])
+        sl = SlackLib()
+        self.assertIsNone(sl.get_user_info("Pauline Ribeyre"))
+        self.assertEqual("U2", sl.get_user_info("Pauline R.")["id"])
+        self.assertIsNone(sl.get_user_info_by_id("U1"))
+
+    def test_api_errors_are_raised(self):
+        with self.slack_mock(ok=False):
+            with self.assertRaises(SlackAPIError):
+                self.directory.refresh()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import io
+import json
+import tarfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+
+from qabot.lib.snapshot import SnapshotLib, clear_snapshots
+from qabot.manifests_checker import ManifestsChecker
+from qabot.parse_codeowners import EnvironmentsManager
+
+
+def build_archive(repo, sha, files):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for path, content in files.items():
+            data = content.encode()
+            member = tarfile.TarInfo(f"{repo}-{sha}/{path}")
+            member.size = len(data)
+            archive.addfile(member, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+ARCHIVE = build_archive(
+    "test-manifests",
+    "abc123",
+    {
+        "CODEOWNERS": "gen3.theanvil.io @theowner @uc-cdis/planx-qa\n",
+        "README.md": "# manifests",
+        "gen3.theanvil.io/manifest.json": json.dumps(
+            {"versions": {"sheepdog": "quay.io/cdis/sheepdog:2024.05"}}
+        ),
+        "gen3.theanvil.io/portal/gitops.json": "{}",
+        "caninedc.org/manifest.json": json.dumps(
+            {"versions": {"indexd": "quay.io/cdis/indexd:2024.04"}}
+        ),
+        "releases/2024/05/manifest.json": "{}",
+    },
+)
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    requests_seen = []
+
+    def do_GET(self):
+        self.requests_seen.append(self.path)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-gzip")
+        self.send_header("Content-Length", str(len(ARCHIVE)))
+        self.end_headers()
+        self.wfile.write(ARCHIVE)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SnapshotLibTestCase(unittest.TestCase):
+    """Tests for snapshot.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        clear_snapshots()
+        ArchiveHandler.requests_seen.clear()
+        self.snapshotlib = SnapshotLib(base_url=self.base_url)
+
+    def tearDown(self):
+        clear_snapshots()
+
+    def test_only_manifests_and_codeowners_are_extracted(self):
+        snapshot = self.snapshotlib.get_snapshot("test-manifests", "abc123")
+        self.assertEqual(
+            [
+                "CODEOWNERS",
+                "caninedc.org/manifest.json",
+                "gen3.theanvil.io/manifest.json",
+            ],
+            sorted(snapshot.files.keys()),
+        )
+        self.assertEqual(["caninedc.org", "gen3.theanvil.io"], snapshot.env_folders())
+        self.assertEqual(
+            "quay.io/cdis/indexd:2024.04",
+            snapshot.manifest("caninedc.org")["versions"]["indexd"],
+        )
+
+        # the archive is downloaded once per commit
+        self.snapshotlib.get_snapshot("test-manifests", "abc123")
+        self.assertEqual(
+            ["/uc-cdis/test-manifests/tar.gz/abc123"], ArchiveHandler.requests_seen
+        )
+
+    def test_modules_read_from_the_snapshot(self):
+        snapshotlib = self.snapshotlib
+        with patch.object(
+            ManifestsChecker, "get_githublib", lambda self: Mock()
+        ), patch.object(
+            ManifestsChecker, "get_snapshotlib", lambda self: snapshotlib
+        ), patch.object(
+            ManifestsChecker, "_get_head_sha", lambda self, repo: "abc123"
+        ):
+            checker = ManifestsChecker()
+            index = checker.refresh_manifest_index("test-manifests")
+
+        self.assertEqual(["gen3.theanvil.io"], index.envs_on_release("2024.05"))
+        self.assertEqual(["caninedc.org"], index.envs_on_release("2024.04"))
+
+        # the CODEOWNERS file comes from the snapshot that is already in memory
+        em = EnvironmentsManager()
+        em.httplib = Mock(name="HttpLibMock")
+        self.assertEqual(
+            ["gen3.theanvil.io"], em.get_envs_owned("@theowner", "test-manifests")
+        )
+        em.httplib.fetch_raw_data.assert_not_called()
+        self.assertEqual(1, len(ArchiveHandler.requests_seen))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import unittest
+from unittest.mock import patch
+
+from httmock import HTTMock, urlmatch
+
+from qabot.lib import githublib
+from qabot.pr_tracker import PRTracker
+from qabot.state_of_the_nation import StateOfTheNation
+
+
+class StateOfTheNationTestCase(unittest.TestCase):
+    """Tests for state_of_the_nation.py"""
+
+    pull_requests = [
+        {
+            "number": 101,
+            "state": "open",
+            "merged_at": None,
+            "updated_at": "2024-05-02T10:00:00Z",
+            "head": {"sha": "aaa"},
+            "html_url": "https://github.com/uc-cdis/cdis-manifest/pull/101",
+            "title": "Release 2024.05 on acct.bionimbus.org",
+        },
+        {
+            "number": 102,
+            "state": "closed",
+            "merged_at": None,
+            "updated_at": "2024-05-01T10:00:00Z",
+            "head": {"sha": "bbb"},
+            "html_url": "https://github.com/uc-cdis/cdis-manifest/pull/102",
+            "title": "Abandoned PR",
+        },
+        {
+            "number": 103,
+            "state": "open",
+            "merged_at": None,
+            "updated_at": "2024-05-01T09:00:00Z",
+            "head": {"sha": "ccc"},
+            "html_url": "https://github.com/uc-cdis/cdis-manifest/pull/103",
+            "title": "Update gen3.theanvil.io",
+        },
+    ]
+
+    def setUp(self):
+        self.files_requests = []
+        self.pulls_requests = []
+        self.tracker = PRTracker()
+        self.patch3 = patch.object(
+            StateOfTheNation, "get_pr_tracker", lambda self_: self.tracker
+        )
+        self.patch3.start()
+        self.patch1 = patch.object(
+            StateOfTheNation, "_get_repo_snapshot", lambda self, repo: None
+        )
+        self.patch1.start()
+        self.patch2 = patch.object(githublib, "GITHUB_BACKEND", "rest")
+        self.patch2.start()
+
+    def tearDown(self):
+        self.patch1.stop()
+        self.patch2.stop()
+        self.patch3.stop()
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r".*/cdis-manifest/pulls$")
+    def pulls_mock(self, url, request):
+        self.pulls_requests.append(url.query)
+        return {"status_code": 200, "content": self.pull_requests}
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r".*/pulls/\d+/files$")
+    def pr_files_mock(self, url, request):
+        pr_number = int(url.path.split("/")[-2])
+        self.files_requests.append(pr_number)
+        env = {101: "acct.bionimbus.org", 102: "qa-acct", 103: "gen3.theanvil.io"}
+        return {
+            "status_code": 200,
+            "content": [{"filename": f"{env[pr_number]}/manifest.json"}],
+        }
+
+    @urlmatch(netloc=r"raw\.githubusercontent\.com$", path=r".*manifest.json$")
+    def manifest_mock(self, url, request):
+        return {
+            "status_code": 200,
+            "content": {
+                "versions": {
+                    "fence": "quay.io/cdis/fence:2024.05",
+                    "revproxy": "quay.io/cdis/nginx:1.17.6-ctds-1.0.1",
+                }
+            },
+        }
+
+    def test_state_of_the_nation_report(self):
+        sotn = StateOfTheNation()
+        with HTTMock(self.pulls_mock, self.pr_files_mock, self.manifest_mock):
+            result = sotn.run_state_of_the_nation_report("account", "all")
+
+        self.assertIn(":point_right: acct.bionimbus.org:", result)
+        self.assertIn("### Release 2024.05 on acct.bionimbus.org", result)
+        self.assertNotIn("Update gen3.theanvil.io", result)
+        # the files of the abandoned PR are never fetched
+        self.assertEqual([101, 103], sorted(self.files_requests))
+
+    def test_unchanged_prs_are_not_fetched_again(self):
+        with HTTMock(self.pulls_mock, self.pr_files_mock, self.manifest_mock):
+            StateOfTheNation().run_state_of_the_nation_report("account", "all")
+            StateOfTheNation().run_state_of_the_nation_report("account", "all")
+        self.assertEqual([101, 103], sorted(self.files_requests))
+
+    @urlmatch(netloc=r"api\.github\.com$", path=r"/graphql$", method="POST")
+    def graphql_mock(self, url, request):
+        self.graphql_requests += 1
+        nodes = [
+            {
+                "number": pr["number"],
+                "title": pr["title"],
+                "url": pr["html_url"],
+                "state": "OPEN" if pr["state"] == "open" else "CLOSED",
+                "mergedAt": pr["merged_at"],
+                "updatedAt": pr["updated_at"],
+                "headRefOid": pr["head"]["sha"],
+                "mergeable": "MERGEABLE",
+                "labels": {"nodes": []},
+                "files": {"nodes": [{"path": f"{env}/manifest.json"}]},
+            }
+            for pr, env in zip(
+                self.pull_requests,
+                ["acct.bionimbus.org", "qa-acct", "gen3.theanvil.io"],
+            )
+        ]
+        return {
+            "status_code": 200,
+            "content": {
+                "data": {
+                    "repository": {
+                        "pullRequests": {
+                            "pageInfo": {"hasNextPage": False, "endCursor": None},
+                            "nodes": nodes,
+                        }
+                    },
+                    "rateLimit": {"cost": 1, "remaining": 4999},
+                }
+            },
+        }
+
+    def test_state_of_the_nation_report_with_graphql(self):
+        self.graphql_requests = 0
+        with patch.object(githublib, "GITHUB_BACKEND", "graphql"), HTTMock(
+            self.graphql_mock, self.pr_files_mock, self.manifest_mock
+        ):
+            result = StateOfTheNation().run_state_of_the_nation_report("account", "all")
+
+        self.assertIn("### Release 2024.05 on acct.bionimbus.org", result)
+        self.assertNotIn("Abandoned PR", result)
+        # PRs and their files come back from a single query
+        self.assertEqual(1, self.graphql_requests)
+        self.assertEqual([], self.files_requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
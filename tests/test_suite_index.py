@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from qabot.suite_index import SuiteIndex, get_feature_name, get_suite_label
+
+
+class SuiteIndexTestCase(unittest.TestCase):
+    """Tests for suite_index.py"""
+
+    files = {
+        "suites/portal/homepageTest.js": "Feature('Home page').retry(2);",
+        "suites/apis/dbgapTest.js": "Feature('dbgap');",
+        "suites/apis/utils/helper.js": "module.exports = {};",
+    }
+
+    def test_labels_and_feature_names(self):
+        self.assertEqual(
+            "test-portal-homepageTest", get_suite_label("suites/portal/homepageTest.js")
+        )
+        self.assertEqual(
+            "Home_page", get_feature_name(self.files["suites/portal/homepageTest.js"])
+        )
+        self.assertIsNone(get_feature_name("Scenario('no feature', () => {});"))
+
+    def test_rebuild_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "suites.json")
+            index = SuiteIndex(path)
+            index.rebuild("sha1", self.files)
+            index.save()
+
+            reloaded = SuiteIndex.load(path)
+            self.assertEqual("sha1", reloaded.commit_sha)
+            self.assertEqual(
+                {"script": "suites/apis/dbgapTest.js", "feature": "dbgap"},
+                reloaded.lookup("test-apis-dbgapTest"),
+            )
+            # helpers in nested folders are not suites
+            self.assertEqual(2, len(reloaded.suites))
+            self.assertIsNone(reloaded.lookup("test-apis-unknownTest"))
+
+
+if __name__ == "__main__":
+    unittest.main()
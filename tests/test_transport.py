@@ -0,0 +1,74 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from qabot.lib import transport
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """Fails the first request of every path with a 503, then succeeds"""
+
+    seen_paths = set()
+
+    def do_GET(self):
+        if self.path not in self.seen_paths:
+            self.seen_paths.add(self.path)
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = b'{"versions": {}}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TransportTestCase(unittest.TestCase):
+    """Tests for transport.py"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_get_is_retried_on_5xx(self):
+        response = transport.get(f"{self.base_url}/manifest.json")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"versions": {}}, response.json())
+
+    def test_post_is_not_retried(self):
+        response = transport.post(f"{self.base_url}/dispatches")
+        self.assertEqual(503, response.status_code)
+
+    def test_session_is_shared(self):
+        self.assertIs(transport.get_session(), transport.get_session())
+
+    def test_per_upstream_timeouts(self):
+        self.assertEqual(
+            transport.UPSTREAM_TIMEOUTS["api.github.com"],
+            transport.get_timeout("https://api.github.com/repos/uc-cdis/qa-bot"),
+        )
+        self.assertEqual(
+            transport.DEFAULT_TIMEOUT,
+            transport.get_timeout(f"{self.base_url}/manifest.json"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from qabot.lib.waiter import ResourceWaiter
+
+
+class ResourceWaiterTestCase(unittest.TestCase):
+    """Tests for waiter.py"""
+
+    def setUp(self):
+        self.waiter = ResourceWaiter(initial_delay=0.01, max_delay=0.05, jitter=0.1)
+
+    def test_concurrent_waiters_share_polls(self):
+        polls = []
+        state = {"prs": []}
+
+        def poll():
+            polls.append(1)
+            # the PRs show up after a few polls
+            if len(polls) == 3:
+                state["prs"] = ["fence-123", "guppy-456"]
+            return list(state["prs"])
+
+        found = {}
+        done = threading.Semaphore(0)
+
+        def waiter_for(title):
+            def match(prs):
+                return next((pr for pr in prs if title in pr), None)
+
+            def on_found(pr):
+                found[title] = pr
+                done.release()
+
+            return match, on_found
+
+        for title in ["123", "456"]:
+            match, on_found = waiter_for(title)
+            self.waiter.wait_for(
+                "gen3-repos", poll, match, on_found, done.release, deadline=5
+            )
+
+        self.assertTrue(done.acquire(timeout=5))
+        self.assertTrue(done.acquire(timeout=5))
+        self.assertEqual({"123": "fence-123", "456": "guppy-456"}, found)
+        # both waiters were served by the same polls
+        self.assertEqual(3, len(polls))
+        self.assertEqual(0, self.waiter.pending())
+
+    def test_deadline(self):
+        timed_out = threading.Event()
+        self.waiter.wait_for(
+            "nothing",
+            lambda: [],
+            lambda prs: None,
+            lambda pr: self.fail("nothing should be found"),
+            timed_out.set,
+            deadline=0.1,
+        )
+        self.assertTrue(timed_out.wait(5))
+
+    def test_failing_polls_are_retried(self):
+        attempts = []
+
+        def poll():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionError("github is down")
+            return ["fence-123"]
+
+        found = threading.Event()
+        self.waiter.wait_for(
+            "flaky",
+            poll,
+            lambda prs: prs[0],
+            lambda pr: found.set(),
+            lambda: None,
+            deadline=5,
+        )
+        self.assertTrue(found.wait(5))
+        self.assertEqual(3, len(attempts))
+
+
+if __name__ == "__main__":
+    unittest.main()